@@ -8,6 +8,8 @@ from llama_index.core import VectorStoreIndex
 from llama_index.core.retrievers import BaseRetriever
 from llama_index.core.vector_stores import MetadataFilter, MetadataFilters, FilterOperator
 
+from dense_retriever import build_retriever
+
 _WS = re.compile(r"\s+")
 _TRANSLATE = str.maketrans({
     "\u2018": "'",
@@ -21,6 +23,7 @@ _TRANSLATE = str.maketrans({
 })
 _ZERO_WIDTH = dict.fromkeys(map(ord, ["\u200B", "\u200C", "\u200D", "\u2060"]), None)
 _CONTROL_CHARS = dict.fromkeys(range(0x00, 0x20), None)
+_POSSIBLE_META_IDS = ("doc_id", "from_doc_id", "document_id", "source_id")
 
 
 class Reference(TypedDict):
@@ -61,6 +64,31 @@ def _node_text(n: Any) -> str:
     return getattr(n, "get_text", lambda: "")() or ""
 
 
+def _node_identity(n: Any) -> str:
+    """Key for de-duplication while preserving order."""
+    node = getattr(n, "node", n)
+    return str(
+        getattr(node, "id_", None) or
+        getattr(node, "node_id", None) or
+        id(node)
+    )
+
+
+def _collect_ids(node) -> List[str]:
+    meta = getattr(node, "metadata", {}) or {}
+    ids = [str(meta[k]) for k in _POSSIBLE_META_IDS if meta.get(k)]
+    chunk_id = getattr(node, "id_", None) or getattr(node, "node_id", None)
+    if chunk_id:
+        ids.append(str(chunk_id))
+    # bevar rekkefølge og fjern duplikater
+    return list(dict.fromkeys(ids))
+
+
+def _preferred_display_id(node) -> str:
+    ids = _collect_ids(node)
+    return ids[0] if ids else "unknown"
+
+
 def _build_related_queries_retriever(
     index_qa_bank: VectorStoreIndex,
     *,
@@ -90,7 +118,8 @@ def _build_related_queries_retriever(
         )
 
     composite = MetadataFilters(filters=filters_list, condition="and")
-    return index_qa_bank.as_retriever(
+    return build_retriever(
+        index_qa_bank,
         similarity_top_k=top_k,
         similarity_cutoff=cutoff,
         filters=composite,
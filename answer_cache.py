@@ -0,0 +1,200 @@
+# answer_cache.py
+"""Semantic cache of final, verified answers.
+
+Many questions are paraphrases of the same few hundred topics. Once
+``embed_queries`` has embedded the refined query, ``SemanticAnswerCache``
+looks for a stored answer:
+
+  * in the same bucket — (index name, index version, query_severity, stance,
+    requested response_style, asker_gender: the GROUNDED answer is tailored
+    to it), and
+  * whose refined-query embedding has cosine similarity >= ANSWER_CACHE_MIN_SIM.
+
+A hit replays the stored answer, short answer and references through the
+normal emit node, so the client sees the usual SSE events.
+
+Red severity and harm/prejudice stances never read or write the cache.
+Each index gets a version when it is (re)loaded (``register_index``), and
+reloading drops every entry built on the old version.
+"""
+
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import register_metrics
+
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000") or 0)
+ANSWER_CACHE_MIN_SIM = float(os.getenv("ANSWER_CACHE_MIN_SIM", "0.97") or 0.97)
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "21600") or 0)
+
+BYPASS_SEVERITIES = ("Red",)
+BYPASS_STANCES = ("harm_to_others", "harm_to_self", "expresses_prejudice")
+
+Bucket = Tuple[str, int, str, str, str, str]
+
+_index_versions: "weakref.WeakKeyDictionary[Any, Tuple[str, int]]" = weakref.WeakKeyDictionary()
+_next_version = 0
+_versions_lock = threading.Lock()
+
+
+def register_index(name: str, index: Any) -> None:
+    """Give a freshly (re)loaded index a new version and drop answers built on older ones."""
+    global _next_version
+    with _versions_lock:
+        _next_version += 1
+        _index_versions[index] = (name, _next_version)
+    if _cache is not None:
+        _cache.invalidate_index(name)
+
+
+def index_version(index: Any) -> Optional[Tuple[str, int]]:
+    try:
+        return _index_versions.get(index)
+    except TypeError:
+        return None
+
+
+def bypass_reason(query_severity: str, stance: str) -> Optional[str]:
+    if query_severity in BYPASS_SEVERITIES:
+        return f"severity={query_severity}"
+    if stance in BYPASS_STANCES:
+        return f"stance={stance}"
+    return None
+
+
+def _unit(embedding: List[float]) -> Optional[np.ndarray]:
+    vec = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(vec))
+    if vec.ndim != 1 or norm == 0.0:
+        return None
+    return vec / norm
+
+
+class SemanticAnswerCache:
+    """Bucketed nearest-neighbour store of final answers, bounded and TTL'd."""
+
+    def __init__(self, max_entries: int, min_sim: float, ttl_s: Optional[float]) -> None:
+        self.max_entries = max_entries
+        self.min_sim = min_sim
+        self.ttl_s = ttl_s or None
+        # entry id -> (bucket, unit vector, payload, stored_at); insertion order = LRU order
+        self._entries: "OrderedDict[int, Tuple[Bucket, np.ndarray, Dict[str, Any], float]]" = OrderedDict()
+        self._by_bucket: Dict[Bucket, List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "bypassed": 0, "invalidated": 0}
+
+    def lookup(self, bucket: Bucket, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        query = _unit(embedding)
+        if query is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            # Iterate a copy: _expired drops expired entries from the bucket list.
+            ids = [i for i in list(self._by_bucket.get(bucket, [])) if not self._expired(i, now)]
+            best_id, best_sim = None, self.min_sim
+            if ids:
+                matrix = np.stack([self._entries[i][1] for i in ids])
+                sims = matrix @ query
+                j = int(np.argmax(sims))
+                if float(sims[j]) >= best_sim:
+                    best_id, best_sim = ids[j], float(sims[j])
+            if best_id is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self._counters["hits"] += 1
+            payload = self._entries[best_id][2]
+        return {**payload, "similarity": round(best_sim, 4)}
+
+    def store(self, bucket: Bucket, embedding: List[float], payload: Dict[str, Any]) -> None:
+        vec = _unit(embedding)
+        if vec is None:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (bucket, vec, payload, time.monotonic())
+            self._by_bucket.setdefault(bucket, []).append(entry_id)
+            self._counters["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                old_id = next(iter(self._entries))
+                self._drop(old_id)
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self._counters["bypassed"] += 1
+
+    def invalidate_index(self, name: str) -> None:
+        with self._lock:
+            stale = [i for i, (bucket, *_rest) in self._entries.items() if bucket[0] == name]
+            for entry_id in stale:
+                self._drop(entry_id)
+            self._counters["invalidated"] += len(stale)
+        if stale:
+            logging.info("Answer cache: dropped %d entries for reloaded index '%s'", len(stale), name)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_bucket.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._entries)
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "entries": size,
+            "capacity": self.max_entries,
+            "min_sim": self.min_sim,
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+    # caller holds the lock
+    def _expired(self, entry_id: int, now: float) -> bool:
+        if self.ttl_s is None:
+            return False
+        if now - self._entries[entry_id][3] <= self.ttl_s:
+            return False
+        self._drop(entry_id)
+        return True
+
+    def _drop(self, entry_id: int) -> None:
+        bucket = self._entries.pop(entry_id)[0]
+        ids = self._by_bucket.get(bucket)
+        if ids is not None:
+            ids.remove(entry_id)
+            if not ids:
+                del self._by_bucket[bucket]
+
+
+_cache: Optional[SemanticAnswerCache] = None
+if ANSWER_CACHE_SIZE > 0:
+    _cache = SemanticAnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_MIN_SIM, ANSWER_CACHE_TTL_S)
+    register_metrics("answer_cache", _cache.stats)
+
+
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    """Process-wide cache; None when ANSWER_CACHE_SIZE=0."""
+    return _cache
+
+
+def make_bucket(
+    index: Any, query_severity: str, stance: str, response_style: str, asker_gender: str
+) -> Optional[Bucket]:
+    """Bucket for a request, or None when the index has no registered version."""
+    version = index_version(index)
+    if version is None:
+        return None
+    name, number = version
+    return (name, number, query_severity or "", stance or "", response_style or "", asker_gender or "ukjent")
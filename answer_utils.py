@@ -1,7 +1,10 @@
-from agent_workflow_answer import (answer_workflow, State_Answer)
+from agent_workflow_answer import (answer_workflow, async_answer_workflow, State_Answer)
 from agent_workflow_qa import (related_qa_workflow, State_Related)
-from config import ServerSettings, VectorIndexStore, CustomError
+from config import ServerSettings, VectorIndexStore, CustomError, INDEX_FAILED, INDEX_MISSING
 from query_utils import QuerySettings
+import deadlines
+import derived_cache
+from dense_retriever import build_retriever
 from llama_index.core.vector_stores import MetadataFilter, MetadataFilters
 from llama_index.core.query_engine import RetrieverQueryEngine 
 from llama_index.core.llms import ChatMessage, MessageRole
@@ -74,6 +77,26 @@ def _resolve_qa_bank_entry(query_settings, vector_store):
     return name, None
 
 
+def qa_bank_index_name(query_settings, vector_store) -> str:
+    """The QA-bank `_resolve_qa_bank_entry` settles on once loading is done.
+
+    Same resolution order, but against every index that is loaded or still
+    loading (vector_store.index_states), so routes can wait for the right
+    one during startup.
+    """
+    known = {
+        name for name, info in vector_store.states().items()
+        if info.get("state") not in (INDEX_MISSING, INDEX_FAILED)
+    }
+    requested = getattr(query_settings, "qa_bank_index", None)
+    if requested and requested in known:
+        return requested
+    name = f"{query_settings.vectorIndex}_qa_bank"
+    if name in known:
+        return name
+    return QA_BANK_FALLBACK_NAME
+
+
 categories = [
   {
     "name": "Eksen",
@@ -187,6 +210,11 @@ async def get_answer_as_stream(
     vector_store: VectorIndexStore
 ):
   try:
+    # The request's time budget starts now. The context variable follows the
+    # graph into every node (see deadlines); the state copy drives the
+    # cheaper-path decisions.
+    deadline = deadlines.start(getattr(query_settings, "deadline_s", deadlines.ANSWER_DEADLINE_S))
+
     # Build a conversation string from messages (if any)
     history = query_settings.messages or []
     convo_lines = []
@@ -295,7 +323,8 @@ async def get_answer_as_stream(
         similarity_top_k=query_settings.similarity_top_k,
         response_synthesizer=response_synthesizer,
     )
-    retriever = index.as_retriever(
+    retriever = build_retriever(
+        index,
         similarity_top_k=query_settings.similarity_top_k,
         similarity_cutoff=query_settings.similarity_cutoff,
     )
@@ -334,7 +363,8 @@ async def get_answer_as_stream(
         filters=[MetadataFilter(key="severity", value=v) for v in ("Green", "Yellow", "Red")], condition="or",
     )
     
-    retriever_related_queries = index_qa_bank.as_retriever(
+    retriever_related_queries = build_retriever(
+        index_qa_bank,
         similarity_top_k=query_settings.similarity_top_k,
         similarity_cutoff=query_settings.similarity_cutoff,
         filters=severity_filters,
@@ -404,13 +434,19 @@ async def get_answer_as_stream(
         "claims_valid_threshold": getattr(query_settings, "claims_valid_threshold", 1.0),
         "entailment_check": getattr(query_settings, "entailment_check", True),
         "debug_emit_nodes": getattr(query_settings, "debug_emit_nodes", False),
+        "speculative_retrieval": getattr(query_settings, "speculative_retrieval", False),
+        "deadline": deadline,
+        "degradations": [],
     }
 
 
 
 
+    # Sync- eller async-native graf (samme topologi og SSE-output).
+    workflow = async_answer_workflow if getattr(query_settings, "async_graph", False) else answer_workflow
+
     # ✅ This is  an **async generator**
-    async for chunk in answer_workflow.astream(init_state, stream_mode="custom"):
+    async for chunk in workflow.astream(init_state, stream_mode="custom"):
         yield chunk
   except CustomError:
       # Forventede feil – la route håndtere HTTP-respons
@@ -442,7 +478,12 @@ async def get_related_qa_as_stream(
     # 1) Load the text_bank corresponding to the index
     vec_name = query_settings.vectorIndex
     entry = vector_store.get(vec_name)
-    if entry is None:
+    if entry is None and vector_store.not_ready([vec_name]):
+        # Tekstindeksen gir bare kildedokument-detaljer (tittel, ikon);
+        # svaret kommer fra QA-banken, så vi venter ikke på den.
+        logging.info("Index %s still loading; answering from the QA-bank only.", vec_name)
+        index: Optional[VectorStoreIndex] = None
+    elif entry is None:
         # Log with %s formatting
         logging.error("Index not found: %s", vec_name)
         # Raise so the route handler can catch & return 404 JSON
@@ -450,8 +491,8 @@ async def get_related_qa_as_stream(
             f"Index not found, referansefilene for {vec_name} mangler!",
             404
         )
-
-    index: VectorStoreIndex = entry.index
+    else:
+        index = entry.index
 
     # 1) Load the qa_bank corresponding to the index
     vec_name_qa_bank, entry_qa_bank = _resolve_qa_bank_entry(query_settings, vector_store)
@@ -617,9 +658,14 @@ def _meta_is_valid(meta: dict) -> bool:
 # request then only does a cheap random pick. warm_examples_cache() primes
 # this at server startup so the first /examples call is already fast.
 #
+# The pools are also written next to the index (derived_cache.py), so a
+# restart on unchanged index files reads them back instead of rescanning.
+#
 # Cache shape:  {qa_bank_index_name: {"categories": [...], "pools": {title: [items]}}}
 _examples_cache: Dict[str, Dict[str, Any]] = {}
 _examples_cache_lock = asyncio.Lock()
+EXAMPLES_FILE = "examples_pools.json"
+_EXAMPLES_FORMAT = 1
 
 
 def _node_category_labels(meta: dict) -> List[str]:
@@ -673,6 +719,16 @@ def _build_examples_pools(index_qa_bank: VectorStoreIndex) -> Dict[str, Any]:
     return {"categories": sorted(pools.keys()), "pools": pools}
 
 
+def _load_or_build_examples_pools(index_qa_bank: VectorStoreIndex) -> Dict[str, Any]:
+    """The pools stored for this version of the index, or freshly built (and stored)."""
+    entry = derived_cache.load(index_qa_bank, EXAMPLES_FILE, _EXAMPLES_FORMAT)
+    if isinstance(entry, dict) and "categories" in entry and "pools" in entry:
+        return entry
+    entry = _build_examples_pools(index_qa_bank)
+    derived_cache.store(index_qa_bank, EXAMPLES_FILE, _EXAMPLES_FORMAT, entry)
+    return entry
+
+
 async def _get_examples_cache_entry(
     vec_name: str, index_qa_bank: VectorStoreIndex, force: bool = False
 ) -> Dict[str, Any]:
@@ -687,7 +743,8 @@ async def _get_examples_cache_entry(
         if cached is not None and not force:
             return cached
         logging.info("Building examples cache for %s ...", vec_name)
-        entry = _build_examples_pools(index_qa_bank)
+        # Off the event loop: this also runs while serving (index reload).
+        entry = await asyncio.to_thread(_load_or_build_examples_pools, index_qa_bank)
         _examples_cache[vec_name] = entry
         logging.info(
             "Examples cache for %s ready: %d categories", vec_name, len(entry["categories"])
@@ -695,24 +752,29 @@ async def _get_examples_cache_entry(
         return entry
 
 
-async def warm_examples_cache(vector_store: VectorIndexStore) -> None:
+async def warm_examples_cache(
+    vector_store: VectorIndexStore, index: Optional[VectorStoreIndex] = None
+) -> None:
     """Precompute the examples pools for the QA-bank.
 
     /examples reads only EXAMPLES_INDEX_NAME (hvaerinnafor_qa_bank), so that
-    is the only index we need here. Called once at server startup (after
-    indexes load) so the first /examples request is fast. Safe to call
-    repeatedly — it rebuilds the entry.
+    is the only index we need here. Called once the QA-bank has loaded so
+    the first /examples request is fast, and with ``index`` for a reloaded
+    version before it is swapped in. Safe to call repeatedly — it rebuilds
+    the entry.
     """
-    entry = vector_store.get(EXAMPLES_INDEX_NAME)
-    if entry is None:
-        logging.warning(
-            "Cannot warm examples cache: index %s not loaded.", EXAMPLES_INDEX_NAME
-        )
-        return
+    if index is None:
+        entry = vector_store.get(EXAMPLES_INDEX_NAME)
+        if entry is None:
+            logging.warning(
+                "Cannot warm examples cache: index %s not loaded.", EXAMPLES_INDEX_NAME
+            )
+            return
+        index = entry.index
     try:
-        await _get_examples_cache_entry(entry.name, entry.index, force=True)
+        await _get_examples_cache_entry(EXAMPLES_INDEX_NAME, index, force=True)
     except Exception:
-        logging.exception("Failed to warm examples cache for %s", entry.name)
+        logging.exception("Failed to warm examples cache for %s", EXAMPLES_INDEX_NAME)
 
 
 async def get_examples_full_as_stream(
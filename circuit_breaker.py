@@ -0,0 +1,346 @@
+# circuit_breaker.py
+"""Circuit breakers for the chat and embedding endpoints.
+
+When Azure degrades, every call waits out its full client timeout (120 s main,
+60 s fast) before a node's static fallback runs. Meanwhile SSE connections
+pile up. ``CircuitBreaker`` keeps one state machine per endpoint:
+
+  * closed    — calls go through. BREAKER_FAILURES consecutive deployment
+                failures (5xx, 429, timeouts, connection errors), or
+                BREAKER_SLOW_CALLS consecutive calls slower than
+                BREAKER_SLOW_CALL_S, trip it;
+  * open      — calls fail at once with ``CircuitOpenError``, so the nodes go
+                straight to their existing fallbacks (HARM_REFUSAL_ANSWER,
+                the cannot-answer placeholders, the unstyled source answer);
+  * half-open — after BREAKER_OPEN_S one probe call is let through. Success
+                closes the breaker; failure opens it again. Other calls keep
+                failing fast while the probe runs.
+
+Caller errors (other 4xx, output parsing) and calls cut short by the
+request's deadline (see deadlines) never count. Breaker state is
+published through ``metrics`` under "circuit_breakers", and as a plain
+{breaker: state} map (``states``) on the public /healthz. Breakers are
+named by a short label of the endpoint (the first part of its host name,
+e.g. "chat|my-resource"), never by its full URL.
+
+Chat calls are guarded in agent_workflow_answer's call helpers:
+``check_circuit`` before queueing in llm_scheduler, ``guarded`` around the
+call itself, so queue wait never counts as endpoint latency. Embeddings are
+wrapped with ``GuardedEmbedding`` in embeddings_provider, under the
+query-embedding cache so cache hits are still served while the breaker is
+open.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from langchain_core.exceptions import OutputParserException
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from pydantic import PrivateAttr, ValidationError
+
+import deadlines
+from llm_scheduler import chat_model_of, deployment_key
+from metrics import register_metrics
+
+
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5") or 0)
+BREAKER_SLOW_CALLS = int(os.getenv("BREAKER_SLOW_CALLS", "3") or 0)
+BREAKER_SLOW_CALL_S = float(os.getenv("BREAKER_SLOW_CALL_S", "30") or 0)
+BREAKER_OPEN_S = float(os.getenv("BREAKER_OPEN_S", "30") or 30)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an endpoint whose breaker is open."""
+
+    def __init__(self, name: str, retry_in_s: float) -> None:
+        super().__init__(f"Circuit open for {name}; retry in {retry_in_s:.0f}s")
+        self.name = name
+        self.retry_in_s = retry_in_s
+
+
+def is_deployment_failure(exc: BaseException) -> bool:
+    """True for errors that say something about the endpoint rather than the request."""
+    # A call cut short by the request's own deadline says nothing about the endpoint.
+    if isinstance(exc, deadlines.DeadlineExceeded) or deadlines.expired():
+        return False
+    if isinstance(exc, (CircuitOpenError, OutputParserException, ValidationError, ValueError, TypeError)):
+        return False
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in (408, 409, 429):
+        return False
+    return True
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one endpoint."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = BREAKER_FAILURES,
+        slow_call_threshold: int = BREAKER_SLOW_CALLS,
+        slow_call_s: float = BREAKER_SLOW_CALL_S,
+        open_s: float = BREAKER_OPEN_S,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.slow_call_s = slow_call_s
+        self.open_s = open_s
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._failures = 0
+        self._slow = 0
+        self._counters = {"calls": 0, "failures": 0, "slow_calls": 0, "rejected": 0, "trips": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def check(self) -> None:
+        """Raise CircuitOpenError while open, without taking the probe slot."""
+        with self._lock:
+            if self._state != OPEN:
+                return
+            remaining = self._opened_at + self.open_s - time.monotonic()
+            if remaining <= 0:
+                return
+            self._counters["rejected"] += 1
+        raise CircuitOpenError(self.name, remaining)
+
+    def before_call(self) -> bool:
+        """Admit a call or raise CircuitOpenError; returns True when the call is the half-open probe."""
+        with self._lock:
+            if self._state == CLOSED:
+                self._counters["calls"] += 1
+                return False
+            remaining = self._opened_at + self.open_s - time.monotonic()
+            if self._state == OPEN and remaining <= 0:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                self._counters["calls"] += 1
+                return True
+            self._counters["rejected"] += 1
+        raise CircuitOpenError(self.name, max(0.0, remaining))
+
+    def record_success(self, elapsed_s: Optional[float], probe: bool) -> None:
+        slow = bool(self.slow_call_s) and elapsed_s is not None and elapsed_s > self.slow_call_s
+        with self._lock:
+            if probe:
+                self._probe_in_flight = False
+            self._failures = 0
+            if slow:
+                self._slow += 1
+                self._counters["slow_calls"] += 1
+                if self.slow_call_threshold and self._slow >= self.slow_call_threshold:
+                    self._trip(f"{self._slow} calls slower than {self.slow_call_s:.0f}s")
+                    return
+            else:
+                self._slow = 0
+            # Only the probe closes the breaker; a straggler that was admitted
+            # before the trip says little about the endpoint now.
+            if probe and self._state != CLOSED:
+                self._state = CLOSED
+                logging.info("Circuit breaker %s closed (probe succeeded)", self.name)
+
+    def record_failure(self, exc: BaseException, probe: bool) -> None:
+        with self._lock:
+            if probe:
+                self._probe_in_flight = False
+            if not is_deployment_failure(exc):
+                return
+            self._failures += 1
+            self._counters["failures"] += 1
+            if probe or (self.failure_threshold and self._failures >= self.failure_threshold):
+                self._trip(f"{self._failures} consecutive failures, last: {exc}")
+
+    def release_probe(self, probe: bool) -> None:
+        """The call was abandoned (cancelled) before an outcome."""
+        if probe:
+            with self._lock:
+                self._probe_in_flight = False
+
+    # caller holds the lock
+    def _trip(self, reason: str) -> None:
+        if self._state != OPEN:
+            self._counters["trips"] += 1
+            logging.warning("Circuit breaker %s opened for %.0fs: %s", self.name, self.open_s, reason)
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._failures = 0
+        self._slow = 0
+
+    @contextmanager
+    def guard(self, measure_latency: bool = True):
+        """Run the body as one call through the breaker."""
+        probe = self.before_call()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as exc:
+            self.record_failure(exc, probe)
+            raise
+        except BaseException:
+            self.release_probe(probe)
+            raise
+        self.record_success(time.monotonic() - started if measure_latency else None, probe)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "consecutive_slow": self._slow,
+                **self._counters,
+            }
+            if self._state != CLOSED:
+                out["open_for_s"] = round(max(0.0, self._opened_at + self.open_s - time.monotonic()), 1)
+        return out
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def breaker(name: str) -> CircuitBreaker:
+    """The process-wide breaker for endpoint ``name`` (created on first use)."""
+    with _registry_lock:
+        found = _breakers.get(name)
+        if found is None:
+            found = _breakers[name] = CircuitBreaker(name)
+        return found
+
+
+def endpoint_label(url: Any) -> Optional[str]:
+    """Short name of an endpoint URL for breaker names: the first label of its host."""
+    if not url:
+        return None
+    url = str(url)
+    host = urlparse(url if "//" in url else f"//{url}").hostname or ""
+    return host.split(".")[0] or None
+
+
+def chat_endpoint(llm: Any) -> str:
+    model = chat_model_of(llm)
+    label = endpoint_label(
+        getattr(model, "azure_endpoint", None)
+        or getattr(model, "anthropic_api_url", None)
+        or getattr(model, "endpoint", None)
+    )
+    return f"chat|{label}" if label else f"chat|{deployment_key(llm)}"
+
+
+def check_circuit(llm: Any) -> None:
+    """Fail fast before queueing a chat call whose endpoint breaker is open."""
+    breaker(chat_endpoint(llm)).check()
+
+
+@contextmanager
+def guarded(llm: Any, measure_latency: bool = True):
+    """Guard one chat call with its endpoint's breaker (raises CircuitOpenError when open)."""
+    with breaker(chat_endpoint(llm)).guard(measure_latency=measure_latency):
+        yield
+
+
+class GuardedEmbedding(BaseEmbedding):
+    """BaseEmbedding that sends every backend call through a circuit breaker.
+
+    Calls also respect the request's deadline: none is started once it has
+    passed, and async calls are cut off when it does.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _breaker: CircuitBreaker = PrivateAttr()
+    # Mirrored so embedding_cache can still batch queries via the text endpoint.
+    _query_engine: Any = PrivateAttr(default=None)
+    _text_engine: Any = PrivateAttr(default=None)
+
+    def __init__(self, inner: BaseEmbedding, name: Optional[str] = None, **kwargs: Any) -> None:
+        super().__init__(
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            callback_manager=inner.callback_manager,
+            **kwargs,
+        )
+        self._inner = inner
+        self._query_engine = getattr(inner, "_query_engine", None)
+        self._text_engine = getattr(inner, "_text_engine", None)
+        label = endpoint_label(getattr(inner, "azure_endpoint", None) or getattr(inner, "api_base", None))
+        self._breaker = breaker(name or f"embeddings|{label or inner.model_name}")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "GuardedEmbedding"
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        deadlines.check()
+        with self._breaker.guard():
+            return self._inner._get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        with self._breaker.guard():
+            return await deadlines.await_within(self._inner._aget_query_embedding(query))
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        deadlines.check()
+        with self._breaker.guard():
+            return self._inner._get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        with self._breaker.guard():
+            return await deadlines.await_within(self._inner._aget_text_embedding(text))
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        deadlines.check()
+        with self._breaker.guard():
+            return self._inner._get_text_embeddings(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        with self._breaker.guard():
+            return await deadlines.await_within(self._inner._aget_text_embeddings(texts))
+
+
+def states() -> Dict[str, str]:
+    """{breaker: state} for the public /healthz.
+
+    A breaker without an endpoint label is named by its deployment key;
+    that one is shown by model type only ("chat|AzureChatOpenAI", "#2" for
+    the next one), so no deployment names are published.
+    """
+    with _registry_lock:
+        breakers = sorted(_breakers.items())
+    out: Dict[str, str] = {}
+    for name, b in breakers:
+        kind, _, rest = name.partition("|")
+        label = name
+        if "|" in rest:
+            base = label = f"{kind}|{rest.split('|', 1)[0]}"
+            n = 2
+            while label in out:
+                label, n = f"{base}#{n}", n + 1
+        out[label] = b.state
+    return out
+
+
+def stats() -> Dict[str, Any]:
+    with _registry_lock:
+        breakers = dict(_breakers)
+    return {name: b.stats() for name, b in breakers.items()}
+
+
+register_metrics("circuit_breakers", stats)
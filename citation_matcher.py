@@ -0,0 +1,317 @@
+# citation_matcher.py
+"""Batch verification of citation quotes against the retrieved nodes.
+
+``_verify_claims`` used to call ``_verify_citations_per_node`` once per
+claim, and that walked every quote over every node with ``in`` and, on a
+miss, ``partial_ratio`` against the node's full text: claims x citations x
+nodes scans in Python on every grounded answer. ``CitationMatcher`` is
+built once per answer instead:
+
+  * node texts are normalized once (the default settings come from
+    node_artifacts) and joined into one haystack, separated by "\\x00",
+    which normalization strips from both nodes and quotes;
+  * ``match`` takes every quote of the answer at once, deduplicated. Each
+    one is looked up with one ``str.find`` over the haystack; the offset of
+    the first hit gives the first node containing it (bisect over the node
+    start offsets). That is one C-level scan per distinct quote. A
+    pure-Python Aho-Corasick automaton found the same hits ~30x slower, and
+    pyahocorasick is not a dependency;
+  * only quotes with no exact hit go to fuzzy matching. ``partial_ratio``
+    runs only on up to CITATION_FUZZY_WINDOWS candidate windows per node:
+    stretches about the quote's length that share at least
+    CITATION_FUZZY_MIN_SHARED of its word grams (``NodeGrams``, built at
+    index load), padded by half the quote's length on each side. That cost
+    depends on the quote, not on node length. A node with no candidate
+    window is a miss. With CITATION_FUZZY_WINDOWS=0, or for
+    non-default normalization, all misses go through one
+    ``rapidfuzz.process.cdist`` call over the full node texts. For large
+    enough answers this pass can run in a worker process
+    (verification_pool; ``amatch`` awaits it off the event loop).
+
+A quote resolves to the first node (in rank order) that contains it, else
+the first node whose ``partial_ratio`` reaches ``fuzzy_min_ratio``. Results
+are cached per quote, so ``verify`` per claim is a lookup. Counters are
+published in ``metrics`` under "citation_matcher".
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from bisect import bisect_right
+from concurrent.futures import Future
+from typing import Any, Dict, Iterable, List, Optional
+
+from rapidfuzz.fuzz import partial_ratio
+from rapidfuzz.process import cdist
+
+import verification_pool
+from agent_shared import _node_identity, _node_text, _normalize
+from metrics import register_metrics
+from node_artifacts import artifacts_for, gram_keys
+
+
+CITATION_FUZZY_WINDOWS = int(os.getenv("CITATION_FUZZY_WINDOWS", "4") or 0)
+CITATION_FUZZY_MIN_SHARED = float(os.getenv("CITATION_FUZZY_MIN_SHARED", "0.25") or 0)
+
+_SEPARATOR = "\x00"
+
+_lock = threading.Lock()
+_counters: Dict[str, int] = {
+    "answers": 0,
+    "distinct_quotes": 0,
+    "exact_hits": 0,
+    "fuzzy_checked": 0,
+    "fuzzy_hits": 0,
+    "fuzzy_windows": 0,
+}
+
+
+class CitationMatcher:
+    """Citation quotes of one answer matched against its nodes."""
+
+    def __init__(
+        self,
+        nodes: List[Any],
+        *,
+        min_quote_chars: int = 8,
+        collapse_whitespace: bool = True,
+        case_sensitive: bool = False,
+        fuzzy_min_ratio: Optional[int] = None,
+    ) -> None:
+        grams = None
+        if collapse_whitespace and not case_sensitive:
+            # Normalized once at index load, see node_artifacts.
+            artifacts = [artifacts_for(n) for n in nodes]
+            texts = [a.norm for a in artifacts]
+            grams = [a.grams for a in artifacts]
+        else:
+            texts = [
+                _normalize(_node_text(n), collapse_ws=collapse_whitespace, case_sensitive=case_sensitive)
+                for n in nodes
+            ]
+        self._setup(list(nodes), texts, grams, min_quote_chars, collapse_whitespace, case_sensitive, fuzzy_min_ratio)
+        with _lock:
+            _counters["answers"] += 1
+
+    @classmethod
+    def from_texts(cls, texts: List[str], grams: List[Any], *, fuzzy_min_ratio: Optional[int]) -> "CitationMatcher":
+        """A matcher over texts already normalized with the default settings; its nodes are the indices."""
+        matcher = cls.__new__(cls)
+        matcher._setup(list(range(len(texts))), texts, grams, 8, True, False, fuzzy_min_ratio)
+        return matcher
+
+    def _setup(
+        self,
+        nodes: List[Any],
+        texts: List[str],
+        grams: Optional[List[Any]],
+        min_quote_chars: int,
+        collapse_whitespace: bool,
+        case_sensitive: bool,
+        fuzzy_min_ratio: Optional[int],
+    ) -> None:
+        self.nodes = nodes
+        self.texts = texts
+        self.grams = grams
+        self.min_quote_chars = min_quote_chars
+        self.collapse_whitespace = collapse_whitespace
+        self.case_sensitive = case_sensitive
+        self.fuzzy_min_ratio = fuzzy_min_ratio
+
+        self.haystack = _SEPARATOR.join(texts)
+        self.starts: List[int] = []
+        pos = 0
+        for text in texts:
+            self.starts.append(pos)
+            pos += len(text) + len(_SEPARATOR)
+
+        # stripped quote -> normalized quote, or None when too short
+        self._quotes: Dict[str, Optional[str]] = {}
+        # normalized quote -> index of the matching node, or None
+        self._resolved: Dict[str, Optional[int]] = {}
+
+    @property
+    def has_text(self) -> bool:
+        return any(self.texts)
+
+    def _quote_norm(self, quote: str) -> Optional[str]:
+        """Normalized ``quote``, or None when it is shorter than min_quote_chars."""
+        if quote in self._quotes:
+            return self._quotes[quote]
+        if len(_normalize(quote, collapse_ws=True, case_sensitive=True)) < self.min_quote_chars:
+            q_norm = None
+        else:
+            q_norm = _normalize(quote, collapse_ws=self.collapse_whitespace, case_sensitive=self.case_sensitive)
+        self._quotes[quote] = q_norm
+        return q_norm
+
+    def _first_exact(self, q_norm: str) -> Optional[int]:
+        pos = self.haystack.find(q_norm)
+        if pos < 0:
+            return None
+        return bisect_right(self.starts, pos) - 1
+
+    def _exact_pass(self, quotes: Iterable[str]) -> List[str]:
+        """Resolve every (stripped) quote not seen before by exact lookup; returns the misses."""
+        pending: Dict[str, None] = {}
+        for quote in quotes:
+            q_norm = self._quote_norm(quote)
+            if q_norm is not None and q_norm not in self._resolved:
+                pending[q_norm] = None
+
+        misses: List[str] = []
+        for q_norm in pending:
+            found = self._first_exact(q_norm)
+            self._resolved[q_norm] = found
+            if found is None:
+                misses.append(q_norm)
+
+        with _lock:
+            _counters["distinct_quotes"] += len(pending)
+            _counters["exact_hits"] += len(pending) - len(misses)
+        return misses
+
+    def _submit_fuzzy(self, misses: List[str]) -> Optional[Future]:
+        # Workers only hold the default-normalized corpus.
+        if self.grams is None:
+            return None
+        return verification_pool.submit_fuzzy(self.nodes, misses, self.fuzzy_min_ratio)
+
+    def _finish_fuzzy(self, misses: List[str], resolved: Optional[Dict[str, Optional[int]]]) -> None:
+        if resolved is None:
+            hits = self._match_fuzzy(misses)
+        else:
+            hits = 0
+            for q_norm in misses:
+                found = resolved.get(q_norm)
+                if found is not None:
+                    self._resolved[q_norm] = found
+                    hits += 1
+        with _lock:
+            _counters["fuzzy_checked"] += len(misses)
+            _counters["fuzzy_hits"] += hits
+
+    def match(self, quotes: Iterable[str]) -> None:
+        """Resolve every (stripped) quote not seen before: exact pass first, then fuzzy for the misses."""
+        misses = self._exact_pass(quotes)
+        if not misses or self.fuzzy_min_ratio is None:
+            return
+        future = self._submit_fuzzy(misses)
+        self._finish_fuzzy(misses, verification_pool.result(future) if future else None)
+
+    async def amatch(self, quotes: Iterable[str]) -> None:
+        """``match`` without blocking the event loop.
+
+        The verification pool is awaited; the exact pass, and the fuzzy
+        pass when the pool is off or declines, run in a worker thread.
+        """
+        misses = await asyncio.to_thread(self._exact_pass, list(quotes))
+        if not misses or self.fuzzy_min_ratio is None:
+            return
+        future = self._submit_fuzzy(misses)
+        resolved = await verification_pool.aresult(future) if future else None
+        if resolved is None:
+            await asyncio.to_thread(self._finish_fuzzy, misses, None)
+        else:
+            self._finish_fuzzy(misses, resolved)
+
+    def _match_fuzzy(self, misses: List[str]) -> int:
+        if self.grams is not None and CITATION_FUZZY_WINDOWS > 0 and self.fuzzy_min_ratio > 0:
+            return self._match_fuzzy_windows(misses)
+        columns = [i for i, text in enumerate(self.texts) if text]
+        if not columns:
+            return 0
+        try:
+            scores = cdist(
+                misses,
+                [self.texts[i] for i in columns],
+                scorer=partial_ratio,
+                score_cutoff=self.fuzzy_min_ratio,
+            )
+        except Exception as e:
+            logging.warning("Fuzzy citation matching failed: %s", e)
+            return 0
+        hits = 0
+        for q_norm, row in zip(misses, scores):
+            for col, score in enumerate(row):
+                if score >= self.fuzzy_min_ratio:
+                    self._resolved[q_norm] = columns[col]
+                    hits += 1
+                    logging.debug("Fuzzy match for citation %r, ratio=%s", q_norm, score)
+                    break
+        return hits
+
+    def _match_fuzzy_windows(self, misses: List[str]) -> int:
+        hits = windows = 0
+        for q_norm in misses:
+            keys = gram_keys(q_norm)
+            span = len(q_norm)
+            pad = span // 2
+            for i, text in enumerate(self.texts):
+                if not text:
+                    continue
+                score = 0.0
+                for start, end in self.grams[i].windows(keys, span, CITATION_FUZZY_MIN_SHARED, CITATION_FUZZY_WINDOWS):
+                    windows += 1
+                    segment = text[max(0, start - pad):max(end, start + span) + pad]
+                    score = partial_ratio(q_norm, segment, score_cutoff=self.fuzzy_min_ratio)
+                    if score >= self.fuzzy_min_ratio:
+                        break
+                if score and score >= self.fuzzy_min_ratio:
+                    self._resolved[q_norm] = i
+                    hits += 1
+                    logging.debug("Fuzzy match for citation %r, ratio=%s", q_norm, score)
+                    break
+        with _lock:
+            _counters["fuzzy_windows"] += windows
+        return hits
+
+    def verify(self, quotes: List[str]) -> Dict[str, Any]:
+        """Per-citation result for one claim, shaped like ``_verify_citations_per_node``'s."""
+        problems: List[str] = []
+        matches_by_citation: Dict[int, List[Any]] = {}
+        matched_nodes: List[Any] = []
+        seen_nodes: set = set()
+
+        if quotes and not self.has_text:
+            return {
+                "problems": [f"citation[{i}]: no retrieved text available" for i, _ in enumerate(quotes)],
+                "matched_nodes": [],
+                "matches_by_citation": {},
+            }
+
+        stripped = [(q or "").strip() for q in quotes]
+        self.match(stripped)
+        for i, q_raw in enumerate(stripped):
+            q_norm = self._quote_norm(q_raw)
+            if q_norm is None:
+                problems.append(f"citation[{i}]: quote too short (<{self.min_quote_chars})")
+                continue
+            found = self._resolved.get(q_norm)
+            if found is None:
+                problems.append(f"citation[{i}]: quote not found in any node: {q_raw!r}")
+                continue
+            node_obj = self.nodes[found]
+            matches_by_citation[i] = [node_obj]
+            key = _node_identity(node_obj)
+            if key not in seen_nodes:
+                seen_nodes.add(key)
+                matched_nodes.append(node_obj)
+
+        return {
+            "problems": problems,
+            "matched_nodes": matched_nodes,
+            "matches_by_citation": matches_by_citation,
+        }
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        out = dict(_counters)
+    quotes = out["distinct_quotes"]
+    out["exact_hit_rate"] = round(out["exact_hits"] / quotes, 3) if quotes else 0.0
+    return out
+
+
+register_metrics("citation_matcher", stats)
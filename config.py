@@ -4,6 +4,7 @@ import os
 import logging
 import time
 import json
+import threading
 from llama_index.core import (StorageContext, load_index_from_storage)
 from collections import namedtuple
 import asyncio
@@ -12,6 +13,13 @@ from dotenv import load_dotenv, find_dotenv
 
 from llm_provider import build_chat_llm, build_fast_chat_llm
 from embeddings_provider import configure_embeddings
+from dense_retriever import attach_dense_matrix
+from index_snapshot import try_load_snapshot
+from node_artifacts import ARTIFACTS_FILE, attach_node_artifacts
+import derived_cache
+import index_catalog
+import verification_pool
+from answer_cache import register_index as register_answer_index
 
 load_dotenv(find_dotenv(), override=True)
 
@@ -62,15 +70,70 @@ configure_embeddings()
 server_settings = ServerSettings()
 
 
+# Hot reload: POST /admin/reload (enabled by ADMIN_TOKEN) and/or a poll of
+# the index files every INDEX_RELOAD_WATCH_S seconds (0 = off).
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "").strip()
+INDEX_RELOAD_WATCH_S = float(os.getenv("INDEX_RELOAD_WATCH_S", "0") or 0)
+
+
+# Per-index load states. Only PENDING/LOADING make a request wait (503): a
+# MISSING or FAILED index will not appear, and the agents report it (404).
+INDEX_PENDING = "pending"
+INDEX_LOADING = "loading"
+INDEX_READY = "ready"
+INDEX_MISSING = "missing"
+INDEX_FAILED = "failed"
+
+
 class VectorIndexStore:
     """Singleton store for all loaded vector indexes."""
     def __init__(self):
         self.indexes_loaded = False
         self.objects: list[IndexObject] = []
+        # name -> {"state": ..., "load_s": ...}; indexes load concurrently.
+        self.index_states: dict[str, dict] = {}
+        self._lock = threading.Lock()
 
     def add(self, name, index_obj, description):
         """Append a new IndexObject."""
-        self.objects.append(IndexObject(name, index_obj, description))
+        with self._lock:
+            self.objects.append(IndexObject(name, index_obj, description))
+
+    def replace(self, name, index_obj, description):
+        """Swap in a new version of ``name`` (or add it) in one step.
+
+        The list is rebuilt and rebound, so ``get`` sees either the old entry
+        or the new one. Requests that already hold the old index finish on it.
+        """
+        entry = IndexObject(name, index_obj, description)
+        with self._lock:
+            objects = [entry if e.name == name else e for e in self.objects]
+            if not any(e.name == name for e in self.objects):
+                objects.append(entry)
+            self.objects = objects
+
+    def set_state(self, name, state, **info):
+        """Record the load state of one index (plus e.g. load_s)."""
+        with self._lock:
+            self.index_states[name] = {"state": state, **info}
+
+    def update_state(self, name, **info):
+        """Add to the recorded state of one index (e.g. reloading=True)."""
+        with self._lock:
+            self.index_states.setdefault(name, {}).update(info)
+
+    def not_ready(self, names):
+        """Those of ``names`` that are still pending or loading."""
+        with self._lock:
+            return [
+                n for n in names
+                if self.index_states.get(n, {}).get("state") in (INDEX_PENDING, INDEX_LOADING)
+            ]
+
+    def states(self):
+        """Copy of the per-index states, for /healthz."""
+        with self._lock:
+            return {n: dict(info) for n, info in self.index_states.items()}
 
     def get(self, name):
         """
@@ -84,7 +147,8 @@ class VectorIndexStore:
 
     def clear(self):
         """Clear all stored indexes."""
-        self.objects.clear()
+        with self._lock:
+            self.objects.clear()
 
     def get_all(self):
         """Return a list of all stored entries."""
@@ -106,6 +170,11 @@ VECTOR_INDEX_MAP = [
 ]
 
 
+# Nothing is loaded yet: requests needing an index wait (503) until it is.
+for _item in VECTOR_INDEX_MAP:
+    vector_store.set_state(_item["name"], INDEX_PENDING)
+
+
 server_settings.set_llm(build_chat_llm())
 server_settings.set_fast_llm(build_fast_chat_llm())
 
@@ -134,10 +203,15 @@ async def async_read_indexes():
     try:
         # clear any previous run
         vector_store.clear()
-        
-        # offload the sync work
-        found_any = await asyncio.to_thread(read_all_indexes_from_storage, VECTOR_INDEX_MAP)
+        for item in VECTOR_INDEX_MAP:
+            vector_store.set_state(item["name"], INDEX_PENDING)
 
+        # Load the indexes side by side, one worker thread each: a request is
+        # served as soon as the indexes it needs are in (e.g. /examples only
+        # needs the QA bank), not when the largest one is. Threads rather
+        # than processes, because the loaded index objects cannot be handed
+        # back from another process without copying them.
+        found_any = any(await asyncio.gather(*(_async_read_index(item) for item in VECTOR_INDEX_MAP)))
 
         if found_any:
             logging.info("Indexes successfully read from storage.")
@@ -150,14 +224,11 @@ async def async_read_indexes():
         vector_store.indexes_loaded = loaded
         logging.info(f"Updated Server Status: {status}")
 
-        # Precompute the /examples category pools so the first request is fast.
-        # Local import avoids a circular import (answer_utils imports config).
         if loaded:
-            try:
-                from answer_utils import warm_examples_cache
-                await warm_examples_cache(vector_store)
-            except Exception:
-                logging.exception("Failed to warm examples cache at startup")
+            # Worker processes for fuzzy citation matching get the loaded
+            # corpus (no-op unless VERIFY_POOL_WORKERS > 0).
+            verification_pool.start()
+            _start_watcher()
 
     except Exception as e:
         logging.error(f"Failed to read indexes from storage: {e}")
@@ -165,7 +236,139 @@ async def async_read_indexes():
         vector_store.indexes_loaded = False
 
 
-def check_index_consistency(name, idx):
+async def _async_read_index(item):
+    """Load one index off the event loop, then warm what depends on it alone."""
+    loaded = await asyncio.to_thread(read_index_from_storage, item)
+    if loaded:
+        await _warm_examples(item["name"], vector_store.get(item["name"]).index)
+    return loaded
+
+
+async def _warm_examples(name, idx):
+    # Precompute the /examples category pools so the first request is fast.
+    # Local import avoids a circular import (answer_utils imports config).
+    try:
+        from answer_utils import EXAMPLES_INDEX_NAME, warm_examples_cache
+        if name == EXAMPLES_INDEX_NAME:
+            await warm_examples_cache(vector_store, idx)
+    except Exception:
+        logging.exception("Failed to warm examples cache for %s", name)
+
+
+# ---------- hot reload ----------
+
+_reload_tasks = set()
+_watcher_task = None
+
+
+async def reload_index(item):
+    """Load a new version of one index in the background and swap it in.
+
+    The current version keeps serving (its state stays ready, with
+    reloading=True) while the new one is loaded, checked and warmed: dense
+    matrix, node artifacts, catalog, examples pools. vector_store.replace
+    then swaps it in one step; requests already running finish on the old
+    version, which is released with the last of them. A failed or
+    inconsistent load keeps the current version. Returns True when the new
+    version was swapped in.
+    """
+    name = item['name']
+    storage = item['storage']
+    start = time.time()
+    vector_store.update_state(name, reloading=True)
+    try:
+        if not os.path.exists(storage):
+            raise FileNotFoundError(f"Index directory not found: {storage}")
+        idx, orphans = await asyncio.to_thread(_load_index, name, storage)
+        if orphans > 0:
+            raise ValueError(f"{orphans} embeddings reference node IDs missing from the docstore")
+        await _warm_examples(name, idx)
+        register_answer_index(name, idx)
+        vector_store.replace(name, idx, item['description'])
+    except Exception as e:
+        logging.exception(f"Reload of index '{name}' failed; keeping the current version")
+        vector_store.update_state(name, reloading=False, last_reload_error=str(e))
+        return False
+
+    elapsed = time.time() - start
+    vector_store.set_state(
+        name, INDEX_READY, load_s=round(elapsed, 2), fingerprint=derived_cache.fingerprint_of(idx),
+        reloaded_at=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    )
+    # The pool's shipped corpus is rebuilt for the new nodes.
+    verification_pool.start()
+    logging.info(f"Index '{name}' reloaded and swapped in after {elapsed:.2f}s")
+    return True
+
+
+def start_reload(names=None):
+    """Schedule background reloads of ``names`` (default: every index); returns the names scheduled.
+
+    Indexes still loading at startup, or already reloading, are skipped.
+    Must be called on the event loop.
+    """
+    started = []
+    states = vector_store.states()
+    for item in VECTOR_INDEX_MAP:
+        name = item["name"]
+        if names is not None and name not in names:
+            continue
+        info = states.get(name, {})
+        if info.get("reloading") or info.get("state") in (INDEX_PENDING, INDEX_LOADING):
+            continue
+        vector_store.update_state(name, reloading=True)
+        task = asyncio.get_running_loop().create_task(reload_index(item))
+        _reload_tasks.add(task)
+        task.add_done_callback(_reload_tasks.discard)
+        started.append(name)
+    return started
+
+
+def _storage_signature(storage):
+    """Size and mtime of the files a rebuild or snapshot conversion rewrites."""
+    sig = []
+    for rel in ("docstore.json", "index_store.json", "default__vector_store.json",
+                os.path.join("snapshot", "manifest.json")):
+        try:
+            st = os.stat(os.path.join(storage, rel))
+            sig.append((rel, st.st_size, st.st_mtime_ns))
+        except OSError:
+            sig.append((rel, None, None))
+    return tuple(sig)
+
+
+async def watch_indexes(interval):
+    """Reload an index when its files change.
+
+    Polls every ``interval`` seconds. A change is acted on once it has held
+    still for one more poll, so a rebuild that is still writing files is not
+    picked up half-way.
+    """
+    seen = {item["name"]: _storage_signature(item["storage"]) for item in VECTOR_INDEX_MAP}
+    pending = {}
+    while True:
+        await asyncio.sleep(interval)
+        for item in VECTOR_INDEX_MAP:
+            name = item["name"]
+            sig = _storage_signature(item["storage"])
+            if sig == seen[name]:
+                pending.pop(name, None)
+            elif pending.get(name) != sig:
+                pending[name] = sig
+            elif start_reload([name]):
+                logging.info(f"Index files of '{name}' changed; reloading")
+                seen[name] = sig
+                pending.pop(name, None)
+
+
+def _start_watcher():
+    global _watcher_task
+    if INDEX_RELOAD_WATCH_S > 0 and _watcher_task is None:
+        _watcher_task = asyncio.get_running_loop().create_task(watch_indexes(INDEX_RELOAD_WATCH_S))
+        logging.info(f"Watching index files for changes every {INDEX_RELOAD_WATCH_S:g}s")
+
+
+def check_index_consistency(name, idx, embedding_ids=None):
     """Verify the vector store and docstore of a loaded index agree.
 
     The fatal condition is an *orphan embedding*: a vector in the store whose
@@ -175,12 +378,17 @@ def check_index_consistency(name, idx):
     informational — ref-docs legitimately have none, and they just can't be
     retrieved.)
 
+    ``embedding_ids`` are the vector ids of an index loaded from a snapshot,
+    whose vector store is empty.
+
     Logs the result and returns the number of orphan embeddings
     (0 = consistent, -1 = check could not run).
     """
     try:
         vstore = idx.vector_store
-        emb = getattr(getattr(vstore, "data", None), "embedding_dict", None)
+        emb = embedding_ids
+        if emb is None:
+            emb = getattr(getattr(vstore, "data", None), "embedding_dict", None)
         if emb is None:
             emb = getattr(getattr(vstore, "_data", None), "embedding_dict", None)
         if emb is None:
@@ -190,7 +398,7 @@ def check_index_consistency(name, idx):
             )
             return -1
 
-        emb_ids = set(emb.keys())
+        emb_ids = set(emb)
         doc_ids = set(idx.docstore.docs.keys())
         orphans = emb_ids - doc_ids
         no_emb = doc_ids - emb_ids
@@ -214,31 +422,91 @@ def check_index_consistency(name, idx):
         return -1
 
 
-def read_all_indexes_from_storage(vector_map):
-    """Load all indexes into the singleton store."""
-    found_any = False
+def _load_index(name, storage, background=False):
+    """Load one index version with its derived data attached; returns (index, orphan embeddings).
 
-    for item in vector_map:
-        start = time.time()
-        name = item['name']
-        storage = item['storage']
-        desc = item['description']
-        logging.info("-------------------------------")
+    With ``background``, derived data that is not on disk for this version
+    yet is built on a separate thread and the index is returned without it
+    (requests fall back to building what they need).
+    """
+    logging.info(f"Loading index '{name}' from {storage}")
+    # A binary snapshot (index_snapshot.py) loads without parsing the
+    # JSON stores and comes with its dense matrix prebuilt.
+    snapshot = try_load_snapshot(name, storage)
+    if snapshot is not None:
+        idx, matrix = snapshot
+    else:
+        storage_ctx = StorageContext.from_defaults(persist_dir=storage)
+        idx = load_index_from_storage(storage_ctx)
+        matrix = None
+    # Flag a vector-store/docstore mismatch right at load (e.g. after a
+    # rebuild) so a corrupt index surfaces in the startup log.
+    orphans = check_index_consistency(name, idx, matrix.ids if matrix is not None else None)
+    # Pack the embeddings into one normalized float32 matrix so
+    # retrieval is a single matvec instead of a per-node Python loop.
+    attach_dense_matrix(name, idx, matrix)
+    # Derived data is read back from <storage>/.derived/<fingerprint>/
+    # when this version of the index was loaded before.
+    fingerprint = derived_cache.register(idx, storage)
+    logging.info(f"Index '{name}' fingerprint: {fingerprint}")
+    if background and not all(derived_cache.has(idx, f) for f in (ARTIFACTS_FILE, index_catalog.CATALOG_FILE)):
+        threading.Thread(target=_attach_derived, args=(name, idx), name=f"derive-{name}", daemon=True).start()
+    else:
+        _attach_derived(name, idx)
+    return idx, orphans
+
+
+def _attach_derived(name, idx):
+    # Per-node derived data (normalized text, display id, token
+    # counts per break).
+    attach_node_artifacts(name, idx)
+    # What /categories and /documents serve.
+    index_catalog.warm(name, idx)
 
-        if os.path.exists(storage):
-            logging.info(f"Loading index '{name}' from {storage}")
-            storage_ctx = StorageContext.from_defaults(persist_dir=storage)
-            idx = load_index_from_storage(storage_ctx)
-            # correctly add to the store
-            vector_store.add(name, idx, desc)
-            # Flag a vector-store/docstore mismatch right at load (e.g. after a
-            # rebuild) so a corrupt index surfaces in the startup log.
-            check_index_consistency(name, idx)
-            found_any = True
-        else:
-            logging.warning(f"Index directory not found: {storage}")
 
-        elapsed = time.time() - start
-        logging.info(f"Time taken for {name}: {elapsed:.2f}s")
+def read_index_from_storage(item):
+    """Load one index into the singleton store; returns True when it was loaded.
 
-    return found_any
\ No newline at end of file
+    The index is added to the store only once everything below is attached,
+    and its state (vector_store.index_states) ends as ready, missing or
+    failed. Never raises: a broken index does not stop the others.
+    """
+    start = time.time()
+    name = item['name']
+    storage = item['storage']
+    desc = item['description']
+
+    if not os.path.exists(storage):
+        logging.warning(f"Index directory not found: {storage}")
+        vector_store.set_state(name, INDEX_MISSING)
+        return False
+
+    vector_store.set_state(name, INDEX_LOADING)
+    try:
+        # Derived data not on disk yet is built after the index is served.
+        idx, _ = _load_index(name, storage, background=True)
+        # New index version: cached final answers built on the old one
+        # are dropped.
+        register_answer_index(name, idx)
+        # correctly add to the store
+        vector_store.add(name, idx, desc)
+    except Exception:
+        logging.exception(f"Failed to load index '{name}' from {storage}")
+        vector_store.set_state(name, INDEX_FAILED)
+        return False
+
+    elapsed = time.time() - start
+    vector_store.set_state(
+        name, INDEX_READY, load_s=round(elapsed, 2), fingerprint=derived_cache.fingerprint_of(idx),
+    )
+    logging.info(f"Time taken for {name}: {elapsed:.2f}s")
+    return True
+
+
+def read_all_indexes_from_storage(vector_map):
+    """Load all indexes into the singleton store, one after another."""
+    found_any = False
+    for item in vector_map:
+        logging.info("-------------------------------")
+        found_any = read_index_from_storage(item) or found_any
+    return found_any
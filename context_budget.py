@@ -0,0 +1,157 @@
+# context_budget.py
+"""Token-budgeted context for the GROUNDED prompt.
+
+The old context builder capped the context at MAX_NODES_FOR_CONTEXT nodes of
+MAX_CHARS_PER_NODE characters each. Characters are a poor proxy for tokens,
+so prompt size (and with it cost and latency of the most expensive call)
+varied a lot between questions. This module fills the context by tokens
+instead:
+
+  * at index load, node_artifacts splits every node's text at
+    paragraph/sentence breaks ("\\n\\n", ". ") and stores the cumulative token
+    count at each break (``NodeTokens``);
+  * per request, ``build_context`` walks the nodes in rank order and adds each
+    one whole while it fits. It stops at the first node that does not fit,
+    after trimming that node to the last break inside the remaining budget.
+    No node may take more than CONTEXT_MAX_TOKENS_PER_NODE.
+
+The budget is CONTEXT_TOKEN_BUDGET, or a per-deployment value from
+CONTEXT_TOKEN_BUDGETS ("gpt-4.1-mini=6000,gpt-4o=4000"). 0 turns the budget off
+and brings back the character-based builder. Prompt sizes are published in
+``metrics`` under "context_budget".
+"""
+
+import logging
+import os
+import textwrap
+import threading
+from typing import Any, Dict, List, Tuple
+
+from agent_shared import _node_text
+from llm_scheduler import chat_model_of, deployment_key
+from metrics import register_metrics
+from node_artifacts import artifacts_for, count_tokens, tokenizer_label
+
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000") or 0)
+CONTEXT_MAX_TOKENS_PER_NODE = int(os.getenv("CONTEXT_MAX_TOKENS_PER_NODE", "700") or 0)
+
+# A node trimmed below this is not worth its header; assembly stops instead.
+_MIN_NODE_TOKENS = 40
+
+
+def _parse_budgets(raw: str) -> Dict[str, int]:
+    budgets: Dict[str, int] = {}
+    for item in (raw or "").split(","):
+        name, sep, value = item.partition("=")
+        if not sep or not name.strip():
+            continue
+        try:
+            budgets[name.strip()] = int(value)
+        except ValueError:
+            logging.warning("CONTEXT_TOKEN_BUDGETS: ignoring %r", item)
+    return budgets
+
+
+CONTEXT_TOKEN_BUDGETS = _parse_budgets(os.getenv("CONTEXT_TOKEN_BUDGETS", ""))
+
+_lock = threading.Lock()
+_counters: Dict[str, int] = {
+    "prompts": 0,
+    "prompt_tokens": 0,
+    "context_tokens": 0,
+    "nodes_used": 0,
+    "nodes_trimmed": 0,
+    "nodes_dropped": 0,
+}
+
+
+def context_token_budget(llm: Any) -> int:
+    """Context budget for ``llm``: its CONTEXT_TOKEN_BUDGETS entry, else CONTEXT_TOKEN_BUDGET."""
+    if CONTEXT_TOKEN_BUDGETS:
+        model = chat_model_of(llm)
+        names = [deployment_key(llm).split("|", 1)[-1], *(getattr(model, "member_names", None) or [])]
+        for name in names:
+            # Pool members are named "deployment@endpoint" (or "...#n" when
+            # repeated); budgets are per deployment.
+            for candidate in (name, name.split("@", 1)[0].split("#", 1)[0]):
+                if candidate in CONTEXT_TOKEN_BUDGETS:
+                    return CONTEXT_TOKEN_BUDGETS[candidate]
+    return CONTEXT_TOKEN_BUDGET
+
+
+def build_context(
+    nodes: List[Any],
+    budget: int,
+    max_tokens_per_node: int = CONTEXT_MAX_TOKENS_PER_NODE,
+) -> Tuple[str, int, int]:
+    """Context text for ``nodes`` (rank order) within ``budget`` tokens.
+
+    Each node is rendered as "[display id]\\n<text>". Returns (context,
+    context tokens, nodes used).
+    """
+    parts: List[str] = []
+    used = trimmed = 0
+    separator = count_tokens("\n\n")
+    for nws in nodes:
+        node = getattr(nws, "node", nws)
+        text = _node_text(node).strip()
+        if not text:
+            continue
+        artifacts = artifacts_for(node)
+        header = f"[{artifacts.display_id}]\n"
+        overhead = count_tokens(header) + (separator if parts else 0)
+        left = budget - used - overhead
+        room = min(left, max_tokens_per_node) if max_tokens_per_node else left
+        if room < _MIN_NODE_TOKENS:
+            break
+
+        measured = artifacts.tokens
+        body, body_tokens = text, measured.total
+        if body_tokens > room:
+            end, body_tokens = measured.cut(room)
+            if body_tokens < room // 2:
+                # No boundary in the second half of the room: cut on a word
+                # instead of throwing most of the room away.
+                end = text.rfind(" ", 0, max(1, len(text) * room // measured.total))
+                body_tokens = count_tokens(text[:end]) if end > 0 else 0
+            if body_tokens <= 0:
+                break
+            body = text[:end]
+            trimmed += 1
+
+        parts.append(header + textwrap.dedent(body))
+        used += overhead + body_tokens
+        if body_tokens < measured.total and room == left:
+            # Trimmed by the budget itself: the context is full.
+            break
+
+    with _lock:
+        _counters["nodes_used"] += len(parts)
+        _counters["nodes_trimmed"] += trimmed
+        _counters["nodes_dropped"] += max(0, len(nodes) - len(parts))
+    return "\n\n".join(parts), used, len(parts)
+
+
+def record_prompt(prompt_tokens: int, context_tokens: int) -> None:
+    with _lock:
+        _counters["prompts"] += 1
+        _counters["prompt_tokens"] += prompt_tokens
+        _counters["context_tokens"] += context_tokens
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        counters = dict(_counters)
+    prompts = counters["prompts"]
+    return {
+        **counters,
+        "budget": CONTEXT_TOKEN_BUDGET,
+        "budgets": dict(CONTEXT_TOKEN_BUDGETS),
+        "tokenizer": tokenizer_label(),
+        "avg_prompt_tokens": round(counters["prompt_tokens"] / prompts, 1) if prompts else 0.0,
+        "avg_context_tokens": round(counters["context_tokens"] / prompts, 1) if prompts else 0.0,
+    }
+
+
+register_metrics("context_budget", stats)
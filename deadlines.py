@@ -0,0 +1,145 @@
+# deadlines.py
+"""Per-request time budget for the answer graph.
+
+Each /chat request gets a deadline: ANSWER_DEADLINE_S by default, or
+``deadline_s`` in the payload (at least ANSWER_DEADLINE_MIN_S). The deadline
+lives in two places:
+
+  * ``state["deadline"]``. Nodes read it to pick cheaper paths when
+    little time is left (``is_low``). The graph then skips the situational
+    filter, the entailment gate, the style rewrite (crisis style is kept) and
+    the related-question selection, and lists what it skipped under
+    ``degradations`` in query_status;
+  * a context variable set in answer_utils (``start``). langgraph copies it
+    into every node's thread or task, so the shared LLM/embedding call
+    helpers can turn the remaining budget into per-call timeouts
+    (``call_timeout``, ``timeout_kwargs``, ``await_within``) without a
+    deadline argument on every call.
+
+Times are ``time.monotonic()`` values, so they are only meaningful inside this
+process.
+"""
+
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, Optional, TypeVar
+
+from llm_scheduler import chat_model_of
+
+
+ANSWER_DEADLINE_S = float(os.getenv("ANSWER_DEADLINE_S", "90") or 0)
+# Below this much remaining budget, nodes switch to their cheaper paths.
+ANSWER_DEADLINE_LOW_S = float(os.getenv("ANSWER_DEADLINE_LOW_S", "15") or 0)
+# Smallest budget a client may ask for with ``deadline_s``: a tiny budget
+# would switch every node to its cheaper path from the start.
+ANSWER_DEADLINE_MIN_S = float(os.getenv("ANSWER_DEADLINE_MIN_S", "30") or 0)
+# Never give a call less than this, or it cannot even connect.
+MIN_CALL_TIMEOUT_S = 2.0
+
+# Chat classes whose invoke() forwards a per-call ``timeout`` to the HTTP client.
+_TIMEOUT_KWARG_MODELS = ("AzureChatOpenAI", "ChatOpenAI", "ChatAnthropic", "PooledChatModel")
+
+T = TypeVar("T")
+
+_deadline: ContextVar[Optional[float]] = ContextVar("answer_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget ran out before (or during) a call."""
+
+
+def request_budget(value: Any) -> float:
+    """The budget for a payload ``deadline_s``: raised to ANSWER_DEADLINE_MIN_S (0 = no deadline)."""
+    try:
+        budget = float(value or 0)
+    except (TypeError, ValueError):
+        return ANSWER_DEADLINE_S
+    if budget <= 0:
+        return 0.0
+    return max(budget, ANSWER_DEADLINE_MIN_S)
+
+
+def start(budget_s: Optional[float]) -> Optional[float]:
+    """Set this request's deadline ``budget_s`` from now (None/<=0 = no deadline); returns it."""
+    deadline = time.monotonic() + float(budget_s) if budget_s and float(budget_s) > 0 else None
+    _deadline.set(deadline)
+    return deadline
+
+
+def current() -> Optional[float]:
+    return _deadline.get()
+
+
+@contextmanager
+def capped(deadline: float):
+    """Within the block, this context's deadline is at most ``deadline`` (never extended)."""
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining(deadline: Optional[float] = None) -> Optional[float]:
+    """Seconds left until ``deadline`` (default: this context's), or None without a deadline."""
+    if deadline is None:
+        deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired() -> bool:
+    """True when this context's deadline has passed."""
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def is_low(deadline: Optional[float]) -> bool:
+    """True when the budget is nearly spent and nodes should take cheaper paths."""
+    left = remaining(deadline)
+    return left is not None and left < ANSWER_DEADLINE_LOW_S
+
+
+def check() -> None:
+    """Raise DeadlineExceeded when this context's deadline has passed."""
+    if expired():
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+def call_timeout() -> Optional[float]:
+    """Timeout for the next call in this context; raises DeadlineExceeded when the budget is gone."""
+    left = remaining()
+    if left is None:
+        return None
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return max(MIN_CALL_TIMEOUT_S, left)
+
+
+def timeout_kwargs(llm: Any) -> Dict[str, float]:
+    """``{"timeout": s}`` for invoke()/stream() when the chat client supports per-call timeouts."""
+    timeout = call_timeout()
+    if timeout is None or type(chat_model_of(llm)).__name__ not in _TIMEOUT_KWARG_MODELS:
+        return {}
+    return {"timeout": timeout}
+
+
+async def await_within(awaitable: Awaitable[T]) -> T:
+    """Await ``awaitable`` within the remaining budget (DeadlineExceeded on timeout)."""
+    try:
+        timeout = call_timeout()
+    except DeadlineExceeded:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+    if timeout is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError as e:
+        raise DeadlineExceeded("Request deadline exceeded") from e
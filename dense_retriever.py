@@ -0,0 +1,356 @@
+# dense_retriever.py
+"""NumPy-backed dense retrieval over a loaded VectorStoreIndex.
+
+SimpleVectorStore scores every node in Python (one cosine per node, per call).
+At load time we pack all embeddings of an index into one contiguous,
+row-normalized float32 matrix so a query becomes a single matrix-vector
+product followed by ``argpartition`` for the top-k.
+
+``DenseMatrixRetriever`` is a drop-in ``BaseRetriever``: same NodeWithScore
+output (nodes fetched from the index docstore, cosine score), same
+``similarity_top_k`` and the same (non-)handling of ``similarity_cutoff`` as
+``index.as_retriever`` — VectorIndexRetriever accepts the kwarg but never
+applies it, and callers rely on their own score thresholds downstream.
+
+Metadata filters on the hot keys (valid / severity / category) are answered
+from per-value boolean row masks built at load, so a filtered query is a few
+vectorized ORs/ANDs and only the matching rows are scored.
+
+Use ``build_retriever(index, ...)`` everywhere a retriever is needed; it falls
+back to ``index.as_retriever`` when no matrix is attached to the index or when
+DENSE_RETRIEVER_ENABLED=0.
+"""
+
+import logging
+import os
+import time
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from llama_index.core import VectorStoreIndex
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores import FilterCondition, FilterOperator, MetadataFilter, MetadataFilters
+from llama_index.core.vector_stores.utils import build_metadata_filter_fn
+
+
+DENSE_RETRIEVER_ENABLED = os.getenv("DENSE_RETRIEVER_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# Metadata keys that get a columnar value -> row-mask index at load time.
+# These are the keys _build_related_queries_retriever filters on; any other
+# key (or operator) still works through the per-row Python filter.
+INDEXED_METADATA_KEYS = ("valid", "severity", "category")
+
+# A filter mask keeping at least this share of rows scores the whole matrix
+# instead of gathering the rows first.
+_FULL_SCAN_FRACTION = 0.25
+
+# index object -> DenseEmbeddingMatrix. Weak keys so a cleared/reloaded index
+# releases its matrix together with the index itself.
+_DENSE_MATRICES: "weakref.WeakKeyDictionary[VectorStoreIndex, DenseEmbeddingMatrix]" = weakref.WeakKeyDictionary()
+
+
+def _vector_store_data(index: VectorStoreIndex):
+    vstore = getattr(index, "vector_store", None)
+    data = getattr(vstore, "data", None)
+    if data is None:
+        data = getattr(vstore, "_data", None)
+    return data
+
+
+class DenseEmbeddingMatrix:
+    """All embeddings of one index as a (n, d) float32 matrix with unit-norm rows."""
+
+    def __init__(self, ids: List[str], matrix: np.ndarray, metadata: List[Dict[str, Any]]):
+        if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+            raise ValueError(f"Matrix shape {matrix.shape} does not match {len(ids)} ids")
+        self.ids = ids
+        self.matrix = matrix
+        self.metadata = metadata
+        self.columns = self._build_columns(metadata, INDEXED_METADATA_KEYS)
+
+    @staticmethod
+    def _build_columns(metadata: List[Dict[str, Any]], keys) -> Dict[str, Dict[Any, np.ndarray]]:
+        """key -> {value: bool row mask}. Keys holding unhashable values are skipped."""
+        n = len(metadata)
+        columns: Dict[str, Dict[Any, np.ndarray]] = {}
+        for key in keys:
+            rows_by_value: Dict[Any, List[int]] = {}
+            try:
+                for row, meta in enumerate(metadata):
+                    value = meta.get(key)
+                    # build_metadata_filter_fn never matches a missing/None value.
+                    if value is not None:
+                        rows_by_value.setdefault(value, []).append(row)
+            except TypeError:
+                continue
+            masks: Dict[Any, np.ndarray] = {}
+            for value, rows in rows_by_value.items():
+                mask = np.zeros(n, dtype=bool)
+                mask[rows] = True
+                masks[value] = mask
+            columns[key] = masks
+        return columns
+
+    @property
+    def size(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    @classmethod
+    def from_embeddings(
+        cls,
+        ids: List[str],
+        embeddings: List[List[float]],
+        metadata: Optional[List[Dict[str, Any]]] = None,
+    ) -> "DenseEmbeddingMatrix":
+        matrix = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32))
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(ids), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        # Zero vectors stay zero (score 0.0) instead of producing NaN.
+        norms[norms == 0.0] = 1.0
+        matrix /= norms
+        return cls(list(ids), matrix, metadata if metadata is not None else [{} for _ in ids])
+
+    @classmethod
+    def from_index(cls, index: VectorStoreIndex) -> Optional["DenseEmbeddingMatrix"]:
+        """Build from the index's SimpleVectorStore; None if the store exposes no embedding_dict."""
+        data = _vector_store_data(index)
+        emb = getattr(data, "embedding_dict", None)
+        if not emb:
+            return None
+        meta = getattr(data, "metadata_dict", None) or {}
+
+        # as_retriever() restricts the search to the index_struct's node ids.
+        allowed = set(index.index_struct.nodes_dict.values())
+        ids = [nid for nid in emb.keys() if nid in allowed]
+        return cls.from_embeddings(
+            ids,
+            [emb[nid] for nid in ids],
+            [meta.get(nid) or {} for nid in ids],
+        )
+
+    def _column_mask(self, flt: MetadataFilter) -> Optional[np.ndarray]:
+        """Vectorized mask for one EQ/IN filter on an indexed key, else None."""
+        column = self.columns.get(flt.key)
+        if column is None:
+            return None
+        try:
+            if flt.operator == FilterOperator.EQ:
+                mask = column.get(flt.value)
+                return mask if mask is not None else np.zeros(self.size, dtype=bool)
+            if flt.operator == FilterOperator.IN and isinstance(flt.value, (list, tuple, set)):
+                mask = np.zeros(self.size, dtype=bool)
+                for value in flt.value:
+                    hit = column.get(value)
+                    if hit is not None:
+                        mask |= hit
+                return mask
+        except TypeError:
+            # Unhashable filter value — let the Python filter decide.
+            return None
+        return None
+
+    def _python_mask(self, filters: MetadataFilters) -> np.ndarray:
+        match = build_metadata_filter_fn(lambda row: self.metadata[row], filters)
+        return np.fromiter((match(i) for i in range(self.size)), dtype=bool, count=self.size)
+
+    def filter_mask(self, filters: Optional[MetadataFilters]) -> Optional[np.ndarray]:
+        """Boolean row mask for ``filters`` (None = every row).
+
+        EQ/IN filters on INDEXED_METADATA_KEYS are answered from the columnar
+        masks; the rest go through the same per-row predicate SimpleVectorStore
+        uses, so results are identical either way.
+        """
+        if filters is None or not filters.filters:
+            return None
+        if (
+            filters.condition not in (FilterCondition.AND, FilterCondition.OR)
+            or any(isinstance(f, MetadataFilters) for f in filters.filters)
+        ):
+            return self._python_mask(filters)
+
+        masks: List[np.ndarray] = []
+        leftovers: List[MetadataFilter] = []
+        for flt in filters.filters:
+            mask = self._column_mask(flt)
+            if mask is None:
+                leftovers.append(flt)
+            else:
+                masks.append(mask)
+
+        if leftovers:
+            masks.append(self._python_mask(MetadataFilters(filters=leftovers, condition=filters.condition)))
+
+        if filters.condition == FilterCondition.OR:
+            return np.logical_or.reduce(masks)
+        return np.logical_and.reduce(masks)
+
+    def top_k(
+        self,
+        query_embedding: List[float],
+        k: int,
+        mask: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (scores, row indices) of the k best rows, best first."""
+        q = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        q_norm = float(np.linalg.norm(q))
+        if q_norm > 0.0:
+            q = q / q_norm
+
+        if mask is None:
+            rows = None
+            scores = self.matrix @ q
+        else:
+            rows = np.flatnonzero(mask)
+            if rows.shape[0] >= _FULL_SCAN_FRACTION * self.size:
+                # Score every row and keep the masked ones: no copy of the
+                # selected rows (the matrix may be a shared memory map), and
+                # faster once the mask keeps a good share of them.
+                scores = (self.matrix @ q)[rows]
+            else:
+                scores = self.matrix[rows] @ q
+
+        n = scores.shape[0]
+        if n == 0 or k <= 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        if k < n:
+            part = np.argpartition(-scores, k - 1)[:k]
+        else:
+            part = np.arange(n)
+        order = part[np.argsort(-scores[part], kind="stable")]
+        top_scores = scores[order]
+        return top_scores, (order if rows is None else rows[order])
+
+
+class DenseMatrixRetriever(BaseRetriever):
+    """Drop-in replacement for ``index.as_retriever()`` backed by a DenseEmbeddingMatrix."""
+
+    def __init__(
+        self,
+        index: VectorStoreIndex,
+        matrix: DenseEmbeddingMatrix,
+        similarity_top_k: int = 2,
+        similarity_cutoff: Optional[float] = None,
+        filters: Optional[MetadataFilters] = None,
+        **kwargs: Any,
+    ) -> None:
+        self._index = index
+        self._matrix = matrix
+        self._similarity_top_k = similarity_top_k
+        # Kept for signature parity with VectorIndexRetriever, which swallows it
+        # without applying it. Callers filter on score themselves.
+        self._similarity_cutoff = similarity_cutoff
+        self._filters = filters
+        self._embed_model = index._embed_model
+        self._docstore = index.docstore
+        super().__init__(
+            callback_manager=kwargs.get("callback_manager") or index._callback_manager,
+            object_map=kwargs.get("object_map") or index._object_map,
+            verbose=kwargs.get("verbose", False),
+        )
+
+    @property
+    def similarity_top_k(self) -> int:
+        return self._similarity_top_k
+
+    @similarity_top_k.setter
+    def similarity_top_k(self, similarity_top_k: int) -> None:
+        self._similarity_top_k = similarity_top_k
+
+    def _search(self, embedding: List[float]) -> Tuple[List[str], List[float]]:
+        mask = self._matrix.filter_mask(self._filters)
+        scores, rows = self._matrix.top_k(embedding, self._similarity_top_k, mask)
+        ids = [self._matrix.ids[i] for i in rows]
+        return ids, [float(s) for s in scores]
+
+    def _to_scored_nodes(self, ids: List[str], scores: List[float], fetched) -> List[NodeWithScore]:
+        nodes_dict = self._index.index_struct.nodes_dict
+        by_id = {str(n.node_id): n for n in fetched}
+        out: List[NodeWithScore] = []
+        for vid, score in zip(ids, scores):
+            if vid not in nodes_dict:
+                raise KeyError(f"Node ID {vid} not found in index. ")
+            node_id = str(nodes_dict[vid])
+            if node_id not in by_id:
+                raise KeyError(f"Node ID {node_id} not found in fetched nodes. ")
+            out.append(NodeWithScore(node=by_id[node_id], score=score))
+        return out
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if query_bundle.embedding is None and len(query_bundle.embedding_strs) > 0:
+            query_bundle.embedding = self._embed_model.get_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        ids, scores = self._search(query_bundle.embedding)
+        if not ids:
+            return []
+        nodes_dict = self._index.index_struct.nodes_dict
+        fetched = self._docstore.get_nodes(
+            [nodes_dict[i] for i in ids if i in nodes_dict], raise_error=False
+        )
+        return self._to_scored_nodes(ids, scores, fetched)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        embedding = query_bundle.embedding
+        if embedding is None and len(query_bundle.embedding_strs) > 0:
+            embedding = await self._embed_model.aget_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        ids, scores = self._search(embedding)
+        if not ids:
+            return []
+        nodes_dict = self._index.index_struct.nodes_dict
+        fetched = await self._docstore.aget_nodes(
+            [nodes_dict[i] for i in ids if i in nodes_dict], raise_error=False
+        )
+        return self._to_scored_nodes(ids, scores, fetched)
+
+
+def attach_dense_matrix(
+    name: str,
+    index: VectorStoreIndex,
+    matrix: Optional[DenseEmbeddingMatrix] = None,
+) -> Optional[DenseEmbeddingMatrix]:
+    """Build the dense matrix for a freshly loaded index (or take a prebuilt one) and register it.
+
+    Never raises: on failure the index keeps using the stock retriever.
+    """
+    if not DENSE_RETRIEVER_ENABLED:
+        return None
+    try:
+        start = time.time()
+        if matrix is None:
+            matrix = DenseEmbeddingMatrix.from_index(index)
+        if matrix is None:
+            logging.warning("Index '%s': no embedding_dict — dense retriever disabled for this index.", name)
+            return None
+        _DENSE_MATRICES[index] = matrix
+        logging.info(
+            "Index '%s': dense matrix %d x %d (%.1f MB) built in %.2fs",
+            name, matrix.size, matrix.dim, matrix.matrix.nbytes / 1e6, time.time() - start,
+        )
+        return matrix
+    except Exception:
+        logging.exception("Could not build dense matrix for index '%s' — using stock retriever", name)
+        return None
+
+
+def get_dense_matrix(index: VectorStoreIndex) -> Optional[DenseEmbeddingMatrix]:
+    try:
+        return _DENSE_MATRICES.get(index)
+    except TypeError:
+        return None
+
+
+def build_retriever(index: VectorStoreIndex, **kwargs: Any) -> BaseRetriever:
+    """``index.as_retriever(**kwargs)`` — served from the dense matrix when one is attached."""
+    matrix = get_dense_matrix(index) if DENSE_RETRIEVER_ENABLED else None
+    if matrix is None:
+        return index.as_retriever(**kwargs)
+    return DenseMatrixRetriever(index, matrix, **kwargs)
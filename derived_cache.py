@@ -0,0 +1,194 @@
+# derived_cache.py
+"""Data derived from a persisted index, kept on disk under the index's fingerprint.
+
+Several structures are computed from the docstore of every loaded index:
+the node artifacts (node_artifacts.py), the /categories and /documents
+lists (index_catalog.py) and the /examples pools (answer_utils). Here each
+loaded index gets a content fingerprint, and each of those structures is
+written as JSON to
+
+    <index dir>/.derived/<fingerprint>/<name>.json
+
+and read back instead of rebuilt while the index files are unchanged.
+When they change (a rebuild, a new snapshot), the fingerprint changes, the
+structures are rebuilt once and written under the new fingerprint, and the
+directories of older fingerprints are removed.
+
+The fingerprint hashes docstore.json and index_store.json in full, and
+default__vector_store.json by its size plus its first and last MiB
+(snapshot/manifest.json and snapshot/index_store.json for a snapshot-only
+directory). Everything derived here comes from the node texts, so any edit
+of the docstore, even one that keeps node ids and file size, gives a new
+fingerprint; the docstore is read at load anyway, so hashing it costs one
+more pass over warm pages. Embeddings only change along with the texts,
+which is why a sample of the vector store is enough. Unlike the files'
+mtimes the fingerprint is the same on every instance serving the same
+copy, which is what /healthz shows it for.
+
+With INDEX_DERIVED_CACHE off, or a read-only index directory, everything
+still works: the structures are just rebuilt on every start.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import weakref
+from typing import Any, Dict, Optional, Tuple
+
+from llama_index.core import VectorStoreIndex
+
+from metrics import register_metrics
+
+
+INDEX_DERIVED_CACHE = os.getenv("INDEX_DERIVED_CACHE", "true").strip().lower() in ("1", "true", "yes", "on")
+
+DERIVED_DIR = ".derived"
+
+_SAMPLE_BYTES = 1 << 20
+_CHUNK_BYTES = 4 << 20
+_STORE_FILES = ("docstore.json", "index_store.json", "default__vector_store.json")
+_SNAPSHOT_FILES = (os.path.join("snapshot", "manifest.json"), os.path.join("snapshot", "index_store.json"))
+# Hashed by size and first/last MiB only; every other file is hashed in full.
+_SAMPLED_FILES = ("default__vector_store.json",)
+
+_lock = threading.Lock()
+# index object -> (index dir, fingerprint)
+_LOCATIONS: "weakref.WeakKeyDictionary[VectorStoreIndex, Tuple[str, str]]" = weakref.WeakKeyDictionary()
+_counters: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "writes": 0,
+    "write_errors": 0,
+}
+
+
+def _hash_file(h: "hashlib._Hash", path: str) -> None:
+    size = os.path.getsize(path)
+    h.update(f"{os.path.basename(path)}:{size}\n".encode("utf-8"))
+    with open(path, "rb") as f:
+        if os.path.basename(path) not in _SAMPLED_FILES or size <= 2 * _SAMPLE_BYTES:
+            for chunk in iter(lambda: f.read(_CHUNK_BYTES), b""):
+                h.update(chunk)
+        else:
+            h.update(f.read(_SAMPLE_BYTES))
+            f.seek(-_SAMPLE_BYTES, os.SEEK_END)
+            h.update(f.read(_SAMPLE_BYTES))
+
+
+def fingerprint(persist_dir: str) -> Optional[str]:
+    """Content fingerprint of the index in ``persist_dir``, or None when it has no index files."""
+    paths = [os.path.join(persist_dir, rel) for rel in _STORE_FILES]
+    if not any(os.path.isfile(p) for p in paths):
+        paths = [os.path.join(persist_dir, rel) for rel in _SNAPSHOT_FILES]
+    paths = [p for p in paths if os.path.isfile(p)]
+    if not paths:
+        return None
+    h = hashlib.blake2b(digest_size=10)
+    try:
+        for path in paths:
+            _hash_file(h, path)
+    except OSError as e:
+        logging.warning("Could not fingerprint %s: %s", persist_dir, e)
+        return None
+    return h.hexdigest()
+
+
+def register(index: VectorStoreIndex, persist_dir: str) -> Optional[str]:
+    """Fingerprint a freshly loaded index and remember where its derived data lives."""
+    fp = fingerprint(persist_dir)
+    if fp is not None:
+        with _lock:
+            _LOCATIONS[index] = (persist_dir, fp)
+    return fp
+
+
+def fingerprint_of(index: VectorStoreIndex) -> Optional[str]:
+    with _lock:
+        location = _LOCATIONS.get(index)
+    return location[1] if location else None
+
+
+def _path(index: VectorStoreIndex, name: str) -> Optional[str]:
+    if not INDEX_DERIVED_CACHE:
+        return None
+    with _lock:
+        location = _LOCATIONS.get(index)
+    if location is None:
+        return None
+    persist_dir, fp = location
+    return os.path.join(persist_dir, DERIVED_DIR, fp, name)
+
+
+def has(index: VectorStoreIndex, name: str) -> bool:
+    """Whether ``name`` is on disk for this version of ``index``."""
+    path = _path(index, name)
+    return path is not None and os.path.isfile(path)
+
+
+def load(index: VectorStoreIndex, name: str, version: Any) -> Optional[Any]:
+    """The stored ``name`` of ``index``, or None when missing, unreadable or of another ``version``."""
+    path = _path(index, name)
+    if path is None:
+        return None
+    data = None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning("Ignoring unreadable %s: %s", path, e)
+    found = isinstance(data, dict) and data.get("version") == version
+    with _lock:
+        _counters["hits" if found else "misses"] += 1
+    return data.get("data") if found else None
+
+
+def store(index: VectorStoreIndex, name: str, version: Any, data: Any) -> None:
+    """Write ``name`` for this version of ``index`` and drop older fingerprints. Never raises."""
+    path = _path(index, name)
+    if path is None:
+        return
+    directory = os.path.dirname(path)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "data": data}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+    except (OSError, TypeError, ValueError) as e:
+        logging.warning("Could not persist %s: %s", path, e)
+        with _lock:
+            _counters["write_errors"] += 1
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return
+    with _lock:
+        _counters["writes"] += 1
+    _prune(os.path.dirname(directory), os.path.basename(directory))
+
+
+def _prune(root: str, keep: str) -> None:
+    try:
+        entries = os.listdir(root)
+    except OSError:
+        return
+    for entry in entries:
+        if entry != keep:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        out = dict(_counters)
+        out["indexes"] = len(_LOCATIONS)
+    out["enabled"] = INDEX_DERIVED_CACHE
+    return out
+
+
+register_metrics("derived_cache", stats)
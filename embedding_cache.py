@@ -0,0 +1,274 @@
+# embedding_cache.py
+"""Query-embedding cache around the configured embed model.
+
+One /chat request embeds the same refined query several times (main
+retriever, related-questions retriever), and popular questions repeat across
+sessions. ``CachedEmbedding`` wraps the real embed model with:
+
+  * an in-process LRU keyed by (model, deployment, normalized text), and
+  * an optional diskcache tier (EMBEDDINGS_CACHE_DIR) that survives restarts.
+
+Only *query* embeddings are cached; document/text embedding (index builds)
+goes straight to the wrapped model. Hit/miss counters are published through
+``metrics`` under "embedding_cache".
+
+``embed_queries`` embeds several queries at once (refined query + all
+subqueries) — cache hits are served locally and the misses go out in a single
+backend request when the model embeds queries and texts the same way.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from pydantic import PrivateAttr
+
+from metrics import register_metrics
+
+
+_WS_RE = re.compile(r"\s+")
+
+
+def _normalize_query(text: str) -> str:
+    # Same text modulo Unicode form and whitespace => same vector. Case is kept:
+    # the embedding model is case-sensitive, so folding it would change results.
+    return _WS_RE.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+def _query_equals_text(model: BaseEmbedding) -> bool:
+    # OpenAI/Azure embeddings use the same engine for queries and documents
+    # (except legacy *-search-* models), so a query batch can go through the
+    # batched text endpoint and yield exactly the query vectors.
+    query_engine = getattr(model, "_query_engine", None)
+    return query_engine is not None and query_engine == getattr(model, "_text_engine", None)
+
+
+def _embed_query_batch(model: BaseEmbedding, texts: List[str]) -> List[Embedding]:
+    if len(texts) > 1 and _query_equals_text(model):
+        return model._get_text_embeddings(texts)
+    return [model._get_query_embedding(t) for t in texts]
+
+
+async def _aembed_query_batch(model: BaseEmbedding, texts: List[str]) -> List[Embedding]:
+    if len(texts) > 1 and _query_equals_text(model):
+        return await model._aget_text_embeddings(texts)
+    return [await model._aget_query_embedding(t) for t in texts]
+
+
+class CachedEmbedding(BaseEmbedding):
+    """BaseEmbedding that serves repeated query embeddings from memory/disk."""
+
+    cache_size: int = 2048
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _namespace: str = PrivateAttr(default="")
+    _lru: "OrderedDict[str, Embedding]" = PrivateAttr(default_factory=OrderedDict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _disk: Any = PrivateAttr(default=None)
+    _disk_ttl: Optional[float] = PrivateAttr(default=None)
+    _counters: Dict[str, int] = PrivateAttr(default_factory=dict)
+
+    def __init__(
+        self,
+        inner: BaseEmbedding,
+        cache_size: int = 2048,
+        cache_dir: Optional[str] = None,
+        disk_ttl_s: Optional[float] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            callback_manager=inner.callback_manager,
+            cache_size=cache_size,
+            **kwargs,
+        )
+        self._inner = inner
+        # Key on the real backend, not on wrappers such as GuardedEmbedding.
+        backend = getattr(inner, "inner", inner)
+        deployment = (
+            getattr(backend, "azure_deployment", None)
+            or getattr(backend, "deployment_name", None)
+            or ""
+        )
+        self._namespace = f"{type(backend).__name__}|{backend.model_name}|{deployment}"
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._disk_ttl = disk_ttl_s or None
+        if cache_dir:
+            try:
+                import diskcache
+                self._disk = diskcache.Cache(cache_dir)
+            except Exception:
+                logging.exception("Could not open embedding disk cache at %s — memory only", cache_dir)
+                self._disk = None
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    # ---------- cache plumbing ----------
+
+    def _key(self, text: str) -> str:
+        raw = f"{self._namespace}|query|{_normalize_query(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[Embedding]:
+        with self._lock:
+            hit = self._lru.get(key)
+            if hit is not None:
+                self._lru.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return hit
+        if self._disk is not None:
+            try:
+                hit = self._disk.get(key)
+            except Exception:
+                logging.exception("Embedding disk cache read failed")
+                hit = None
+            if hit is not None:
+                self._remember(key, hit, to_disk=False)
+                with self._lock:
+                    self._counters["disk_hits"] += 1
+                return hit
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def _remember(self, key: str, embedding: Embedding, to_disk: bool = True) -> None:
+        with self._lock:
+            self._lru[key] = embedding
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.cache_size:
+                self._lru.popitem(last=False)
+        if to_disk and self._disk is not None:
+            try:
+                self._disk.set(key, embedding, expire=self._disk_ttl)
+            except Exception:
+                logging.exception("Embedding disk cache write failed")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._lru)
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        return {
+            **counters,
+            "memory_entries": size,
+            "memory_capacity": self.cache_size,
+            "disk_enabled": self._disk is not None,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lru.clear()
+
+    def _partition(self, queries: List[str]):
+        keys = [self._key(q) for q in queries]
+        out: List[Optional[Embedding]] = [self._lookup(k) for k in keys]
+        missing: Dict[str, str] = {}
+        for key, query, hit in zip(keys, queries, out):
+            if hit is None and key not in missing:
+                missing[key] = query
+        return keys, out, missing
+
+    def _merge(self, keys, out, missing, vectors) -> List[Embedding]:
+        fresh = dict(zip(missing.keys(), vectors))
+        for key, vector in fresh.items():
+            self._remember(key, vector)
+        return [hit if hit is not None else fresh[key] for key, hit in zip(keys, out)]
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[Embedding]:
+        """Query embeddings for ``queries``; all misses in one backend call."""
+        keys, out, missing = self._partition(queries)
+        if not missing:
+            return out  # type: ignore[return-value]
+        vectors = _embed_query_batch(self._inner, list(missing.values()))
+        return self._merge(keys, out, missing, vectors)
+
+    async def aget_query_embedding_batch(self, queries: List[str]) -> List[Embedding]:
+        """Async twin of ``get_query_embedding_batch``."""
+        keys, out, missing = self._partition(queries)
+        if not missing:
+            return out  # type: ignore[return-value]
+        vectors = await _aembed_query_batch(self._inner, list(missing.values()))
+        return self._merge(keys, out, missing, vectors)
+
+    # ---------- BaseEmbedding ----------
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        key = self._key(query)
+        hit = self._lookup(key)
+        if hit is not None:
+            return hit
+        embedding = self._inner._get_query_embedding(query)
+        self._remember(key, embedding)
+        return embedding
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        key = self._key(query)
+        hit = self._lookup(key)
+        if hit is not None:
+            return hit
+        embedding = await self._inner._aget_query_embedding(query)
+        self._remember(key, embedding)
+        return embedding
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._inner._get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await self._inner._aget_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._inner._get_text_embeddings(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await self._inner._aget_text_embeddings(texts)
+
+
+def embed_queries(embed_model: BaseEmbedding, queries: List[str]) -> List[Embedding]:
+    """Embed several queries, batched into one request where the backend allows it."""
+    if not queries:
+        return []
+    if isinstance(embed_model, CachedEmbedding):
+        return embed_model.get_query_embedding_batch(queries)
+    return _embed_query_batch(embed_model, queries)
+
+
+async def aembed_queries(embed_model: BaseEmbedding, queries: List[str]) -> List[Embedding]:
+    """Async twin of ``embed_queries``."""
+    if not queries:
+        return []
+    if isinstance(embed_model, CachedEmbedding):
+        return await embed_model.aget_query_embedding_batch(queries)
+    return await _aembed_query_batch(embed_model, queries)
+
+
+def wrap_with_cache(
+    inner: BaseEmbedding,
+    *,
+    cache_size: int,
+    cache_dir: Optional[str] = None,
+    disk_ttl_s: Optional[float] = None,
+) -> BaseEmbedding:
+    """Wrap ``inner`` in a CachedEmbedding and publish its stats. cache_size <= 0 disables."""
+    if cache_size <= 0:
+        return inner
+    cached = CachedEmbedding(inner, cache_size=cache_size, cache_dir=cache_dir, disk_ttl_s=disk_ttl_s)
+    register_metrics("embedding_cache", cached.stats)
+    logging.info(
+        "Query-embedding cache enabled (memory=%d entries, disk=%s)",
+        cache_size, cache_dir or "off",
+    )
+    return cached
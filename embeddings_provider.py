@@ -4,6 +4,10 @@ Kept separate from llm_provider.py because the chat-LLM and the embeddings
 backend are independent choices. Anthropic doesn't offer an embeddings API,
 so when LLM_PROVIDER=anthropic the embeddings can still come from Azure
 OpenAI (or OpenAI direct, Voyage, etc.) without any change to the workflow.
+
+Whatever backend is picked gets wrapped in a circuit breaker
+(circuit_breaker.GuardedEmbedding) and then in the query-embedding cache
+(embedding_cache.py) unless EMBEDDINGS_CACHE_SIZE=0.
 """
 
 import os
@@ -11,18 +15,30 @@ import os
 from llama_index.core import Settings
 from llama_index.embeddings.azure_openai import AzureOpenAIEmbedding
 
+from circuit_breaker import GuardedEmbedding
+from embedding_cache import wrap_with_cache
+
+
+def _with_query_cache(embed_model):
+    return wrap_with_cache(
+        GuardedEmbedding(embed_model),
+        cache_size=int(os.getenv("EMBEDDINGS_CACHE_SIZE", "2048")),
+        cache_dir=os.getenv("EMBEDDINGS_CACHE_DIR") or None,
+        disk_ttl_s=float(os.getenv("EMBEDDINGS_CACHE_TTL_S", "0")) or None,
+    )
+
 
 def configure_embeddings() -> None:
     provider = os.getenv("EMBEDDINGS_PROVIDER", "azure_openai").lower()
 
     if provider == "azure_openai":
-        Settings.embed_model = AzureOpenAIEmbedding(
+        Settings.embed_model = _with_query_cache(AzureOpenAIEmbedding(
             model=os.getenv("AZURE_OPENAI_EMBEDDINGS_MODEL"),
             deployment_name=os.getenv("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT"),
             api_key=os.getenv("AZURE_OPENAI_EMBEDDINGS_API_KEY"),
             azure_endpoint=os.getenv("AZURE_OPENAI_EMBEDDINGS_ENDPOINT"),
             api_version=os.getenv("AZURE_OPENAI_EMBEDDINGS_API_VERSION"),
-        )
+        ))
         return
 
     raise ValueError(
@@ -53,8 +53,10 @@ add_table(
     ],
 )
 doc.add_paragraph(
-    "Indeksene lastes asynkront i bakgrunnen ved oppstart, og /healthz "
-    "rapporterer når de er klare."
+    "Indeksene lastes asynkront og samtidig i bakgrunnen ved oppstart, og /healthz "
+    "rapporterer tilstanden og fingeravtrykket (hash av indeksfilene) til hver "
+    "indeks. Et endepunkt svarer 503 bare mens en indeks det selv trenger, "
+    "fortsatt lastes."
 )
 
 # --- Client ---
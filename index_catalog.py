@@ -0,0 +1,98 @@
+# index_catalog.py
+"""The lists /categories and /documents serve, built once per loaded index.
+
+Both endpoints used to walk every docstore node on every request. Here
+they are derived once per index object, when it loads (``warm``) or on
+first use, and kept in a side table with weak keys, so a reloaded index
+gets fresh lists and the old ones go with the old index:
+
+  * ``categories(index)`` — sorted distinct values of the nodes'
+    "categories" metadata;
+  * ``documents(index)``  — one entry per source document (nodes
+    deduplicated by "url"), sorted by title.
+
+The lists are also written next to the index (derived_cache.py) and read
+back instead of rebuilt while the index files are unchanged.
+"""
+
+import logging
+import threading
+import time
+import weakref
+from typing import Any, Dict, List
+
+from llama_index.core import VectorStoreIndex
+
+import derived_cache
+
+
+_lock = threading.Lock()
+# index object -> {"categories": [...], "documents": [...]}
+_CATALOGS: "weakref.WeakKeyDictionary[VectorStoreIndex, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+
+CATALOG_FILE = "catalog.json"
+_FORMAT = 1
+
+
+def _build(index: VectorStoreIndex) -> Dict[str, Any]:
+    seen: set = set()
+    by_url: Dict[str, Dict[str, Any]] = {}
+    for node in index.docstore.docs.values():
+        meta = getattr(node, "metadata", None) or {}
+
+        cats = meta.get("categories")
+        if isinstance(cats, list):
+            for c in cats:
+                c = str(c).strip()
+                if c:
+                    seen.add(c)
+
+        url = (meta.get("url") or "").strip()
+        if not url or url in by_url:
+            continue
+        by_url[url] = {
+            "url": url,
+            "title": (meta.get("title") or "").strip(),
+            "category": (meta.get("category") or "").strip(),
+            "categories": cats if isinstance(cats, list) else [],
+            "description": (meta.get("description") or "").strip(),
+        }
+
+    return {
+        "categories": sorted(seen),
+        "documents": sorted(by_url.values(), key=lambda d: d["title"].casefold()),
+    }
+
+
+def _catalog(index: VectorStoreIndex) -> Dict[str, Any]:
+    with _lock:
+        catalog = _CATALOGS.get(index)
+    if catalog is None:
+        catalog = derived_cache.load(index, CATALOG_FILE, _FORMAT)
+        if not isinstance(catalog, dict):
+            catalog = _build(index)
+            derived_cache.store(index, CATALOG_FILE, _FORMAT, catalog)
+        with _lock:
+            catalog = _CATALOGS.setdefault(index, catalog)
+    return catalog
+
+
+def warm(name: str, index: VectorStoreIndex) -> None:
+    """Build (or read back) the lists for a freshly loaded index. Never raises (they are built on first use instead)."""
+    try:
+        start = time.time()
+        catalog = _catalog(index)
+        logging.info(
+            "Index '%s': catalog of %d categories, %d documents in %.2fs",
+            name, len(catalog["categories"]), len(catalog["documents"]), time.time() - start,
+        )
+    except Exception:
+        logging.exception("Could not build the catalog for index '%s'", name)
+
+
+def categories(index: VectorStoreIndex) -> List[str]:
+    return _catalog(index)["categories"]
+
+
+def documents(index: VectorStoreIndex) -> List[Dict[str, Any]]:
+    return _catalog(index)["documents"]
@@ -0,0 +1,398 @@
+# index_snapshot.py
+"""Compact binary snapshot of a persisted index, and a loader for it.
+
+``load_index_from_storage`` parses docstore.json and
+default__vector_store.json into Python dicts and lists: every embedding
+becomes a list of 3072 Python floats, every node a nested dict. That parse
+is most of the cold start (the server answers 503 until it is done), and
+the parsed lists stay in memory next to the dense matrix built from them.
+
+``convert(persist_dir)`` (offline, see below) writes the same index as a
+snapshot under ``<persist_dir>/snapshot/``:
+
+  * ``embeddings.npy``  — (n, d) float32, unit-norm rows, exactly the
+                           matrix ``DenseEmbeddingMatrix.from_index`` builds;
+  * ``ids.json``         — matrix row -> vector id, and docstore row -> node id;
+  * ``<column>.npy`` + ``<column>_offsets.npy`` — one UTF-8 blob per column
+    and the byte offsets of each row in it: ``text`` (node text),
+    ``metadata`` (node metadata, JSON), ``node`` (the rest of the stored
+    node, JSON) and ``vector_metadata`` (the vector store's metadata per
+    matrix row, used by metadata filters);
+  * ``index_store.json`` and ``collections.json`` — the index struct and the
+    small docstore collections (ref doc info, hashes), as stored;
+  * ``manifest.json``    — format, sizes and the size/mtime of the JSON files
+    the snapshot was built from.
+
+``load_snapshot(persist_dir)`` returns the index and its dense matrix. The
+docstore is a ``KVDocumentStore`` over ``SnapshotKVStore``, which decodes a
+node from the columns when it is asked for, so ``docstore.docs``,
+``get_node``, ``get_document`` and the retrievers work as before. The
+vector store is empty: only ``DenseMatrixRetriever`` can search a snapshot,
+so snapshots are not used with DENSE_RETRIEVER_ENABLED off. A snapshot is
+skipped (and the JSON files loaded) when it is missing, has another format,
+or was built from JSON files that have since changed.
+
+With INDEX_SNAPSHOT_MMAP on, the embedding matrix and the column blobs are
+memory-mapped read-only instead of read into memory. Every Hypercorn worker
+loads its own index, but the mapped pages come from the page cache, so the
+largest parts of the indexes are held once per machine rather than once
+per worker. Retrieval computes on the mapping directly. Converting again
+while the server runs is safe: the old files stay mapped until the index is
+reloaded.
+
+Convert after every index rebuild:
+
+    python index_snapshot.py ./blobstorage/chatbot/hvaerinnafor_unified [...]
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.index_store.simple_index_store import SimpleIndexStore
+from llama_index.core.storage.kvstore.types import DEFAULT_COLLECTION, BaseKVStore
+from llama_index.core.vector_stores.simple import SimpleVectorStore
+
+import dense_retriever
+from dense_retriever import DenseEmbeddingMatrix
+
+
+INDEX_SNAPSHOT = os.getenv("INDEX_SNAPSHOT", "true").strip().lower() in ("1", "true", "yes", "on")
+INDEX_SNAPSHOT_MMAP = os.getenv("INDEX_SNAPSHOT_MMAP", "true").strip().lower() in ("1", "true", "yes", "on")
+
+SNAPSHOT_DIR = "snapshot"
+# Bump when the layout or how a column is derived changes.
+_FORMAT = 1
+
+_DOCSTORE_FILE = "docstore.json"
+_VECTOR_STORE_FILE = "default__vector_store.json"
+_INDEX_STORE_FILE = "index_store.json"
+_SOURCE_FILES = (_DOCSTORE_FILE, _VECTOR_STORE_FILE, _INDEX_STORE_FILE)
+
+_NAMESPACE = "docstore"
+_DATA_COLLECTION = f"{_NAMESPACE}/data"
+
+
+def _source_fingerprint(persist_dir: str) -> Optional[Dict[str, List[int]]]:
+    """{file: [size, mtime_ns]} of the JSON files, or None when one is missing."""
+    out: Dict[str, List[int]] = {}
+    for name in _SOURCE_FILES:
+        try:
+            st = os.stat(os.path.join(persist_dir, name))
+        except OSError:
+            return None
+        out[name] = [st.st_size, st.st_mtime_ns]
+    return out
+
+
+# ---------- columns ----------
+
+def _write_column(path: str, name: str, rows: List[str]) -> None:
+    encoded = [row.encode("utf-8") for row in rows]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(os.path.join(path, f"{name}.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(path, f"{name}_offsets.npy"), offsets)
+
+
+def _load_array(path: str) -> np.ndarray:
+    """The array in ``path``: memory-mapped read-only with INDEX_SNAPSHOT_MMAP, else read into memory.
+
+    The mapping is returned as a plain ndarray view, so nothing downstream
+    can tell it apart (or copy it by accident through np.memmap's
+    subclass handling).
+    """
+    if INDEX_SNAPSHOT_MMAP:
+        try:
+            return np.asarray(np.load(path, mmap_mode="r"))
+        except ValueError:
+            # Zero-length arrays cannot be mapped.
+            pass
+    return np.load(path)
+
+
+class _Column:
+    """Rows of one column: a UTF-8 blob and the byte offset of each row."""
+
+    def __init__(self, path: str, name: str) -> None:
+        self.blob = _load_array(os.path.join(path, f"{name}.npy"))
+        self.offsets = _load_array(os.path.join(path, f"{name}_offsets.npy"))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        return self.blob[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+
+    def json(self, row: int) -> Any:
+        return json.loads(self[row])
+
+
+# ---------- converter ----------
+
+def _read_json(path: str) -> Any:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _allowed_vector_ids(index_store: Dict[str, Any]) -> Optional[set]:
+    """Node ids of the (single) vector index struct, or None when there is none."""
+    for entry in (index_store.get("index_store/data") or {}).values():
+        data = entry.get("__data__")
+        if isinstance(data, str):
+            data = json.loads(data)
+        if isinstance(data, dict) and "nodes_dict" in data:
+            return set(data["nodes_dict"].values())
+    return None
+
+
+def convert(persist_dir: str) -> Dict[str, Any]:
+    """Write ``<persist_dir>/snapshot`` from the JSON files; returns the manifest.
+
+    Reads the JSON files directly (no embedding model or LLM settings
+    needed) and replaces an existing snapshot only once the new one is
+    complete.
+    """
+    fingerprint = _source_fingerprint(persist_dir)
+    if fingerprint is None:
+        raise FileNotFoundError(f"{persist_dir}: missing one of {', '.join(_SOURCE_FILES)}")
+
+    docstore = _read_json(os.path.join(persist_dir, _DOCSTORE_FILE))
+    vectors = _read_json(os.path.join(persist_dir, _VECTOR_STORE_FILE))
+    index_store = _read_json(os.path.join(persist_dir, _INDEX_STORE_FILE))
+
+    # Matrix rows: same ids, order and normalization as DenseEmbeddingMatrix.from_index.
+    embedding_dict = vectors.get("embedding_dict") or {}
+    vector_meta = vectors.get("metadata_dict") or {}
+    allowed = _allowed_vector_ids(index_store)
+    vector_ids = [vid for vid in embedding_dict if allowed is None or vid in allowed]
+    matrix = DenseEmbeddingMatrix.from_embeddings(vector_ids, [embedding_dict[vid] for vid in vector_ids])
+    del embedding_dict
+
+    # Docstore rows: text and metadata in their own columns, the rest as stored.
+    data = docstore.pop(_DATA_COLLECTION, {}) or {}
+    node_ids = list(data)
+    texts: List[str] = []
+    metadata: List[str] = []
+    rest: List[str] = []
+    for node_id in node_ids:
+        entry = data[node_id]
+        fields = dict(entry.get("__data__") or {})
+        text = fields.pop("text", None)
+        if isinstance(text, str):
+            fields["__text__"] = True
+        else:
+            if text is not None:
+                fields["text"] = text
+            text = ""
+        texts.append(text)
+        metadata.append(json.dumps(fields.pop("metadata", {}) or {}, ensure_ascii=False))
+        rest.append(json.dumps({"__type__": entry.get("__type__"), "__data__": fields}, ensure_ascii=False))
+    del data
+
+    final = os.path.join(persist_dir, SNAPSHOT_DIR)
+    tmp = f"{final}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        np.save(os.path.join(tmp, "embeddings.npy"), matrix.matrix)
+        _write_column(tmp, "text", texts)
+        _write_column(tmp, "metadata", metadata)
+        _write_column(tmp, "node", rest)
+        _write_column(tmp, "vector_metadata", [
+            json.dumps(
+                {k: v for k, v in (vector_meta.get(vid) or {}).items() if k != "_node_content"},
+                ensure_ascii=False,
+            )
+            for vid in vector_ids
+        ])
+        with open(os.path.join(tmp, "ids.json"), "w", encoding="utf-8") as f:
+            json.dump({"vectors": vector_ids, "nodes": node_ids}, f, ensure_ascii=False)
+        with open(os.path.join(tmp, "collections.json"), "w", encoding="utf-8") as f:
+            json.dump(docstore, f, ensure_ascii=False)
+        shutil.copyfile(os.path.join(persist_dir, _INDEX_STORE_FILE), os.path.join(tmp, _INDEX_STORE_FILE))
+
+        manifest = {
+            "format": _FORMAT,
+            "vectors": len(vector_ids),
+            "nodes": len(node_ids),
+            "dim": int(matrix.dim) if vector_ids else 0,
+            "source": fingerprint,
+        }
+        # Written last: a snapshot without a manifest is never loaded.
+        with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+        old = f"{final}.old-{os.getpid()}"
+        if os.path.exists(final):
+            os.rename(final, old)
+        os.rename(tmp, final)
+        shutil.rmtree(old, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    known = set(node_ids)
+    missing = sum(1 for vid in vector_ids if vid not in known)
+    if missing:
+        logging.error("%s: %d embeddings reference node IDs missing from the docstore", persist_dir, missing)
+    return manifest
+
+
+# ---------- loader ----------
+
+class SnapshotKVStore(BaseKVStore):
+    """Read-only KV store serving the docstore collections of a snapshot.
+
+    "docstore/data" entries are decoded from the columns on each get, in
+    the form ``json_to_doc`` expects; the other collections come from
+    collections.json.
+    """
+
+    def __init__(self, path: str, node_ids: List[str]) -> None:
+        self._text = _Column(path, "text")
+        self._metadata = _Column(path, "metadata")
+        self._node = _Column(path, "node")
+        self._node_ids = node_ids
+        self._rows = {node_id: row for row, node_id in enumerate(node_ids)}
+        with open(os.path.join(path, "collections.json"), "r", encoding="utf-8") as f:
+            self._collections: Dict[str, Dict[str, Any]] = json.load(f)
+
+    def _entry(self, row: int) -> Dict[str, Any]:
+        entry = self._node.json(row)
+        fields = entry["__data__"]
+        if fields.pop("__text__", False):
+            fields["text"] = self._text[row]
+        fields["metadata"] = self._metadata.json(row)
+        return entry
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        if collection == _DATA_COLLECTION:
+            row = self._rows.get(key)
+            return None if row is None else self._entry(row)
+        return self._collections.get(collection, {}).get(key)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        if collection == _DATA_COLLECTION:
+            return {node_id: self._entry(row) for row, node_id in enumerate(self._node_ids)}
+        return dict(self._collections.get(collection, {}))
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        raise NotImplementedError("index snapshots are read-only")
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        raise NotImplementedError("index snapshots are read-only")
+
+    async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        return self.get(key, collection)
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return self.get_all(collection)
+
+    async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put(key, val, collection)
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection)
+
+
+def snapshot_status(persist_dir: str) -> str:
+    """"fresh", "missing", "stale" (JSON files changed since) or "format" (other format)."""
+    try:
+        manifest = _read_json(os.path.join(persist_dir, SNAPSHOT_DIR, "manifest.json"))
+    except FileNotFoundError:
+        return "missing"
+    except Exception:
+        return "format"
+    if manifest.get("format") != _FORMAT:
+        return "format"
+    current = _source_fingerprint(persist_dir)
+    # A snapshot deployed without its JSON files is taken as is.
+    if current is not None and current != manifest.get("source"):
+        return "stale"
+    return "fresh"
+
+
+def load_snapshot(persist_dir: str) -> Tuple[VectorStoreIndex, DenseEmbeddingMatrix]:
+    """The index and its dense matrix from ``<persist_dir>/snapshot``."""
+    path = os.path.join(persist_dir, SNAPSHOT_DIR)
+    with open(os.path.join(path, "ids.json"), "r", encoding="utf-8") as f:
+        ids = json.load(f)
+
+    docstore = KVDocumentStore(SnapshotKVStore(path, ids["nodes"]), namespace=_NAMESPACE)
+    storage_context = StorageContext.from_defaults(
+        docstore=docstore,
+        index_store=SimpleIndexStore.from_persist_path(os.path.join(path, _INDEX_STORE_FILE)),
+        vector_store=SimpleVectorStore(),
+    )
+    index = load_index_from_storage(storage_context)
+
+    vector_metadata = _Column(path, "vector_metadata")
+    matrix = DenseEmbeddingMatrix(
+        ids["vectors"],
+        _load_array(os.path.join(path, "embeddings.npy")),
+        [vector_metadata.json(row) for row in range(len(vector_metadata))],
+    )
+    return index, matrix
+
+
+def try_load_snapshot(name: str, persist_dir: str) -> Optional[Tuple[VectorStoreIndex, DenseEmbeddingMatrix]]:
+    """``load_snapshot`` when a fresh snapshot exists and can be used, else None (load the JSON files).
+
+    Never raises.
+    """
+    if not INDEX_SNAPSHOT:
+        return None
+    status = snapshot_status(persist_dir)
+    if status == "missing":
+        return None
+    if status != "fresh":
+        logging.warning("Index '%s': snapshot is %s — loading the JSON files. Re-run index_snapshot.py.",
+                        name, "out of date" if status == "stale" else "in another format")
+        return None
+    if not dense_retriever.DENSE_RETRIEVER_ENABLED:
+        logging.warning("Index '%s': snapshot needs the dense retriever (DENSE_RETRIEVER_ENABLED) — "
+                        "loading the JSON files.", name)
+        return None
+    try:
+        start = time.time()
+        index, matrix = load_snapshot(persist_dir)
+        logging.info("Index '%s': snapshot loaded in %.2fs (%d vectors x %d, %d nodes%s)",
+                     name, time.time() - start, matrix.size, matrix.dim, len(index.index_struct.nodes_dict),
+                     ", memory-mapped" if INDEX_SNAPSHOT_MMAP else "")
+        return index, matrix
+    except Exception:
+        logging.exception("Could not load snapshot of index '%s' — loading the JSON files", name)
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Write a binary snapshot next to each persisted index.")
+    ap.add_argument("persist_dirs", nargs="+", help="index directories (with docstore.json etc.)")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    failed = 0
+    for persist_dir in args.persist_dirs:
+        start = time.time()
+        try:
+            manifest = convert(persist_dir)
+        except Exception:
+            logging.exception("Could not convert %s", persist_dir)
+            failed += 1
+            continue
+        logging.info("%s: snapshot of %d vectors x %d, %d nodes written in %.2fs",
+                     persist_dir, manifest["vectors"], manifest["dim"], manifest["nodes"], time.time() - start)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
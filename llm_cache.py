@@ -0,0 +1,221 @@
+# llm_cache.py
+"""Content-addressed cache for deterministic structured LLM calls.
+
+All chat models run at temperature 0, and several auxiliary calls
+(``analyze_query``'s QueryPlan, the entailment gate, the situational node
+filter, related-question selection) see the exact same prompt for recurring
+questions. ``LLMResponseCache`` stores their *parsed* structured results keyed
+by
+
+    (model class, deployment/model name, temperature, schema name + JSON
+     schema hash, rendered prompt)
+
+in an in-process LRU, plus an optional diskcache tier (LLM_CACHE_DIR) with a
+TTL and a size bound. A hit replays the stored pydantic object and costs zero
+tokens; the tokens the original call used are counted as "tokens_saved" and
+published through ``metrics`` under "llm_cache".
+
+Models with a non-zero temperature are never cached. Call sites choose
+per call whether to use the cache (harm-branch outputs never do).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from metrics import register_metrics
+
+
+def _model_identity(llm: Any) -> Optional[str]:
+    temperature = getattr(llm, "temperature", None)
+    if temperature not in (None, 0, 0.0):
+        return None
+    name = (
+        getattr(llm, "deployment_name", None)
+        or getattr(llm, "azure_deployment", None)
+        or getattr(llm, "model_name", None)
+        or getattr(llm, "model", None)
+        or ""
+    )
+    return f"{type(llm).__name__}|{name}|{temperature}"
+
+
+def _schema_identity(schema: Type[BaseModel]) -> str:
+    digest = hashlib.sha256(
+        json.dumps(schema.model_json_schema(), sort_keys=True).encode("utf-8")
+    ).hexdigest()[:16]
+    return f"{schema.__name__}|{digest}"
+
+
+def _render_prompt(messages: Any) -> Any:
+    if isinstance(messages, str):
+        return messages
+    if hasattr(messages, "to_messages"):
+        messages = messages.to_messages()
+    if isinstance(messages, (list, tuple)):
+        return [
+            [getattr(m, "type", type(m).__name__), getattr(m, "content", str(m))]
+            for m in messages
+        ]
+    return str(messages)
+
+
+class LLMResponseCache:
+    """Memory LRU + optional disk tier for parsed structured LLM responses."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_s: Optional[float] = 86400.0,
+        cache_dir: Optional[str] = None,
+        disk_max_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s or None
+        self._lru: "OrderedDict[str, Tuple[Optional[float], Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0,
+            "input_tokens_saved": 0, "output_tokens_saved": 0,
+        }
+        self._disk = None
+        if cache_dir:
+            try:
+                import diskcache
+                self._disk = diskcache.Cache(cache_dir, size_limit=disk_max_bytes)
+            except Exception:
+                logging.exception("Could not open LLM disk cache at %s — memory only", cache_dir)
+
+    def key(self, llm: Any, schema: Type[BaseModel], messages: Any) -> Optional[str]:
+        """Cache key for this call, or None when the call must not be cached."""
+        model_id = _model_identity(llm)
+        if model_id is None:
+            return None
+        try:
+            raw = json.dumps(
+                [model_id, _schema_identity(schema), _render_prompt(messages)],
+                ensure_ascii=False,
+                default=str,
+            )
+        except Exception:
+            logging.exception("Could not render LLM cache key — not caching")
+            return None
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, schema: Type[BaseModel]) -> Optional[BaseModel]:
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        try:
+            value = schema.model_validate(entry["value"])
+        except Exception:
+            logging.exception("Stale LLM cache entry for %s — ignoring", schema.__name__)
+            return None
+        with self._lock:
+            self._counters["input_tokens_saved"] += entry.get("input_tokens", 0)
+            self._counters["output_tokens_saved"] += entry.get("output_tokens", 0)
+        return value
+
+    def put(self, key: str, value: BaseModel, input_tokens: int, output_tokens: int) -> None:
+        entry = {
+            "value": value.model_dump(mode="json"),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+        }
+        self._remember(key, entry)
+        with self._lock:
+            self._counters["stores"] += 1
+        if self._disk is not None:
+            try:
+                self._disk.set(key, entry, expire=self.ttl_s)
+            except Exception:
+                logging.exception("LLM disk cache write failed")
+
+    def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            hit = self._lru.get(key)
+            if hit is not None:
+                expires_at, entry = hit
+                if expires_at is None or expires_at > now:
+                    self._lru.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return entry
+                del self._lru[key]
+        if self._disk is not None:
+            try:
+                entry = self._disk.get(key)
+            except Exception:
+                logging.exception("LLM disk cache read failed")
+                entry = None
+            if entry is not None:
+                self._remember(key, entry)
+                with self._lock:
+                    self._counters["disk_hits"] += 1
+                return entry
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        expires_at = time.monotonic() + self.ttl_s if self.ttl_s else None
+        with self._lock:
+            self._lru[key] = (expires_at, entry)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._lru)
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        return {
+            **counters,
+            "memory_entries": size,
+            "memory_capacity": self.max_entries,
+            "disk_enabled": self._disk is not None,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lru.clear()
+
+
+_cache: Optional[LLMResponseCache] = None
+_cache_lock = threading.Lock()
+_cache_built = False
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """Process-wide cache built from LLM_CACHE_* env vars; None when disabled (LLM_CACHE_SIZE=0)."""
+    global _cache, _cache_built
+    if _cache_built:
+        return _cache
+    with _cache_lock:
+        if not _cache_built:
+            size = int(os.getenv("LLM_CACHE_SIZE", "1024") or 0)
+            if size > 0:
+                cache_dir = os.getenv("LLM_CACHE_DIR") or None
+                _cache = LLMResponseCache(
+                    max_entries=size,
+                    ttl_s=float(os.getenv("LLM_CACHE_TTL_S", "86400") or 0),
+                    cache_dir=cache_dir,
+                    disk_max_bytes=int(float(os.getenv("LLM_CACHE_DISK_MAX_MB", "256") or 256) * 1024 * 1024),
+                )
+                register_metrics("llm_cache", _cache.stats)
+                logging.info(
+                    "LLM response cache enabled (memory=%d entries, disk=%s)",
+                    size, cache_dir or "off",
+                )
+            _cache_built = True
+    return _cache
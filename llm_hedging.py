@@ -0,0 +1,385 @@
+# llm_hedging.py
+"""Hedged requests for the fast-model auxiliary calls.
+
+The fast-LLM calls (analyze_query, entailment gate, situational filter,
+related-question selection) are small, but now and then one Azure response is
+very slow and holds up the whole answer. When hedging is on for a deployment,
+``HedgedDeployment`` does this:
+
+  * keeps a rolling window of call latencies, measured from admission by
+    llm_scheduler, so time spent in the local queue is not mistaken for a
+    slow Azure call;
+  * when a call runs longer than the chosen percentile of that window
+    (LLM_FAST_HEDGE_PERCENTILE, never below LLM_FAST_HEDGE_MIN_DELAY_MS)
+    after it was admitted, sends a duplicate, to a backup deployment if one
+    is configured. No duplicate is sent while the backup's scheduler has a
+    queue: it would only wait behind the calls that are already waiting;
+  * the first successful result wins. The loser is cancelled (async) or left
+    to finish and be discarded (sync threads cannot be interrupted);
+  * at most LLM_FAST_HEDGE_MAX_RATE of recent calls may be hedged, so a slow
+    provider does not get twice the load.
+
+On the sync path the primary runs on the caller's thread and only the
+duplicate goes to a small pool; the caller's thread is busy until the primary
+returns, so there a duplicate takes over when the primary fails, or wins
+when it has finished by then.
+
+The loser's tokens are added to the tokens the call reports, so hedging shows
+up in the per-request cost accounting, but only a loser that has finished by
+then has real usage. One still running (cancelled on the async path, left to
+finish on the sync path) is an estimate: the winner's input tokens (same
+prompt) and 0 output. A sync loser's real usage, once it arrives, goes to the
+"wasted_*" counters only, not to the request. Counters go to ``metrics``
+under "llm_hedging".
+
+Usage (see agent_workflow_answer._invoke_structured); ``call`` calls
+``on_admitted`` once its scheduler slot is granted:
+
+    hedge = hedge_for(llm)
+    if hedge is not None:
+        result, in_tok, out_tok = hedge.invoke(
+            lambda target, on_admitted: _invoke_with_usage(
+                target.with_structured_output(schema), messages, on_admitted
+            )
+        )
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import deadlines
+from llm_scheduler import deployment_key, scheduler_for
+from metrics import register_metrics
+
+
+LLM_FAST_HEDGE = os.getenv("LLM_FAST_HEDGE", "false").strip().lower() in ("1", "true", "yes", "on")
+LLM_FAST_HEDGE_PERCENTILE = float(os.getenv("LLM_FAST_HEDGE_PERCENTILE", "95") or 95)
+LLM_FAST_HEDGE_MAX_RATE = float(os.getenv("LLM_FAST_HEDGE_MAX_RATE", "0.1") or 0)
+LLM_FAST_HEDGE_MIN_DELAY_MS = float(os.getenv("LLM_FAST_HEDGE_MIN_DELAY_MS", "250") or 0)
+LLM_FAST_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_FAST_HEDGE_MIN_SAMPLES", "20") or 0)
+
+_LATENCY_WINDOW = 200
+_RATE_WINDOW = 200
+
+Usage = Tuple[Any, int, int]
+# call(llm, on_admitted) -> (result, input tokens, output tokens)
+Call = Callable[[Any, Callable[[], None]], Usage]
+ACall = Callable[[Any, Callable[[], None]], Awaitable[Usage]]
+
+# Runs the duplicates of sync hedged calls only; primaries stay on the caller's thread.
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+
+
+class _Timers:
+    """One thread firing the hedge timers of sync calls."""
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[float, int, Callable[[], None]]] = []
+        self._seq = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def after(self, delay: float, fn: Callable[[], None]) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), fn))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="llm-hedge-timer", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(timeout=self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, fn = heapq.heappop(self._heap)
+            try:
+                fn()
+            except Exception:
+                logging.exception("Hedge timer failed")
+
+
+_timers = _Timers()
+
+
+class _SyncRace:
+    """A sync hedged call: the duplicate, once sent, and whether the primary has returned."""
+
+    __slots__ = ("lock", "closed", "backup")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.closed = False
+        self.backup: Optional["concurrent.futures.Future"] = None
+
+    def close(self) -> Optional["concurrent.futures.Future"]:
+        """Primary returned: no duplicate from now on; the one already sent, if any."""
+        with self.lock:
+            self.closed = True
+            return self.backup
+
+
+class HedgedDeployment:
+    """Latency tracker, hedge-rate cap and hedged invoke for one deployment."""
+
+    def __init__(
+        self,
+        primary: Any,
+        backup: Optional[Any] = None,
+        percentile: float = LLM_FAST_HEDGE_PERCENTILE,
+        max_rate: float = LLM_FAST_HEDGE_MAX_RATE,
+        min_delay_s: float = LLM_FAST_HEDGE_MIN_DELAY_MS / 1000.0,
+        min_samples: int = LLM_FAST_HEDGE_MIN_SAMPLES,
+    ) -> None:
+        self.primary = primary
+        self.backup = backup if backup is not None else primary
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_delay_s = min_delay_s
+        self.min_samples = max(1, min_samples)
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=_LATENCY_WINDOW)
+        self._recent: Deque[bool] = deque(maxlen=_RATE_WINDOW)  # True = hedged
+        self._counters = {
+            "calls": 0, "hedged": 0, "hedge_won": 0, "primary_won": 0,
+            "rate_capped": 0, "backup_queued": 0, "losers_cancelled": 0,
+            "wasted_input_tokens": 0, "wasted_output_tokens": 0,
+        }
+
+    # ---------- policy ----------
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds after admission to wait before hedging, or None while the window is too small."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        rank = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100.0))
+        return max(self.min_delay_s, ordered[rank])
+
+    def _start_call(self) -> None:
+        with self._lock:
+            self._counters["calls"] += 1
+            self._recent.append(False)
+
+    def _allow_hedge(self) -> bool:
+        if scheduler_for(self.backup).queue_depth() > 0:
+            # The duplicate would queue behind the calls already waiting.
+            with self._lock:
+                self._counters["backup_queued"] += 1
+            return False
+        with self._lock:
+            hedged = sum(self._recent)
+            if hedged + 1 > self.max_rate * len(self._recent):
+                self._counters["rate_capped"] += 1
+                return False
+            self._recent[-1] = True
+            self._counters["hedged"] += 1
+            return True
+
+    def _record_latency(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _record_outcome(self, hedge_won: bool) -> None:
+        with self._lock:
+            self._counters["hedge_won" if hedge_won else "primary_won"] += 1
+
+    def _record_waste(self, in_tok: int, out_tok: int, cancelled: bool = False) -> None:
+        with self._lock:
+            self._counters["wasted_input_tokens"] += in_tok
+            self._counters["wasted_output_tokens"] += out_tok
+            if cancelled:
+                self._counters["losers_cancelled"] += 1
+
+    # ---------- sync ----------
+
+    def invoke(self, call: Call) -> Usage:
+        """Run ``call`` against the primary on this thread, hedging to the backup when it is slow."""
+        self._start_call()
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._timed(call, self.primary)
+
+        race = _SyncRace()
+        context = contextvars.copy_context()
+        try:
+            out = self._timed(
+                call, self.primary, lambda: _timers.after(delay, lambda: self._hedge_sync(call, race, context, delay))
+            )
+        except Exception:
+            backup = race.close()
+            if backup is None:
+                raise
+            # The duplicate may still come through; wait for it within the deadline.
+            try:
+                out = backup.result(timeout=deadlines.remaining())
+            except Exception:
+                backup.add_done_callback(self._settle_sync_loser)
+                raise
+            self._record_outcome(hedge_won=True)
+            return out
+
+        backup = race.close()
+        if backup is None:
+            return out
+        if backup.done() and backup.exception() is None:
+            # The duplicate finished first: it won, the primary's usage is waste.
+            result, in_tok, out_tok = backup.result()
+            self._record_outcome(hedge_won=True)
+            self._record_waste(out[1], out[2])
+            return result, in_tok + out[1], out_tok + out[2]
+        self._record_outcome(hedge_won=False)
+        # Threads cannot be interrupted: the loser runs to completion and its
+        # real usage is counted when it does.
+        backup.add_done_callback(self._settle_sync_loser)
+        # The loser sent the same prompt, so at least its input tokens are spent.
+        result, in_tok, out_tok = out
+        return result, in_tok * 2, out_tok
+
+    def _hedge_sync(self, call: Call, race: _SyncRace, context: contextvars.Context, delay: float) -> None:
+        # Timer thread: the primary was admitted ``delay`` seconds ago.
+        with race.lock:
+            if race.closed or not self._allow_hedge():
+                return
+            logging.info("Hedging slow fast-LLM call after %.0f ms", delay * 1000)
+            # The duplicate runs in the caller's context (deadline, callbacks).
+            race.backup = _executor.submit(context.run, self._timed, call, self.backup)
+
+    def _settle_sync_loser(self, future: "concurrent.futures.Future") -> None:
+        if future.exception() is None:
+            _, in_tok, out_tok = future.result()
+            self._record_waste(in_tok, out_tok)
+
+    def _timed(self, call: Call, llm: Any, on_admitted: Optional[Callable[[], None]] = None) -> Usage:
+        admitted_at: List[float] = []
+
+        def admitted() -> None:
+            admitted_at.append(time.monotonic())
+            if on_admitted is not None:
+                on_admitted()
+
+        out = call(llm, admitted)
+        if admitted_at:
+            self._record_latency(time.monotonic() - admitted_at[0])
+        return out
+
+    # ---------- async ----------
+
+    async def ainvoke(self, acall: ACall) -> Usage:
+        """Async twin of ``invoke``; the losing call is cancelled."""
+        self._start_call()
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._atimed(acall, self.primary)
+
+        admitted = asyncio.Event()
+        primary = asyncio.ensure_future(self._atimed(acall, self.primary, admitted.set))
+        admission = asyncio.ensure_future(admitted.wait())
+        pending = {primary}
+        try:
+            # The hedge timer starts when the primary leaves the scheduler queue.
+            await asyncio.wait({primary, admission}, return_when=asyncio.FIRST_COMPLETED)
+            if primary.done():
+                return await primary
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done or not self._allow_hedge():
+                return await primary
+
+            logging.info("Hedging slow fast-LLM call after %.0f ms", delay * 1000)
+            backup = asyncio.ensure_future(self._atimed(acall, self.backup))
+            pending = {primary, backup}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    result, in_tok, out_tok = task.result()
+                    self._record_outcome(hedge_won=task is backup)
+                    loser = backup if task is primary else primary
+                    if loser.done() and not loser.cancelled() and loser.exception() is None:
+                        _, loser_in, loser_out = loser.result()
+                        self._record_waste(loser_in, loser_out)
+                        return result, in_tok + loser_in, out_tok + loser_out
+                    # Cancelled mid-flight: no usage comes back; the prompt
+                    # was sent, so count the winner's input tokens once more.
+                    self._record_waste(in_tok, 0, cancelled=not loser.done())
+                    return result, in_tok * 2, out_tok
+            raise error
+        finally:
+            admission.cancel()
+            for task in pending:
+                task.cancel()
+
+    async def _atimed(self, acall: ACall, llm: Any, on_admitted: Optional[Callable[[], None]] = None) -> Usage:
+        admitted_at: List[float] = []
+
+        def admitted() -> None:
+            admitted_at.append(time.monotonic())
+            if on_admitted is not None:
+                on_admitted()
+
+        out = await acall(llm, admitted)
+        if admitted_at:
+            self._record_latency(time.monotonic() - admitted_at[0])
+        return out
+
+    # ---------- metrics ----------
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.hedge_delay()
+        with self._lock:
+            counters = dict(self._counters)
+            samples = len(self._latencies)
+        return {
+            **counters,
+            "hedge_rate": round(counters["hedged"] / counters["calls"], 4) if counters["calls"] else 0.0,
+            "hedge_delay_ms": round(delay * 1000, 1) if delay is not None else None,
+            "latency_samples": samples,
+            "backup": deployment_key(self.backup),
+        }
+
+
+_hedges: Dict[str, HedgedDeployment] = {}
+_registry_lock = threading.Lock()
+
+
+def register_hedging(llm: Any, backup: Optional[Any] = None, **policy: Any) -> Any:
+    """Enable hedging for ``llm``'s deployment (optionally to ``backup``); returns ``llm``."""
+    key = deployment_key(llm)
+    with _registry_lock:
+        _hedges[key] = HedgedDeployment(llm, backup, **policy)
+    logging.info(
+        "LLM hedging for %s: p%g, max rate %.0f%%, backup=%s",
+        key, _hedges[key].percentile, _hedges[key].max_rate * 100,
+        deployment_key(backup) if backup is not None else "same deployment",
+    )
+    return llm
+
+
+def hedge_for(llm: Any) -> Optional[HedgedDeployment]:
+    """The hedging policy for ``llm``'s deployment, or None when hedging is off for it."""
+    if not _hedges:
+        return None
+    with _registry_lock:
+        return _hedges.get(deployment_key(llm))
+
+
+def stats() -> Dict[str, Any]:
+    with _registry_lock:
+        hedges = dict(_hedges)
+    return {key: hedge.stats() for key, hedge in hedges.items()}
+
+
+register_metrics("llm_hedging", stats)
@@ -0,0 +1,317 @@
+# llm_pool.py
+"""Pool of equivalent chat deployments behind one BaseChatModel.
+
+``PooledChatModel`` holds several interchangeable deployments for one role
+(main or fast). Each call goes to the member with the best score:
+
+    score = latency EWMA * (1 + calls in flight) / (1 - error-rate EWMA)
+
+Members with no samples yet are tried first. A member that fails with a
+deployment-side error (5xx, 429, timeout, connection) is ejected for a cooldown,
+and the call fails over to the next member. Cooldowns double on repeated
+failures, up to POOL_MAX_EJECT_S. After the cooldown the member is half-open:
+exactly one probe call is routed to it, and it is readmitted only if that call
+succeeds. Caller errors (other 4xx, output parsing) are raised unchanged and
+do not count against the deployment.
+
+A pool spreads load over several deployments' TPM quotas. llm_provider builds
+one from comma-separated *_DEPLOYMENT_NAMES; per-member health is published
+through ``metrics`` under "llm_pool".
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable, RunnableConfig
+from pydantic import ConfigDict, PrivateAttr
+
+from circuit_breaker import is_deployment_failure
+from metrics import register_metrics
+
+
+POOL_EJECT_S = float(os.getenv("POOL_EJECT_S", "10") or 10)
+POOL_MAX_EJECT_S = float(os.getenv("POOL_MAX_EJECT_S", "300") or 300)
+
+_EWMA_ALPHA = 0.2
+
+
+class _Member:
+    """Health bookkeeping for one deployment in the pool."""
+
+    def __init__(self, model: BaseChatModel, name: str) -> None:
+        self.model = model
+        self.name = name
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.ejected_until: Optional[float] = None
+        self.eject_s = POOL_EJECT_S
+        self.probing = False
+        self.calls = 0
+        self.failures = 0
+        self.ejections = 0
+
+    def score(self) -> float:
+        latency = self.latency if self.latency is not None else 0.0
+        return latency * (1 + self.in_flight) / max(0.05, 1.0 - self.error_rate)
+
+
+class PooledChatModel(BaseChatModel):
+    """BaseChatModel that routes each call to the healthiest of several deployments."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    members: List[BaseChatModel]
+    member_names: List[str]
+    model_name: str = "pool"
+    temperature: Optional[float] = 0.0
+
+    _state: List[_Member] = PrivateAttr(default_factory=list)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _clock: Callable[[], float] = PrivateAttr(default=time.monotonic)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._state = [_Member(m, n) for m, n in zip(self.members, self.member_names)]
+
+    @property
+    def _llm_type(self) -> str:
+        return "pooled-chat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "members": list(self.member_names)}
+
+    # ---------- routing ----------
+
+    def _pick(self, exclude: List[_Member]) -> _Member:
+        # Callers stop before every member has been tried, so one is always left.
+        now = self._clock()
+        with self._lock:
+            ready: List[_Member] = []
+            for member in self._state:
+                if member in exclude:
+                    continue
+                if member.ejected_until is None:
+                    ready.append(member)
+                elif member.ejected_until <= now and not member.probing:
+                    # Half-open: this call is the probe.
+                    member.probing = True
+                    member.in_flight += 1
+                    return member
+            if ready:
+                # Untried members first, then best score; ties go to list order.
+                chosen = min(ready, key=lambda m: (m.latency is not None, m.score()))
+            else:
+                # Everything is ejected: fail open on the one back soonest.
+                ejected = [m for m in self._state if m not in exclude]
+                chosen = min(ejected, key=lambda m: m.ejected_until or 0.0)
+            chosen.in_flight += 1
+            return chosen
+
+    def _succeeded(self, member: _Member, started: float) -> None:
+        elapsed = self._clock() - started
+        with self._lock:
+            member.in_flight -= 1
+            member.calls += 1
+            member.latency = elapsed if member.latency is None else (
+                (1 - _EWMA_ALPHA) * member.latency + _EWMA_ALPHA * elapsed
+            )
+            member.error_rate *= 1 - _EWMA_ALPHA
+            if member.ejected_until is not None:
+                logging.info("LLM pool: %s readmitted after probe", member.name)
+            member.ejected_until = None
+            member.eject_s = POOL_EJECT_S
+            member.probing = False
+
+    def _failed(self, member: _Member, exc: BaseException) -> bool:
+        """Record a failure; returns True when the call should fail over."""
+        with self._lock:
+            member.in_flight -= 1
+            member.calls += 1
+            member.probing = False
+            if not is_deployment_failure(exc):
+                return False
+            member.failures += 1
+            member.error_rate = (1 - _EWMA_ALPHA) * member.error_rate + _EWMA_ALPHA
+            if member.ejected_until is not None:
+                member.eject_s = min(POOL_MAX_EJECT_S, member.eject_s * 2)
+            member.ejected_until = self._clock() + member.eject_s
+            member.ejections += 1
+        logging.warning("LLM pool: ejecting %s for %.0fs (%s)", member.name, member.eject_s, exc)
+        return True
+
+    def _route(self, call: Callable[[BaseChatModel], Any]) -> Any:
+        tried: List[_Member] = []
+        while True:
+            member = self._pick(tried)
+            tried.append(member)
+            started = self._clock()
+            try:
+                out = call(member.model)
+            except Exception as exc:
+                if not self._failed(member, exc) or len(tried) >= len(self._state):
+                    raise
+                continue
+            self._succeeded(member, started)
+            return out
+
+    async def _aroute(self, acall: Callable[[BaseChatModel], Any]) -> Any:
+        tried: List[_Member] = []
+        while True:
+            member = self._pick(tried)
+            tried.append(member)
+            started = self._clock()
+            try:
+                out = await acall(member.model)
+            except BaseException as exc:
+                if not isinstance(exc, Exception):
+                    # Cancelled: give the slot back without judging the member.
+                    with self._lock:
+                        member.in_flight -= 1
+                        member.probing = False
+                    raise
+                if not self._failed(member, exc) or len(tried) >= len(self._state):
+                    raise
+                continue
+            self._succeeded(member, started)
+            return out
+
+    # ---------- BaseChatModel ----------
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return self._route(lambda m: m._generate(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return await self._aroute(lambda m: m._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        # Fail over only until the first chunk; after that the caller has
+        # already seen output from this member.
+        member_stream: Dict[str, Any] = {}
+
+        def first_chunk(model: BaseChatModel) -> Optional[ChatGenerationChunk]:
+            member_stream["it"] = iter(model._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+            return next(member_stream["it"], None)
+
+        first = self._route(first_chunk)
+        if first is not None:
+            yield first
+            yield from member_stream["it"]
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        member_stream: Dict[str, Any] = {}
+
+        async def first_chunk(model: BaseChatModel) -> Optional[ChatGenerationChunk]:
+            member_stream["it"] = model._astream(messages, stop=stop, run_manager=run_manager, **kwargs).__aiter__()
+            try:
+                return await member_stream["it"].__anext__()
+            except StopAsyncIteration:
+                return None
+
+        first = await self._aroute(first_chunk)
+        if first is not None:
+            yield first
+            async for chunk in member_stream["it"]:
+                yield chunk
+
+    def with_structured_output(self, schema: Any, **kwargs: Any) -> Runnable:
+        # Each member builds its own structured runnable (tool/JSON-schema
+        # binding is provider-specific); the pool only picks which one runs.
+        return _PooledStructured(self, lambda m: m.with_structured_output(schema, **kwargs))
+
+    # ---------- metrics ----------
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        with self._lock:
+            return {
+                m.name: {
+                    "healthy": m.ejected_until is None,
+                    "ejected_for_s": round(max(0.0, m.ejected_until - now), 1) if m.ejected_until else 0.0,
+                    "latency_ms": round(m.latency * 1000, 1) if m.latency is not None else None,
+                    "error_rate": round(m.error_rate, 4),
+                    "in_flight": m.in_flight,
+                    "calls": m.calls,
+                    "failures": m.failures,
+                    "ejections": m.ejections,
+                }
+                for m in self._state
+            }
+
+
+class _PooledStructured(Runnable):
+    """with_structured_output() of a pool: routes each call to a member's structured runnable.
+
+    ``bound`` points at the pool (like RunnableBinding) so llm_scheduler and
+    llm_cache see the pooled model.
+    """
+
+    def __init__(self, pool: PooledChatModel, build: Callable[[BaseChatModel], Runnable]) -> None:
+        self.bound = pool
+        self._build = build
+        self._runnables: Dict[int, Runnable] = {}
+
+    def _for(self, model: BaseChatModel) -> Runnable:
+        key = id(model)
+        if key not in self._runnables:
+            self._runnables[key] = self._build(model)
+        return self._runnables[key]
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return self.bound._route(lambda m: self._for(m).invoke(input, config, **kwargs))
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return await self.bound._aroute(lambda m: self._for(m).ainvoke(input, config, **kwargs))
+
+
+_pools: Dict[str, PooledChatModel] = {}
+_pools_lock = threading.Lock()
+
+
+def build_pool(role: str, members: List[BaseChatModel], names: List[str]) -> PooledChatModel:
+    """Pool for ``role`` ("main"/"fast"), registered for /healthz."""
+    pool = PooledChatModel(members=members, member_names=names, model_name=f"pool:{','.join(names)}")
+    with _pools_lock:
+        _pools[role] = pool
+    logging.info("LLM pool for %s: %s", role, ", ".join(names))
+    return pool
+
+
+def stats() -> Dict[str, Any]:
+    with _pools_lock:
+        pools = dict(_pools)
+    return {role: pool.stats() for role, pool in pools.items()}
+
+
+register_metrics("llm_pool", stats)
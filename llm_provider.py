@@ -6,10 +6,23 @@ interface (invoke, with_structured_output, usage_metadata callbacks), which both
 returned objects implement.
 """
 
+import logging
 import os
+from typing import List, Optional
 
 from langchain_core.language_models import BaseChatModel
 
+from circuit_breaker import endpoint_label
+from llm_hedging import LLM_FAST_HEDGE, register_hedging
+from llm_pool import build_pool
+from llm_scheduler import (
+    LLM_FAST_MAX_IN_FLIGHT,
+    LLM_FAST_TPM,
+    LLM_MAX_IN_FLIGHT,
+    LLM_TPM,
+    register_deployment,
+)
+
 # NB: provider-SDK-ene importeres LAT inne i hver gren, ikke på toppnivå.
 # Slik krever det å importere denne modulen bare SDK-en for den valgte
 # LLM_PROVIDER – en bruker på Azure OpenAI trenger ikke ha langchain_anthropic
@@ -17,19 +30,60 @@ from langchain_core.language_models import BaseChatModel
 
 
 def build_chat_llm() -> BaseChatModel:
-    provider = os.getenv("LLM_PROVIDER", "azure_openai").lower()
+    # Calls are admitted through llm_scheduler (max in-flight + TPM bucket per
+    # deployment); registering here sets this deployment's limits.
+    # A pool of N deployments gets N times the per-deployment limits.
+    llm = _build_chat_llm()
+    scale = len(getattr(llm, "members", None) or [llm])
+    return register_deployment(llm, LLM_MAX_IN_FLIGHT * scale, LLM_TPM * scale)
 
-    if provider == "azure_openai":
-        from langchain_openai import AzureChatOpenAI
-        return AzureChatOpenAI(
-            azure_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
+
+def _env_list(name: str) -> List[str]:
+    return [item.strip() for item in (os.getenv(name) or "").split(",") if item.strip()]
+
+
+def _azure_chat_llm(role: str, deployments: List[str], prefix: str, timeout: int) -> BaseChatModel:
+    """One AzureChatOpenAI, or a PooledChatModel when several deployments are listed.
+
+    <prefix>ENDPOINTS / <prefix>API_KEYS may list one value per deployment;
+    missing entries fall back to AZURE_OPENAI_ENDPOINT / AZURE_OPENAI_API_KEY.
+    """
+    from langchain_openai import AzureChatOpenAI
+
+    endpoints = _env_list(f"{prefix}ENDPOINTS")
+    api_keys = _env_list(f"{prefix}API_KEYS")
+    models = [
+        AzureChatOpenAI(
+            azure_deployment=deployment,
             api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-            timeout=120,
+            api_key=api_keys[i] if i < len(api_keys) else os.getenv("AZURE_OPENAI_API_KEY"),
+            azure_endpoint=endpoints[i] if i < len(endpoints) else os.getenv("AZURE_OPENAI_ENDPOINT"),
+            timeout=timeout,
             temperature=0.0,
             verbose=False,
         )
+        for i, deployment in enumerate(deployments)
+    ]
+    if len(models) == 1:
+        return models[0]
+    # Member names end up in metrics keys, breaker names and logs: name the
+    # endpoint by its short label, never by its URL.
+    labels = [endpoint_label(endpoints[i]) if i < len(endpoints) else None for i in range(len(deployments))]
+    names = [
+        f"{deployment}@{labels[i]}" if labels[i] else deployment
+        for i, deployment in enumerate(deployments)
+    ]
+    # Two hosts can share a first label; keep the names (metrics keys) apart.
+    names = [name if names.count(name) == 1 else f"{name}#{i + 1}" for i, name in enumerate(names)]
+    return build_pool(role, models, names)
+
+
+def _build_chat_llm() -> BaseChatModel:
+    provider = os.getenv("LLM_PROVIDER", "azure_openai").lower()
+
+    if provider == "azure_openai":
+        deployments = _env_list("AZURE_OPENAI_DEPLOYMENT_NAMES") or [os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")]
+        return _azure_chat_llm("main", deployments, "AZURE_OPENAI_", timeout=120)
 
     if provider == "anthropic":
         from langchain_anthropic import ChatAnthropic
@@ -65,27 +119,56 @@ def build_fast_chat_llm() -> BaseChatModel:
     Configured via *_FAST_* env vars. If none is set we fall back to the
     main model, so behaviour is unchanged until a fast deployment exists.
     """
+    fast = _build_fast_chat_llm()
+    if fast is None:
+        # No fast deployment: no hedging either, or the main model's
+        # structured calls (e.g. the harm refusals) would be duplicated.
+        if LLM_FAST_HEDGE:
+            logging.info("LLM_FAST_HEDGE is on but no fast deployment is configured; not hedging")
+        return build_chat_llm()
+    scale = len(getattr(fast, "members", None) or [fast])
+    register_deployment(fast, LLM_FAST_MAX_IN_FLIGHT * scale, LLM_FAST_TPM * scale)
+    if LLM_FAST_HEDGE:
+        # Slow structured calls get a duplicate (see llm_hedging), sent to
+        # the backup deployment when one is configured.
+        backup = _build_fast_hedge_llm()
+        if backup is not None:
+            register_deployment(backup, LLM_FAST_MAX_IN_FLIGHT, LLM_FAST_TPM)
+        register_hedging(fast, backup)
+    return fast
+
+
+def _build_fast_hedge_llm() -> Optional[BaseChatModel]:
+    """Optional second Azure deployment that hedged fast calls are sent to."""
+    provider = os.getenv("LLM_PROVIDER", "azure_openai").lower()
+    backup_deployment = os.getenv("AZURE_OPENAI_FAST_HEDGE_DEPLOYMENT_NAME")
+    if provider != "azure_openai" or not backup_deployment:
+        return None
+    from langchain_openai import AzureChatOpenAI
+    return AzureChatOpenAI(
+        azure_deployment=backup_deployment,
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_FAST_HEDGE_ENDPOINT") or os.getenv("AZURE_OPENAI_ENDPOINT"),
+        timeout=60,
+        temperature=0.0,
+        verbose=False,
+    )
+
+
+def _build_fast_chat_llm() -> Optional[BaseChatModel]:
     provider = os.getenv("LLM_PROVIDER", "azure_openai").lower()
 
     if provider == "azure_openai":
-        fast_deployment = os.getenv("AZURE_OPENAI_FAST_DEPLOYMENT_NAME")
-        if not fast_deployment:
-            return build_chat_llm()
-        from langchain_openai import AzureChatOpenAI
-        return AzureChatOpenAI(
-            azure_deployment=fast_deployment,
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-            timeout=60,
-            temperature=0.0,
-            verbose=False,
-        )
+        fast_deployments = _env_list("AZURE_OPENAI_FAST_DEPLOYMENT_NAMES") or _env_list("AZURE_OPENAI_FAST_DEPLOYMENT_NAME")
+        if not fast_deployments:
+            return None
+        return _azure_chat_llm("fast", fast_deployments, "AZURE_OPENAI_FAST_", timeout=60)
 
     if provider == "anthropic":
         fast_model = os.getenv("ANTHROPIC_FAST_MODEL")
         if not fast_model:
-            return build_chat_llm()
+            return None
         from langchain_anthropic import ChatAnthropic
         return ChatAnthropic(
             model=fast_model,
@@ -98,7 +181,7 @@ def build_fast_chat_llm() -> BaseChatModel:
     if provider == "mistral":
         fast_model = os.getenv("MISTRAL_FAST_MODEL")
         if not fast_model:
-            return build_chat_llm()
+            return None
         from langchain_mistralai import ChatMistralAI
         return ChatMistralAI(
             model=fast_model,
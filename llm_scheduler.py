@@ -0,0 +1,343 @@
+# llm_scheduler.py
+"""Shared admission control for chat-model calls, per deployment.
+
+Every /chat request fires several calls at the main and fast deployments. Under
+spikes they all hit Azure at once, get 429s and sit in client retries until
+the timeout. ``DeploymentScheduler`` makes them queue here instead:
+
+  * at most ``max_in_flight`` calls per deployment at a time;
+  * a tokens-per-minute bucket. Each call reserves an estimate before it
+    starts (a running average of real usage) and settles against the
+    actual usage when it finishes. Overruns become debt that later calls
+    wait for;
+  * strict FIFO admission across threads and asyncio tasks, so the oldest
+    waiter always goes first;
+  * no waiting past the request's deadline (deadlines.py). A waiter whose
+    budget runs out leaves the queue and the call raises DeadlineExceeded.
+
+Queue depth, in-flight count and wait-time percentiles are published through
+``metrics`` under "llm_scheduler".
+
+Usage (see agent_workflow_answer._invoke_with_usage):
+
+    with scheduled(llm) as slot:
+        result = llm.invoke(...)
+        slot.record_usage(in_tokens + out_tokens)
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Deque, Dict, Optional
+
+from metrics import register_metrics
+
+
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8") or 0)
+LLM_TPM = int(os.getenv("LLM_TPM", "0") or 0)
+LLM_FAST_MAX_IN_FLIGHT = int(os.getenv("LLM_FAST_MAX_IN_FLIGHT", str(LLM_MAX_IN_FLIGHT)) or 0)
+LLM_FAST_TPM = int(os.getenv("LLM_FAST_TPM", str(LLM_TPM)) or 0)
+
+_INITIAL_TOKEN_ESTIMATE = 2000
+_WAIT_SAMPLES = 500
+
+
+def chat_model_of(runnable: Any) -> Any:
+    """Unwrap with_structured_output / bind() chains down to the chat model."""
+    seen = 0
+    while runnable is not None and seen < 8:
+        seen += 1
+        if hasattr(runnable, "bound"):
+            runnable = runnable.bound
+        elif hasattr(runnable, "first"):
+            runnable = runnable.first
+        else:
+            break
+    return runnable
+
+
+def deployment_key(llm: Any) -> str:
+    model = chat_model_of(llm)
+    name = (
+        getattr(model, "deployment_name", None)
+        or getattr(model, "azure_deployment", None)
+        or getattr(model, "model_name", None)
+        or getattr(model, "model", None)
+        or ""
+    )
+    return f"{type(model).__name__}|{name}"
+
+
+class _Slot:
+    """One admitted call; ``record_usage`` settles its token reservation."""
+
+    __slots__ = ("reserved", "used")
+
+    def __init__(self, reserved: int) -> None:
+        self.reserved = reserved
+        self.used: Optional[int] = None
+
+    def record_usage(self, tokens: int) -> None:
+        self.used = max(0, int(tokens or 0))
+
+
+class _Waiter:
+    __slots__ = ("event", "loop", "future", "enqueued_at", "slot")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+        self.enqueued_at = time.monotonic()
+        self.slot: Optional[_Slot] = None
+
+    def grant(self, slot: _Slot) -> None:
+        self.slot = slot
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: "asyncio.Future") -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class DeploymentScheduler:
+    """FIFO concurrency + token-bucket limiter for one deployment."""
+
+    def __init__(self, name: str, max_in_flight: int, tokens_per_minute: int) -> None:
+        self.name = name
+        self.max_in_flight = max_in_flight if max_in_flight > 0 else None
+        self.tpm = tokens_per_minute if tokens_per_minute > 0 else None
+        self._lock = threading.Lock()
+        self._queue: Deque[_Waiter] = deque()
+        self._in_flight = 0
+        self._tokens = float(self.tpm or 0)
+        self._refilled_at = time.monotonic()
+        self._estimate = float(_INITIAL_TOKEN_ESTIMATE)
+        self._waits_ms: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        self._admitted = 0
+        self._timed_out = 0
+
+    # ---------- admission ----------
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[_Slot]:
+        """Wait for admission; None when ``timeout`` seconds pass first (the waiter leaves the queue)."""
+        waiter = _Waiter()
+        give_up = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._queue.append(waiter)
+            self._dispatch()
+        while True:
+            wait = self._wait_time(give_up)
+            if wait is not None and wait <= 0:
+                return None if self._abandon(waiter) else waiter.slot
+            if waiter.event.wait(timeout=wait):
+                return waiter.slot
+            with self._lock:
+                self._dispatch()
+
+    async def aacquire(self, timeout: Optional[float] = None) -> Optional[_Slot]:
+        """``acquire`` for asyncio tasks."""
+        waiter = _Waiter(asyncio.get_running_loop())
+        give_up = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._queue.append(waiter)
+            self._dispatch()
+        try:
+            while True:
+                wait = self._wait_time(give_up)
+                if wait is not None and wait <= 0:
+                    return None if self._abandon(waiter) else waiter.slot
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), timeout=wait)
+                    return waiter.slot
+                except asyncio.TimeoutError:
+                    with self._lock:
+                        self._dispatch()
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.slot is None:
+                    try:
+                        self._queue.remove(waiter)
+                    except ValueError:
+                        pass
+            if waiter.slot is not None:
+                self.release(waiter.slot)
+            raise
+
+    def _wait_time(self, give_up: Optional[float]) -> Optional[float]:
+        # Until the next token-bucket retry, or until the waiter gives up.
+        wait = self._retry_after()
+        if give_up is None:
+            return wait
+        left = give_up - time.monotonic()
+        return left if wait is None else min(wait, left)
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Take a timed-out waiter off the queue; False when it was admitted just before."""
+        with self._lock:
+            if waiter.slot is not None:
+                return False
+            try:
+                self._queue.remove(waiter)
+            except ValueError:
+                pass
+            self._timed_out += 1
+            return True
+
+    def release(self, slot: _Slot) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            if self.tpm is not None:
+                used = slot.reserved if slot.used is None else slot.used
+                # Settle the reservation; overruns push the bucket into debt.
+                self._tokens = min(float(self.tpm), self._tokens + slot.reserved - used)
+            if slot.used:
+                self._estimate = 0.8 * self._estimate + 0.2 * slot.used
+            self._dispatch()
+
+    # caller holds the lock
+    def _dispatch(self) -> None:
+        self._refill()
+        while self._queue:
+            if self.max_in_flight is not None and self._in_flight >= self.max_in_flight:
+                return
+            reserve = self._reservation()
+            if self.tpm is not None and self._tokens < reserve:
+                return
+            waiter = self._queue.popleft()
+            self._in_flight += 1
+            self._admitted += 1
+            if self.tpm is not None:
+                self._tokens -= reserve
+            self._waits_ms.append((time.monotonic() - waiter.enqueued_at) * 1000.0)
+            waiter.grant(_Slot(reserve))
+
+    def _reservation(self) -> int:
+        if self.tpm is None:
+            return 0
+        # Never reserve more than the whole bucket, or a call could wait forever.
+        return int(min(self._estimate, self.tpm))
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.tpm is not None:
+            self._tokens = min(float(self.tpm), self._tokens + (now - self._refilled_at) * self.tpm / 60.0)
+        self._refilled_at = now
+
+    def _retry_after(self) -> Optional[float]:
+        # Waiters blocked only by the token bucket must wake up when it has
+        # refilled; waiters blocked on concurrency are woken by release().
+        if self.tpm is None:
+            return None
+        with self._lock:
+            missing = self._reservation() - self._tokens
+        return max(0.05, missing * 60.0 / self.tpm) if missing > 0 else 0.05
+
+    def queue_depth(self) -> int:
+        """Callers waiting for admission right now."""
+        with self._lock:
+            return len(self._queue)
+
+    # ---------- metrics ----------
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill()
+            waits = sorted(self._waits_ms)
+            out = {
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._queue),
+                "max_in_flight": self.max_in_flight,
+                "tokens_per_minute": self.tpm,
+                "tokens_available": round(self._tokens) if self.tpm is not None else None,
+                "token_estimate": round(self._estimate),
+                "admitted": self._admitted,
+                "timed_out": self._timed_out,
+            }
+        if waits:
+            out["wait_ms_p50"] = round(waits[len(waits) // 2], 1)
+            out["wait_ms_p95"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 1)
+            out["wait_ms_max"] = round(waits[-1], 1)
+        return out
+
+
+_schedulers: Dict[str, DeploymentScheduler] = {}
+_registry_lock = threading.Lock()
+
+
+def register_deployment(llm: Any, max_in_flight: int, tokens_per_minute: int) -> Any:
+    """Set the limits for ``llm``'s deployment (replaces earlier limits); returns ``llm``."""
+    key = deployment_key(llm)
+    with _registry_lock:
+        _schedulers[key] = DeploymentScheduler(key, max_in_flight, tokens_per_minute)
+    logging.info(
+        "LLM scheduler for %s: max_in_flight=%s, tpm=%s",
+        key, max_in_flight or "unlimited", tokens_per_minute or "unlimited",
+    )
+    return llm
+
+
+def scheduler_for(llm: Any) -> DeploymentScheduler:
+    key = deployment_key(llm)
+    with _registry_lock:
+        sched = _schedulers.get(key)
+        if sched is None:
+            sched = _schedulers[key] = DeploymentScheduler(key, LLM_MAX_IN_FLIGHT, LLM_TPM)
+        return sched
+
+
+def _queue_budget() -> Optional[float]:
+    """How long this request may wait for admission: what is left of its deadline (None = no deadline)."""
+    import deadlines  # local import: deadlines imports this module
+
+    left = deadlines.remaining()
+    if left is not None and left <= 0:
+        raise deadlines.DeadlineExceeded("Request deadline exceeded")
+    return left
+
+
+def _queue_timed_out(sched: DeploymentScheduler) -> None:
+    import deadlines
+
+    raise deadlines.DeadlineExceeded(f"Request deadline exceeded while queued for {sched.name}")
+
+
+@contextmanager
+def scheduled(llm: Any):
+    sched = scheduler_for(llm)
+    slot = sched.acquire(timeout=_queue_budget())
+    if slot is None:
+        _queue_timed_out(sched)
+    try:
+        yield slot
+    finally:
+        sched.release(slot)
+
+
+@asynccontextmanager
+async def ascheduled(llm: Any):
+    sched = scheduler_for(llm)
+    slot = await sched.aacquire(timeout=_queue_budget())
+    if slot is None:
+        _queue_timed_out(sched)
+    try:
+        yield slot
+    finally:
+        sched.release(slot)
+
+
+def stats() -> Dict[str, Any]:
+    with _registry_lock:
+        schedulers = dict(_schedulers)
+    return {key: sched.stats() for key, sched in schedulers.items()}
+
+
+register_metrics("llm_scheduler", stats)
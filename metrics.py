@@ -0,0 +1,34 @@
+# metrics.py
+"""Tiny in-process metrics registry.
+
+Components register a zero-arg callable that returns a JSON-serialisable dict
+(hit/miss counters, queue depths, ...). /healthz calls ``metrics_snapshot()``
+so everything shows up in one place without each module knowing about routes.
+"""
+
+import logging
+import threading
+from typing import Any, Callable, Dict
+
+_sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+_lock = threading.Lock()
+
+
+def register_metrics(name: str, source: Callable[[], Dict[str, Any]]) -> None:
+    """Register (or replace) the metrics source published under ``name``."""
+    with _lock:
+        _sources[name] = source
+
+
+def metrics_snapshot() -> Dict[str, Any]:
+    """Collect every registered source. A failing source never breaks the probe."""
+    with _lock:
+        sources = dict(_sources)
+    out: Dict[str, Any] = {}
+    for name, source in sources.items():
+        try:
+            out[name] = source()
+        except Exception:
+            logging.exception("Metrics source '%s' failed", name)
+            out[name] = {"error": "unavailable"}
+    return out
@@ -0,0 +1,416 @@
+# node_artifacts.py
+"""Per-node derived data, computed once when an index loads.
+
+Every request used to redo the same work on the same retrieved nodes:
+normalizing node text for citation matching (and as the ``partial_ratio``
+haystack), picking the display id for the context header, and finding
+paragraph/sentence breaks to trim the context. ``attach_node_artifacts``
+builds a ``NodeArtifacts`` per docstore node at load time, into a side table
+keyed by node id:
+
+  * ``display_id`` — the "[...]" id shown to the LLM and cited back;
+  * ``norm``       — ``_normalize(text)`` with the settings citation
+                     verification uses (collapsed whitespace, casefolded);
+  * ``tokens``     — ``NodeTokens``: break offsets in the stripped text and
+                     cumulative token counts at each (see context_budget);
+  * ``grams``      — ``NodeGrams``: offsets of every word in ``norm``, keyed
+                     by a hash of its first characters, so fuzzy citation
+                     matching can find candidate windows (see
+                     citation_matcher).
+
+``artifacts_for(node)`` returns the table entry, or builds one on the spot
+for a node that did not come from a loaded index.
+
+With NODE_ARTIFACTS_PERSIST on, the table is written next to the index
+(derived_cache.py: ``<index dir>/.derived/<fingerprint>/node_artifacts.json``)
+and read back on the next start, as long as the index files, the tokenizer
+and the format are unchanged. A read-only index directory just means the
+table is rebuilt on every start.
+
+Tokens are counted with tiktoken's CONTEXT_TOKENIZER encoding (o200k_base =
+gpt-4o/4.1). If the encoding cannot be loaded (e.g. no network for the first
+download), counts fall back to a chars/4 estimate.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from llama_index.core import VectorStoreIndex
+
+import derived_cache
+from agent_shared import _node_text, _normalize, _preferred_display_id
+from metrics import register_metrics
+
+
+NODE_ARTIFACTS_PERSIST = os.getenv("NODE_ARTIFACTS_PERSIST", "true").strip().lower() in ("1", "true", "yes", "on")
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "o200k_base").strip()
+
+ARTIFACTS_FILE = "node_artifacts.json"
+# Bump when NodeArtifacts or how it is derived changes.
+_FORMAT = 3
+
+# Fallback when tiktoken or its encoding file is unavailable.
+_CHARS_PER_TOKEN = 4
+
+# Lookahead, so overlapping separators ("\n\n\n") each count as a break.
+_BREAK_RE = re.compile(r"(?=\n\n|\. )")
+
+_WORD_RE = re.compile(r"\w{2,}")
+# Words are keyed by their first characters, so inflected forms
+# ("hindrer"/"hindre") still share a gram.
+_GRAM_CHARS = 5
+# Grams this frequent in a node ("og", "det", ...) say nothing about where a
+# quote is and are left out of the window search.
+_MAX_POSTINGS = 32
+
+
+# ---------- tokenizer ----------
+
+_encoder_lock = threading.Lock()
+_encoder: Optional[Callable[[str], int]] = None
+_exact = False
+
+
+def _load_encoder() -> Callable[[str], int]:
+    global _encoder, _exact
+    with _encoder_lock:
+        if _encoder is not None:
+            return _encoder
+        try:
+            import tiktoken
+
+            encoding = tiktoken.get_encoding(CONTEXT_TOKENIZER)
+            _encoder = lambda text: len(encoding.encode_ordinary(text))
+            _exact = True
+        except Exception as e:
+            logging.warning(
+                "Tokenizer %r unavailable (%s); estimating tokens as chars/%d",
+                CONTEXT_TOKENIZER, e, _CHARS_PER_TOKEN,
+            )
+            _encoder = lambda text: (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+        return _encoder
+
+
+def count_tokens(text: str) -> int:
+    """Token count of ``text`` with the context tokenizer (or the chars/4 estimate)."""
+    return _load_encoder()(text) if text else 0
+
+
+def tokenizer_label() -> str:
+    _load_encoder()
+    return CONTEXT_TOKENIZER if _exact else f"chars/{_CHARS_PER_TOKEN} estimate"
+
+
+# ---------- artifacts ----------
+
+class NodeTokens:
+    """Break offsets of one node's stripped text and the cumulative token count at each.
+
+    ``ends[i]`` is the character offset just after the i-th break (the last
+    one is the end of the text); ``cum[i]`` the tokens of ``text[:ends[i]]``.
+    """
+
+    __slots__ = ("ends", "cum")
+
+    def __init__(self, ends: array, cum: array) -> None:
+        self.ends = ends
+        self.cum = cum
+
+    @property
+    def total(self) -> int:
+        return self.cum[-1] if self.cum else 0
+
+    @classmethod
+    def from_text(cls, text: str) -> "NodeTokens":
+        ends = array("I", (m.start() + 1 for m in _BREAK_RE.finditer(text)))
+        if not ends or ends[-1] != len(text):
+            ends.append(len(text))
+        count = _load_encoder()
+        cum = array("I")
+        total = start = 0
+        for end in ends:
+            total += count(text[start:end])
+            cum.append(total)
+            start = end
+        return cls(ends, cum)
+
+    def cut(self, max_tokens: int) -> Tuple[int, int]:
+        """(char offset, tokens) of the longest break prefix within ``max_tokens``; (0, 0) if none."""
+        i = bisect_right(self.cum, max_tokens)
+        if i == 0:
+            return 0, 0
+        return self.ends[i - 1], self.cum[i - 1]
+
+    def last_break_before(self, max_chars: int) -> int:
+        """Offset just after the last break whose separator fits in ``text[:max_chars]`` (0 if none)."""
+        # ends[-1] is the end of the text, not a break. A break ending at
+        # ``end`` has its two-char separator at end-1 and end.
+        i = bisect_right(self.ends, max_chars - 1, 0, len(self.ends) - 1)
+        return self.ends[i - 1] if i else 0
+
+
+def _grams(text: str) -> Iterator[Tuple[int, int]]:
+    for m in _WORD_RE.finditer(text):
+        yield zlib.crc32(m.group()[:_GRAM_CHARS].encode("utf-8")), m.start()
+
+
+def gram_keys(text: str) -> Set[int]:
+    """The distinct gram keys of (normalized) ``text``."""
+    return {key for key, _ in _grams(text)}
+
+
+class NodeGrams:
+    """Word offsets of one node's normalized text, sorted by gram key.
+
+    ``keys[i]`` is the gram of the word starting at ``offsets[i]``; entries
+    are sorted by (key, offset), so a gram's postings are one bisect away.
+    """
+
+    __slots__ = ("keys", "offsets")
+
+    def __init__(self, keys: array, offsets: array) -> None:
+        self.keys = keys
+        self.offsets = offsets
+
+    @classmethod
+    def from_bytes(cls, keys: bytes, offsets: bytes) -> "NodeGrams":
+        k, o = array("I"), array("I")
+        k.frombytes(keys)
+        o.frombytes(offsets)
+        return cls(k, o)
+
+    @classmethod
+    def from_text(cls, norm: str) -> "NodeGrams":
+        pairs = sorted(_grams(norm))
+        return cls(array("I", (k for k, _ in pairs)), array("I", (o for _, o in pairs)))
+
+    def windows(self, keys: Set[int], span: int, min_shared: float, limit: int) -> List[Tuple[int, int]]:
+        """Up to ``limit`` (start, end) offsets of non-overlapping windows at most ``span`` wide
+        that hold at least ``min_shared`` (a fraction) of ``keys``, most shared first."""
+        hits: List[Tuple[int, int]] = []
+        usable = 0
+        for key in keys:
+            lo = bisect_left(self.keys, key)
+            hi = bisect_right(self.keys, key, lo)
+            if lo == hi or hi - lo > _MAX_POSTINGS:
+                continue
+            usable += 1
+            hits.extend((self.offsets[i], key) for i in range(lo, hi))
+        if not hits:
+            return []
+        hits.sort()
+        need = max(1, int(min_shared * usable + 0.999))
+
+        candidates: List[Tuple[int, int, int]] = []
+        inside: Counter = Counter()
+        left = 0
+        for right, (offset, key) in enumerate(hits):
+            inside[key] += 1
+            while offset - hits[left][0] > span:
+                old = hits[left][1]
+                inside[old] -= 1
+                if not inside[old]:
+                    del inside[old]
+                left += 1
+            if len(inside) >= need:
+                candidates.append((len(inside), hits[left][0], offset))
+
+        chosen: List[Tuple[int, int]] = []
+        for _, start, end in sorted(candidates, key=lambda c: (-c[0], c[1])):
+            if any(start <= e and end >= s for s, e in chosen):
+                continue
+            chosen.append((start, end))
+            if len(chosen) >= limit:
+                break
+        return chosen
+
+
+def _text_crc(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+class NodeArtifacts:
+    # text_crc: checksum of the node text the entry was built from, so an
+    # entry is never used for a node whose text has since changed.
+    __slots__ = ("display_id", "norm", "tokens", "grams", "text_crc")
+
+    def __init__(
+        self, display_id: str, norm: str, tokens: NodeTokens, grams: NodeGrams, text_crc: int
+    ) -> None:
+        self.display_id = display_id
+        self.norm = norm
+        self.tokens = tokens
+        self.grams = grams
+        self.text_crc = text_crc
+
+    @classmethod
+    def from_node(cls, node: Any) -> "NodeArtifacts":
+        text = _node_text(node)
+        norm = _normalize(text, collapse_ws=True, case_sensitive=False)
+        return cls(
+            _preferred_display_id(node),
+            norm,
+            NodeTokens.from_text(text.strip()),
+            NodeGrams.from_text(norm),
+            _text_crc(text),
+        )
+
+    def to_json(self) -> list:
+        return [
+            self.display_id, self.norm,
+            list(self.tokens.ends), list(self.tokens.cum),
+            list(self.grams.keys), list(self.grams.offsets),
+            self.text_crc,
+        ]
+
+    @classmethod
+    def from_json(cls, row: list) -> "NodeArtifacts":
+        display_id, norm, ends, cum, keys, offsets, text_crc = row
+        return cls(
+            display_id, norm,
+            NodeTokens(array("I", ends), array("I", cum)),
+            NodeGrams(array("I", keys), array("I", offsets)),
+            text_crc,
+        )
+
+
+# index object -> {node id: NodeArtifacts}. Weak keys, like the dense
+# matrices, so a reloaded index drops its table.
+_TABLES: "weakref.WeakKeyDictionary[VectorStoreIndex, Dict[str, NodeArtifacts]]" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+# Bumped whenever a table is attached, so copies of the tables elsewhere
+# (verification_pool's worker processes) know when they are stale.
+_generation = 0
+_counters: Dict[str, int] = {
+    "loaded_from_disk": 0,
+    "built": 0,
+    "lookups": 0,
+    "misses": 0,  # built per request (node not in a load-time table)
+}
+
+
+def _version() -> Dict[str, Any]:
+    return {"format": _FORMAT, "tokenizer": tokenizer_label()}
+
+
+def attach_node_artifacts(name: str, index: VectorStoreIndex) -> int:
+    """Build (or read back) the artifact table for a freshly loaded index.
+
+    Never raises: without a table, artifacts are built per request instead.
+    Returns the number of nodes in the table.
+    """
+    global _generation
+    try:
+        start = time.time()
+        stored = derived_cache.load(index, ARTIFACTS_FILE, _version()) if NODE_ARTIFACTS_PERSIST else None
+
+        table = None
+        if isinstance(stored, dict):
+            table = {node_id: NodeArtifacts.from_json(row) for node_id, row in stored.items()}
+        source = "read from disk"
+        if table is None:
+            table = {str(node_id): NodeArtifacts.from_node(node) for node_id, node in index.docstore.docs.items()}
+            source = "built"
+            if NODE_ARTIFACTS_PERSIST:
+                derived_cache.store(index, ARTIFACTS_FILE, _version(), {k: v.to_json() for k, v in table.items()})
+
+        with _lock:
+            _TABLES[index] = table
+            _generation += 1
+            _counters["loaded_from_disk" if source == "read from disk" else "built"] += len(table)
+        logging.info(
+            "Index '%s': node artifacts for %d nodes %s in %.2fs (%s)",
+            name, len(table), source, time.time() - start, tokenizer_label(),
+        )
+        return len(table)
+    except Exception:
+        logging.exception("Could not build node artifacts for index '%s'", name)
+        return 0
+
+
+def node_key(node: Any) -> str:
+    """Table key of ``node`` (NodeWithScore or node): its node id."""
+    node = getattr(node, "node", node)
+    return str(getattr(node, "node_id", None) or getattr(node, "id_", ""))
+
+
+def _tables_newest_first() -> List[Dict[str, NodeArtifacts]]:
+    # caller holds _lock. A reloaded index's table is attached after the
+    # old one, which stays alive while requests still hold the old index.
+    return list(_TABLES.values())[::-1]
+
+
+def table_entry(node: Any, newest_only: bool = False) -> Optional[NodeArtifacts]:
+    """The load-time artifacts of ``node``, or None when it is in no table.
+
+    Tables are searched newest first, and an entry counts only when it was
+    built from the node's current text: a rebuilt index can keep node ids
+    while their text changes. With ``newest_only``, only the newest table
+    holding the node id is checked (the entry ``export_corpus`` ships).
+    """
+    key = node_key(node)
+    with _lock:
+        _counters["lookups"] += 1
+        tables = _tables_newest_first()
+    crc = None
+    for table in tables:
+        found = table.get(key)
+        if found is None:
+            continue
+        if crc is None:
+            crc = _text_crc(_node_text(getattr(node, "node", node)))
+        if found.text_crc == crc:
+            return found
+        if newest_only:
+            break
+    return None
+
+
+def artifacts_for(node: Any) -> NodeArtifacts:
+    """The load-time artifacts of ``node`` (NodeWithScore or node), built on the spot if missing."""
+    found = table_entry(node)
+    if found is not None:
+        return found
+    with _lock:
+        _counters["misses"] += 1
+    return NodeArtifacts.from_node(getattr(node, "node", node))
+
+
+def generation() -> int:
+    with _lock:
+        return _generation
+
+
+def export_corpus() -> Tuple[int, Dict[str, Tuple[str, bytes, bytes]]]:
+    """(generation, {node id: (norm, gram keys, gram offsets)}) of every table, for shipping
+    to another process. The arrays are raw "I" bytes (see ``NodeGrams.from_bytes``)."""
+    with _lock:
+        tables = _tables_newest_first()
+        gen = _generation
+    corpus: Dict[str, Tuple[str, bytes, bytes]] = {}
+    for table in tables:
+        for key, artifacts in table.items():
+            # Newest table wins, as in table_entry.
+            if key not in corpus:
+                corpus[key] = (artifacts.norm, artifacts.grams.keys.tobytes(), artifacts.grams.offsets.tobytes())
+    return gen, corpus
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        out = dict(_counters)
+        out["nodes"] = sum(len(table) for table in _TABLES.values())
+    out["tokenizer"] = tokenizer_label() if _encoder is not None else CONTEXT_TOKENIZER
+    return out
+
+
+register_metrics("node_artifacts", stats)
@@ -1,6 +1,13 @@
 # query_utils.py
 
 import json
+import os
+
+from deadlines import ANSWER_DEADLINE_S, request_budget
+from speculative_retrieval import SPECULATIVE_RETRIEVAL_DEFAULT
+
+# Default for QuerySettings.async_graph; a request can still override it.
+ANSWER_GRAPH_ASYNC = os.getenv("ANSWER_GRAPH_ASYNC", "false").strip().lower() in ("1", "true", "yes", "on")
 
 class QuerySettings:
     def __init__(self, **kwargs):
@@ -37,6 +44,17 @@ class QuerySettings:
         # Debug only: when True, query_grounded emits the exact retrieved nodes
         # (text + score) as a `retrieved_nodes` SSE event. Off in production.
         self.debug_emit_nodes = bool(kwargs.get('debug_emit_nodes', False))
+        # Run the async-native answer graph (awaits LLM/retrieval/embedding
+        # calls) instead of the sync one. Same SSE output; for side-by-side
+        # load tests. Default from ANSWER_GRAPH_ASYNC.
+        self.async_graph = bool(kwargs.get('async_graph', ANSWER_GRAPH_ASYNC))
+        # Retrieve on the raw question in parallel with analyze_query and reuse
+        # the nodes when the rewrite is near-identical. Default from
+        # SPECULATIVE_RETRIEVAL.
+        self.speculative_retrieval = bool(kwargs.get('speculative_retrieval', SPECULATIVE_RETRIEVAL_DEFAULT))
+        # Time budget for the whole answer in seconds; 0 = no deadline.
+        # Default from ANSWER_DEADLINE_S, never below ANSWER_DEADLINE_MIN_S.
+        self.deadline_s = request_budget(kwargs.get('deadline_s', ANSWER_DEADLINE_S))
 
     def __str__(self):
         # Convert object properties to a JSON string
@@ -62,6 +80,9 @@ def get_query_settings(json_request):
         requested_categories = json_request.get('requested_categories', []),
         claims_valid_threshold = json_request.get('claims_valid_threshold', 1.0),
         entailment_check = json_request.get('entailment_check', True),
+        async_graph = json_request.get('async_graph', ANSWER_GRAPH_ASYNC),
+        speculative_retrieval = json_request.get('speculative_retrieval', SPECULATIVE_RETRIEVAL_DEFAULT),
+        deadline_s = json_request.get('deadline_s', ANSWER_DEADLINE_S),
 
         session_id=json_request.get('session_id'),
         messages=json_request.get('messages', []),
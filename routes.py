@@ -1,12 +1,16 @@
 from quart import request, Response
 import logging, json, asyncio
 from typing import Any, Dict, List, Optional, Tuple
-from config import server_settings, vector_store
+from config import server_settings, vector_store, start_reload, ADMIN_TOKEN, VECTOR_INDEX_MAP
 import secrets
 import diskcache
 from query_utils import get_query_settings
+from metrics import metrics_snapshot
+import circuit_breaker
+import index_catalog
 from answer_utils import (
-    get_answer_as_stream, get_related_qa_as_stream, get_examples_full_as_stream
+    get_answer_as_stream, get_related_qa_as_stream, get_examples_full_as_stream,
+    qa_bank_index_name, EXAMPLES_INDEX_NAME,
 )
 
 AGENT_REGISTRY = {
@@ -15,6 +19,18 @@ AGENT_REGISTRY = {
     "hvaerinnafor_examples": get_examples_full_as_stream, 
 }
 
+# Indexes each agent must have loaded before it can run (503 until then).
+# The related-QA agent answers from the QA-bank alone; the text index only
+# adds source-document details once it is in.
+AGENT_INDEXES = {
+    "hvaerinnafor": lambda qs: [qs.vectorIndex, qa_bank_index_name(qs, vector_store)],
+    "hvaerinnafor_related_qa": lambda qs: [qa_bank_index_name(qs, vector_store)],
+    "hvaerinnafor_examples": lambda qs: [EXAMPLES_INDEX_NAME],
+}
+
+# /categories and /documents read the article index.
+ARTICLE_INDEX_NAME = "hvaerinnafor"
+
 SESSION_STORE = diskcache.Cache("./session_cache")
 
 
@@ -91,7 +107,7 @@ def register_routes(app):
             },
         )
 
-    def _not_ready_response(status: str) -> Response:
+    def _not_ready_response(status: str, waiting_for: Optional[List[str]] = None) -> Response:
         """503 response the browser can actually read (explicit CORS + JSON)."""
         body = {
             "error": "server_not_ready",
@@ -99,6 +115,8 @@ def register_routes(app):
             "status": status,
             "message": "Serveren laster fortsatt indekser. Prøv igjen om noen sekunder.",
         }
+        if waiting_for:
+            body["waiting_for"] = waiting_for
         return Response(
             json.dumps(body, ensure_ascii=False),
             status=503,
@@ -109,6 +127,23 @@ def register_routes(app):
             },
         )
 
+    def _is_admin() -> bool:
+        """True when the request carries "Authorization: Bearer <ADMIN_TOKEN>" (and ADMIN_TOKEN is set)."""
+        if not ADMIN_TOKEN:
+            return False
+        auth = request.headers.get("Authorization", "")
+        token = auth[len("Bearer "):] if auth.startswith("Bearer ") else ""
+        return secrets.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+
+    def _indexes_not_ready(names: List[str]) -> Optional[Response]:
+        """503 response while any of ``names`` is still loading, else None."""
+        waiting = vector_store.not_ready(names)
+        if not waiting:
+            return None
+        status, _ = server_settings.get_status()
+        logging.warning("Indexes %s are still loading (status=%s)", waiting, status)
+        return _not_ready_response(status, waiting)
+
     def _is_duplicate_last(history: List[Dict[str, str]], msg: Dict[str, str]) -> bool:
         """Return True hvis msg er identisk med siste element i history."""
         if not history:
@@ -221,8 +256,16 @@ def register_routes(app):
         """Lightweight readiness probe for clients to poll before calling /chat or /examples.
 
         Always returns 200 — the body's `ready` flag tells the client whether the
-        backend has finished loading indexes. (Returning 200 here keeps the polling
-        loop simple; the chat/examples endpoints still return 503 for safety.)
+        backend has finished loading indexes, and `indexes` gives each index's
+        state (pending / loading / ready / missing / failed). (Returning 200 here
+        keeps the polling loop simple; the chat/examples endpoints still return
+        503 while an index they need is loading.)
+
+        `circuit_breakers` gives each endpoint breaker's state (closed / open
+        / half_open) by its short label. The in-process metrics (deployments,
+        endpoints, queues) are added under `metrics` only for a request with
+        the admin bearer token: this endpoint is public and polled by the
+        browser.
         """
         if request.method == "OPTIONS":
             return _cors_preflight()
@@ -231,9 +274,13 @@ def register_routes(app):
         body = {
             "ready": bool(indexes_loaded),
             "status": status,
+            "indexes": vector_store.states(),
+            "circuit_breakers": circuit_breaker.states(),
         }
         if not indexes_loaded:
             body["message"] = "Serveren laster fortsatt indekser. Prøv igjen om noen sekunder."
+        if _is_admin():
+            body["metrics"] = metrics_snapshot()
 
         return Response(
             json.dumps(body, ensure_ascii=False),
@@ -245,30 +292,49 @@ def register_routes(app):
             },
         )
 
+    @app.route("/admin/reload", methods=["POST"])
+    async def admin_reload():
+        """Reload indexes in the background and swap them in without downtime.
+
+        Disabled (404) unless ADMIN_TOKEN is set; send it as
+        "Authorization: Bearer <token>". Optional body
+        {"indexes": ["hvaerinnafor_qa_bank", ...]} (default: every index).
+        Returns 202 with the indexes scheduled; /healthz shows `reloading`
+        per index until the new version is swapped in. Each Hypercorn worker
+        holds its own indexes and this reaches only one of them — use
+        INDEX_RELOAD_WATCH_S to reload every worker.
+        """
+        if not ADMIN_TOKEN:
+            return {"error": "Not found"}, 404
+        if not _is_admin():
+            return {"error": "Unauthorized"}, 401
+
+        payload = await request.get_json(silent=True) or {}
+        names = payload.get("indexes")
+        if names is not None:
+            known = {item["name"] for item in VECTOR_INDEX_MAP}
+            if not isinstance(names, list) or any(n not in known for n in names):
+                return {"error": f"'indexes' must be a list of: {sorted(known)}"}, 400
+
+        started = start_reload(names)
+        logging.info("Admin reload requested for %s; scheduled %s", names or "all indexes", started)
+        return {"reloading": started, "indexes": vector_store.states()}, 202
+
     @app.route("/categories", methods=["GET", "OPTIONS"])
     async def categories():
-        """Return the sorted distinct categories present in the hvaerinnafor index."""
+        """Return the sorted distinct categories present in the hvaerinnafor index (see index_catalog)."""
         if request.method == "OPTIONS":
             return _cors_preflight()
 
-        status, indexes_loaded = server_settings.get_status()
-        if not indexes_loaded:
-            logging.warning("Indexes are still loading (status=%s)", status)
-            return _not_ready_response(status)
-
-        seen: set[str] = set()
-        entry = vector_store.get("hvaerinnafor")
-        if entry is not None:
-            for node in entry.index.docstore.docs.values():
-                cats = (getattr(node, "metadata", None) or {}).get("categories")
-                if isinstance(cats, list):
-                    for c in cats:
-                        c = str(c).strip()
-                        if c:
-                            seen.add(c)
+        not_ready = _indexes_not_ready([ARTICLE_INDEX_NAME])
+        if not_ready is not None:
+            return not_ready
+
+        entry = vector_store.get(ARTICLE_INDEX_NAME)
+        cats = index_catalog.categories(entry.index) if entry is not None else []
 
         return Response(
-            json.dumps(sorted(seen), ensure_ascii=False),
+            json.dumps(cats, ensure_ascii=False),
             status=200,
             headers={
                 "Content-Type": "application/json; charset=utf-8",
@@ -283,34 +349,18 @@ def register_routes(app):
 
         Deduplicates the docstore nodes by URL (used as doc_id at ingest time) and
         returns one entry per source document with its title, category and
-        categories. Sorted by title for stable client rendering.
+        categories. Sorted by title for stable client rendering. Built once per
+        loaded index (index_catalog).
         """
         if request.method == "OPTIONS":
             return _cors_preflight()
 
-        status, indexes_loaded = server_settings.get_status()
-        if not indexes_loaded:
-            logging.warning("Indexes are still loading (status=%s)", status)
-            return _not_ready_response(status)
-
-        by_url: Dict[str, Dict[str, Any]] = {}
-        entry = vector_store.get("hvaerinnafor")
-        if entry is not None:
-            for node in entry.index.docstore.docs.values():
-                meta = getattr(node, "metadata", None) or {}
-                url = (meta.get("url") or "").strip()
-                if not url or url in by_url:
-                    continue
-                cats = meta.get("categories")
-                by_url[url] = {
-                    "url": url,
-                    "title": (meta.get("title") or "").strip(),
-                    "category": (meta.get("category") or "").strip(),
-                    "categories": cats if isinstance(cats, list) else [],
-                    "description": (meta.get("description") or "").strip(),
-                }
-
-        docs = sorted(by_url.values(), key=lambda d: d["title"].casefold())
+        not_ready = _indexes_not_ready([ARTICLE_INDEX_NAME])
+        if not_ready is not None:
+            return not_ready
+
+        entry = vector_store.get(ARTICLE_INDEX_NAME)
+        docs = index_catalog.documents(entry.index) if entry is not None else []
         body = {"count": len(docs), "documents": docs}
 
         return Response(
@@ -328,12 +378,6 @@ def register_routes(app):
         if request.method == "OPTIONS":
             return _cors_preflight()
 
-        # Index readiness
-        status, indexes_loaded = server_settings.get_status()
-        if not indexes_loaded:
-            logging.warning("Indexes are still loading (status=%s)", status)
-            return _not_ready_response(status)
-
         try:
             payload = await request.get_json()
             query_settings = get_query_settings(payload)
@@ -343,6 +387,11 @@ def register_routes(app):
             if agent_fn is None:
                 return {"error": f"Unknown agent '{agent_name}'"}, 400
 
+            # Index readiness — only the indexes this agent reads
+            not_ready = _indexes_not_ready(AGENT_INDEXES[agent_name](query_settings))
+            if not_ready is not None:
+                return not_ready
+
             async def stream_examples():
                 yield _format_sse(json.dumps({"event": "open", "message": "ok"}, ensure_ascii=False))
                 chunks_sent = 0
@@ -398,18 +447,20 @@ def register_routes(app):
         if request.method == "OPTIONS":
             return _cors_preflight()
 
-        # Index readiness
-        status, indexes_loaded = server_settings.get_status()
-        if not indexes_loaded:
-            logging.warning("Indexes are still loading (status=%s)", status)
-            return _not_ready_response(status)
-
         try:
             payload = await request.get_json()
             logging.info("Received /chat payload: %r", payload)
 
             query_settings = get_query_settings(payload)
 
+            # Index readiness — only the indexes this agent reads, checked
+            # before the message is stored so a retry does not repeat it
+            agent_name = getattr(query_settings, "agent", None)
+            if agent_name in AGENT_INDEXES:
+                not_ready = _indexes_not_ready(AGENT_INDEXES[agent_name](query_settings))
+                if not_ready is not None:
+                    return not_ready
+
             # 1) resolve / create session_id
             session_id = _get_or_create_session_id(query_settings, payload)
 
@@ -0,0 +1,136 @@
+# speculative_retrieval.py
+"""Speculative retrieval on the raw user question.
+
+The answer graph normally retrieves only after ``analyze_query`` has
+rewritten the question, so the fast-LLM call and retrieval add up. In
+speculative mode a parallel branch embeds the *raw* question and retrieves
+against the answer index while ``analyze_query`` runs. Once the rewrite is
+known, the speculative nodes are reused for any query that is near-identical
+to the raw one:
+
+  * same text after ``_normalize_for_match`` (case, whitespace and trailing
+    punctuation folded), or
+  * cosine similarity between the two query embeddings
+    >= SPECULATIVE_RETRIEVAL_MIN_SIM.
+
+Everything else retrieves again as before. Outcomes are counted and published
+through ``metrics`` under "speculative_retrieval" so the win/waste rate can be
+read off /healthz.
+"""
+
+import logging
+import os
+import re
+import threading
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from metrics import register_metrics
+
+
+SPECULATIVE_RETRIEVAL_DEFAULT = os.getenv("SPECULATIVE_RETRIEVAL", "false").strip().lower() in ("1", "true", "yes", "on")
+SPECULATIVE_RETRIEVAL_MIN_SIM = float(os.getenv("SPECULATIVE_RETRIEVAL_MIN_SIM", "0.97") or 0.97)
+
+_TRAILING_PUNCT_RE = re.compile(r"[\s?!.,;:]+$")
+_WS_RE = re.compile(r"\s+")
+
+_lock = threading.Lock()
+_counters: Dict[str, int] = {
+    "runs": 0,             # speculative retrievals started
+    "won": 0,              # runs where at least one query reused the nodes
+    "wasted_miss": 0,      # RAG route, but no query was close enough
+    "wasted_non_rag": 0,   # routed to a branch that does no retrieval
+    "failed": 0,           # speculative embed/retrieve raised
+    "retrievals_saved": 0,
+    "retrievals_rerun": 0,
+}
+
+
+def _normalize_for_match(text: str) -> str:
+    text = unicodedata.normalize("NFC", text or "").casefold()
+    return _TRAILING_PUNCT_RE.sub("", _WS_RE.sub(" ", text).strip())
+
+
+def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    va = np.asarray(a, dtype=np.float32)
+    vb = np.asarray(b, dtype=np.float32)
+    denom = float(np.linalg.norm(va) * np.linalg.norm(vb))
+    if denom == 0.0 or va.shape != vb.shape:
+        return 0.0
+    return float(np.dot(va, vb) / denom)
+
+
+def matches(
+    speculative: Optional[Dict[str, Any]],
+    text: str,
+    embedding: Optional[Sequence[float]],
+    min_sim: float = SPECULATIVE_RETRIEVAL_MIN_SIM,
+) -> bool:
+    """True when ``text`` is close enough to the speculated question to reuse its nodes."""
+    if not speculative or speculative.get("nodes") is None:
+        return False
+    if _normalize_for_match(text) == _normalize_for_match(speculative.get("text", "")):
+        return True
+    spec_embedding = speculative.get("embedding")
+    if embedding is None or spec_embedding is None:
+        return False
+    return _cosine(embedding, spec_embedding) >= min_sim
+
+
+def resolve(
+    speculative: Optional[Dict[str, Any]],
+    texts: List[str],
+    embeddings: Dict[str, List[float]],
+) -> Dict[str, List[Any]]:
+    """Map each query in ``texts`` that can reuse the speculative nodes to them, and record the outcome.
+
+    An empty ``texts`` means the route does no retrieval (harm branches), so
+    the speculative work is discarded.
+    """
+    if not speculative:
+        return {}
+    if speculative.get("nodes") is None:
+        _count(failed=1)
+        return {}
+
+    hits = {
+        text: speculative["nodes"]
+        for text in texts
+        if matches(speculative, text, embeddings.get(text))
+    }
+    if not texts:
+        _count(wasted_non_rag=1)
+    elif hits:
+        _count(won=1)
+    else:
+        _count(wasted_miss=1)
+    _count(retrievals_saved=len(hits), retrievals_rerun=len(texts) - len(hits))
+    if hits:
+        logging.info("Speculative retrieval reused for %d/%d queries", len(hits), len(texts))
+    return hits
+
+
+def record_run() -> None:
+    _count(runs=1)
+
+
+def _count(**deltas: int) -> None:
+    with _lock:
+        for key, delta in deltas.items():
+            _counters[key] += delta
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        counters = dict(_counters)
+    decided = counters["won"] + counters["wasted_miss"] + counters["wasted_non_rag"] + counters["failed"]
+    return {
+        **counters,
+        "win_rate": round(counters["won"] / decided, 4) if decided else 0.0,
+        "waste_rate": round((decided - counters["won"]) / decided, 4) if decided else 0.0,
+    }
+
+
+register_metrics("speculative_retrieval", stats)
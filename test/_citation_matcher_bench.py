@@ -0,0 +1,189 @@
+"""Ad-hoc benchmark: batch citation verification vs. the old per-claim scan. Not a fixture.
+
+Builds synthetic grounded answers (default 40 claims x 3 citations over 12
+nodes of ~4000 chars) and runs ``_verify_claims`` — now one CitationMatcher
+per answer — against the old loop, which walked every quote over every node
+with ``in`` and, on a miss, ``partial_ratio``. The batch path runs twice:
+fuzzy matching on candidate windows (CITATION_FUZZY_WINDOWS) and on the
+full node texts. Quotes are a mix of exact substrings (re-cased, re-spaced),
+lightly edited ones (fuzzy hits) and invented ones (misses). Reports timing
+and how often the paths agree on found/not-found and on the matched node.
+
+    python -m test._citation_matcher_bench
+    python -m test._citation_matcher_bench --claims 120 --nodes 20 --answers 10
+    python -m test._citation_matcher_bench --chars 16000
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import statistics
+import time
+from typing import Any, Dict, List, Optional
+
+from llama_index.core import VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import NodeWithScore, TextNode
+from rapidfuzz.fuzz import partial_ratio
+
+import citation_matcher
+from agent_shared import _node_text, _normalize
+from agent_workflow_answer import Citation, Claim, GroundedAnswer, _verify_claims
+from node_artifacts import attach_node_artifacts
+
+
+def _vocabulary(size: int, seed: int = 0) -> tuple:
+    rng = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyzæøå"
+    return tuple("".join(rng.choice(alphabet) for _ in range(rng.randint(2, 10))) for _ in range(size))
+
+
+WORDS = _vocabulary(3000)
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 16))]
+    return " ".join(words).capitalize() + "."
+
+
+def _nodes(rng: random.Random, n: int, chars: int) -> List[NodeWithScore]:
+    out = []
+    for i in range(n):
+        parts: List[str] = []
+        while sum(len(p) + 1 for p in parts) < chars:
+            parts.append(_sentence(rng))
+            if rng.random() < 0.15:
+                parts.append("\n\n")
+        node = TextNode(text=" ".join(parts), id_=f"node-{i}", metadata={"url": f"https://example.org/{i}"})
+        out.append(NodeWithScore(node=node, score=1.0 - i / 100))
+    return out
+
+
+def _quote(rng: random.Random, nodes: List[NodeWithScore]) -> str:
+    kind = rng.random()
+    text = _node_text(rng.choice(nodes))
+    start = rng.randrange(0, max(1, len(text) - 120))
+    quote = text[start:start + rng.randint(30, 110)]
+    if kind < 0.6:
+        # exact, with different case and spacing
+        return "  " + quote.upper().replace(" ", "  ", 2)
+    if kind < 0.85:
+        # edited: a few words swapped out
+        words = quote.split()
+        for _ in range(max(1, len(words) // 8)):
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+        return " ".join(words)
+    return " ".join(rng.choice(("finnes", "ikke", "noe", "sted", "her")) for _ in range(10))
+
+
+def _answer(rng: random.Random, nodes: List[NodeWithScore], claims: int, citations: int) -> GroundedAnswer:
+    return GroundedAnswer(
+        answer="...",
+        short_answer="...",
+        claims=[
+            Claim(
+                claim=f"claim {i}",
+                Citations=[Citation(url="https://example.org", quote=_quote(rng, nodes)) for _ in range(citations)],
+                validity="valid",
+            )
+            for i in range(claims)
+        ],
+    )
+
+
+def _legacy_claim(quotes: List[str], nodes: List[Any], fuzzy_min_ratio: Optional[int]) -> List[Optional[str]]:
+    """The old _verify_citations_per_node: normalize every node, then node by node, exact then fuzzy."""
+    texts = [(nws, _normalize(_node_text(nws))) for nws in nodes]
+    out: List[Optional[str]] = []
+    for quote in quotes:
+        q_norm = _normalize(quote.strip())
+        hit = None
+        for nws, text in texts:
+            if not text:
+                continue
+            if q_norm in text or (fuzzy_min_ratio is not None and partial_ratio(q_norm, text) >= fuzzy_min_ratio):
+                hit = nws.node.node_id
+                break
+        out.append(hit)
+    return out
+
+
+def _legacy(ga: GroundedAnswer, nodes: List[Any], fuzzy_min_ratio: Optional[int]) -> List[List[Optional[str]]]:
+    return [_legacy_claim([c.quote for c in claim.Citations], nodes, fuzzy_min_ratio) for claim in ga.claims]
+
+
+def _batch(ga: GroundedAnswer, nodes: List[Any], fuzzy_min_ratio: Optional[int]) -> List[List[Optional[str]]]:
+    report = _verify_claims(ga, nodes, fuzzy_min_ratio=fuzzy_min_ratio)["claims_report"]
+    out = []
+    for entry in report:
+        row = []
+        for cit in entry["citations_report"]:
+            row.append(cit["matched_node_urls"][0].rsplit("/", 1)[-1] if cit["found_in_nodes"] else None)
+        out.append(row)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--nodes", type=int, default=12)
+    ap.add_argument("--chars", type=int, default=4000)
+    ap.add_argument("--claims", type=int, default=40)
+    ap.add_argument("--citations", type=int, default=3)
+    ap.add_argument("--answers", type=int, default=5)
+    ap.add_argument("--fuzzy", type=int, default=60, help="fuzzy_min_ratio (-1 = exact only)")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    fuzzy = None if args.fuzzy < 0 else args.fuzzy
+
+    rng = random.Random(args.seed)
+    nodes = _nodes(rng, args.nodes, args.chars)
+    # As at index load, so node texts come pre-normalized.
+    index = VectorStoreIndex(
+        nodes=[nws.node for nws in nodes], embed_model=MockEmbedding(embed_dim=8),
+    )
+    attach_node_artifacts("bench", index)
+    answers = [_answer(rng, nodes, args.claims, args.citations) for _ in range(args.answers)]
+
+    windows = citation_matcher.CITATION_FUZZY_WINDOWS
+    legacy_ms, full_ms, batch_ms = [], [], []
+    found_same = node_same = windows_same = total = 0
+    for ga in answers:
+        t0 = time.perf_counter()
+        old = _legacy(ga, nodes, fuzzy)
+        legacy_ms.append((time.perf_counter() - t0) * 1000.0)
+
+        citation_matcher.CITATION_FUZZY_WINDOWS = 0
+        t0 = time.perf_counter()
+        full = _batch(ga, nodes, fuzzy)
+        full_ms.append((time.perf_counter() - t0) * 1000.0)
+
+        citation_matcher.CITATION_FUZZY_WINDOWS = windows
+        t0 = time.perf_counter()
+        new = _batch(ga, nodes, fuzzy)
+        batch_ms.append((time.perf_counter() - t0) * 1000.0)
+
+        for a_row, f_row, b_row in zip(old, full, new):
+            for a, f, b in zip(a_row, f_row, b_row):
+                total += 1
+                # node ids are "node-<i>", urls end in "<i>"
+                a_idx = a.rsplit("-", 1)[-1] if a else None
+                found_same += (a is None) == (b is None)
+                node_same += a_idx == b
+                windows_same += f == b
+
+    print(f"{args.answers} answers x {args.claims} claims x {args.citations} citations, "
+          f"{args.nodes} nodes of ~{args.chars} chars, fuzzy_min_ratio={fuzzy}")
+    for label, ms in (
+        ("per-claim scan", legacy_ms),
+        ("batch, full-text fuzzy", full_ms),
+        (f"batch, {windows} fuzzy windows", batch_ms),
+    ):
+        print(f"{label:<24}: median {statistics.median(ms):9.2f} ms  max {max(ms):9.2f} ms")
+    print(f"speedup vs per-claim (median): {statistics.median(legacy_ms) / max(statistics.median(batch_ms), 1e-9):.1f}x")
+    print(f"per-claim vs batch: same found/not found {found_same}/{total}, same node {node_same}/{total}")
+    print("  (node differences are quotes the old loop matched fuzzily in an earlier node "
+          "although a later node contains them exactly)")
+    print(f"windows vs full-text fuzzy: same outcome {windows_same}/{total}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Ad-hoc benchmark: DenseMatrixRetriever vs. the stock SimpleVectorStore retriever. Not a fixture.
+
+Builds a synthetic index (default 8000 nodes x 3072 dims, the size of
+hvaerinnafor_unified with text-embedding-3-large), or loads a real persisted
+index with --storage, then runs the same query embeddings through both
+retrievers and reports timing plus whether ids/order/scores agree — once
+unfiltered, and once with the related-questions filter (valid == 1,
+severity IN [...], category == ...) at top_k=30.
+
+    python -m test._dense_retriever_bench
+    python -m test._dense_retriever_bench --nodes 2000 --dim 1536 --queries 50
+    python -m test._dense_retriever_bench --storage ./blobstorage/chatbot/hvaerinnafor_unified
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import QueryBundle, TextNode
+from llama_index.core.vector_stores import FilterOperator, MetadataFilter, MetadataFilters
+
+from dense_retriever import DenseEmbeddingMatrix, DenseMatrixRetriever
+
+
+SEVERITIES = ("Green", "Yellow", "Red")
+CATEGORIES = ("Forelskelse", "Prevensjon", "Kropp", "Grenser", "Psykisk helse")
+
+RELATED_FILTERS = MetadataFilters(
+    filters=[
+        MetadataFilter(key="valid", value=1, operator=FilterOperator.EQ),
+        MetadataFilter(key="severity", value=["Green", "Yellow"], operator=FilterOperator.IN),
+        MetadataFilter(key="category", value="Prevensjon", operator=FilterOperator.EQ),
+    ],
+    condition="and",
+)
+
+
+def _synthetic_index(n: int, dim: int, seed: int) -> VectorStoreIndex:
+    rng = np.random.default_rng(seed)
+    emb = rng.standard_normal((n, dim)).astype(np.float32)
+    nodes = [
+        TextNode(
+            text=f"node {i}",
+            embedding=emb[i].tolist(),
+            metadata={
+                "valid": int(rng.random() < 0.9),
+                "severity": SEVERITIES[int(rng.integers(len(SEVERITIES)))],
+                "category": CATEGORIES[int(rng.integers(len(CATEGORIES)))],
+            },
+        )
+        for i in range(n)
+    ]
+    return VectorStoreIndex(nodes=nodes, embed_model=MockEmbedding(embed_dim=dim))
+
+
+def _timed(fn, queries):
+    out, times = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        out.append(fn(q))
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return out, times
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--nodes", type=int, default=8000)
+    ap.add_argument("--dim", type=int, default=3072)
+    ap.add_argument("--queries", type=int, default=20)
+    ap.add_argument("--top-k", type=int, default=5)
+    ap.add_argument("--storage", default=None, help="persist dir of a real index (overrides --nodes/--dim)")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    if args.storage:
+        ctx = StorageContext.from_defaults(persist_dir=args.storage)
+        index = load_index_from_storage(ctx, embed_model=MockEmbedding(embed_dim=args.dim))
+    else:
+        index = _synthetic_index(args.nodes, args.dim, args.seed)
+    print(f"index ready in {time.perf_counter() - t0:.2f}s")
+
+    t0 = time.perf_counter()
+    matrix = DenseEmbeddingMatrix.from_index(index)
+    print(f"dense matrix {matrix.size} x {matrix.dim} ({matrix.matrix.nbytes / 1e6:.1f} MB) "
+          f"built in {time.perf_counter() - t0:.2f}s")
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = [QueryBundle(query_str="q", embedding=rng.standard_normal(matrix.dim).tolist())
+               for _ in range(args.queries)]
+
+    for label, kwargs in (
+        ("unfiltered", {"similarity_top_k": args.top_k}),
+        ("related filter", {"similarity_top_k": 30, "filters": RELATED_FILTERS}),
+    ):
+        stock = index.as_retriever(**kwargs)
+        dense = DenseMatrixRetriever(index, matrix, **kwargs)
+
+        stock_res, stock_ms = _timed(stock.retrieve, queries)
+        dense_res, dense_ms = _timed(dense.retrieve, queries)
+
+        same_ids = 0
+        max_delta = 0.0
+        for a, b in zip(stock_res, dense_res):
+            if [n.node.node_id for n in a] == [n.node.node_id for n in b]:
+                same_ids += 1
+            for x, y in zip(a, b):
+                max_delta = max(max_delta, abs((x.score or 0.0) - (y.score or 0.0)))
+
+        print(f"--- {label} (top_k={kwargs['similarity_top_k']})")
+        print(f"stock  retriever: median {statistics.median(stock_ms):8.2f} ms  max {max(stock_ms):8.2f} ms")
+        print(f"dense  retriever: median {statistics.median(dense_ms):8.2f} ms  max {max(dense_ms):8.2f} ms")
+        print(f"speedup (median): {statistics.median(stock_ms) / max(statistics.median(dense_ms), 1e-9):.1f}x")
+        print(f"identical ids/order: {same_ids}/{len(queries)}   max |score delta|: {max_delta:.2e}")
+
+
+if __name__ == "__main__":
+    main()
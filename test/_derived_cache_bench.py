@@ -0,0 +1,130 @@
+"""Ad-hoc benchmark: derived index data rebuilt vs. read back from derived_cache. Not a fixture.
+
+Persists a synthetic index (default 2000 nodes x 256 dims), or takes a real
+persisted index with --storage, and then, each in a fresh process, loads it
+and times what is derived from it:
+
+  artifacts — ``attach_node_artifacts`` (normalized text, token counts, grams);
+  catalog   — the /categories and /documents lists (``index_catalog``).
+
+(The /examples pools go through the same cache, but answer_utils needs the
+LLM settings of config to import, so they are left out here.)
+
+The first run ("cold") starts without <storage>/.derived/ and builds and
+writes everything; the next ones ("warm") read it back under the same
+fingerprint. Then one character of the docstore is changed in place (same
+node ids, same file size) and the fingerprint is checked to change. Finally
+the synthetic index is rebuilt with one more node, and the fingerprint is
+checked to change and the old directory to be dropped.
+
+    python -m test._derived_cache_bench
+    python -m test._derived_cache_bench --nodes 8000 --repeat 3
+    python -m test._derived_cache_bench --storage ./blobstorage/chatbot/hvaerinnafor_qa_bank
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _child(storage: str, dim: int) -> None:
+    from llama_index.core import Settings, StorageContext, load_index_from_storage
+    from llama_index.core.embeddings import MockEmbedding
+
+    import derived_cache
+    import index_catalog
+    from node_artifacts import attach_node_artifacts
+
+    Settings.embed_model = MockEmbedding(embed_dim=dim)
+    index = load_index_from_storage(StorageContext.from_defaults(persist_dir=storage))
+    t0 = time.perf_counter()
+    fp = derived_cache.register(index, storage)
+    t1 = time.perf_counter()
+    attach_node_artifacts("bench", index)
+    t2 = time.perf_counter()
+    index_catalog.documents(index)
+    t3 = time.perf_counter()
+    print(json.dumps({
+        "fingerprint": fp,
+        "fingerprint_s": t1 - t0,
+        "artifacts_s": t2 - t1,
+        "catalog_s": t3 - t2,
+        "stats": derived_cache.stats(),
+    }))
+
+
+def _run(storage: str, dim: int) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-m", "test._derived_cache_bench", "--child", "--storage", storage, "--dim", str(dim)],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--storage", help="persisted index dir (its .derived/ is rewritten)")
+    ap.add_argument("--nodes", type=int, default=2000)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--chars", type=int, default=1500)
+    ap.add_argument("--repeat", type=int, default=2)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        _child(args.storage, args.dim)
+        return
+
+    import derived_cache
+    from test._index_snapshot_bench import _persist_synthetic
+
+    tmp = None
+    storage = args.storage
+    if storage is None:
+        tmp = tempfile.TemporaryDirectory()
+        storage = tmp.name
+        _persist_synthetic(storage, args.nodes, args.dim, args.chars, args.seed)
+    derived_root = os.path.join(storage, derived_cache.DERIVED_DIR)
+    shutil.rmtree(derived_root, ignore_errors=True)
+
+    keys = ("fingerprint_s", "artifacts_s", "catalog_s")
+    runs = {"cold": [_run(storage, args.dim)], "warm": [_run(storage, args.dim) for _ in range(args.repeat)]}
+    print(f"fingerprint {runs['cold'][0]['fingerprint']}")
+    print(f"{'':<5} " + " ".join(f"{k[:-2]:>12}" for k in keys) + f" {'total s':>9}")
+    for mode, rows in runs.items():
+        med = {k: statistics.median(r[k] for r in rows) for k in keys}
+        print(f"{mode:<5} " + " ".join(f"{med[k]:12.3f}" for k in keys) + f" {sum(med.values()):9.3f}")
+    assert all(r["fingerprint"] == runs["cold"][0]["fingerprint"] for r in runs["warm"])
+    assert all(r["stats"]["misses"] == 0 for r in runs["warm"]), "warm run rebuilt something"
+
+    if tmp is not None:
+        # An equal-length text fix mid-docstore: new fingerprint.
+        docstore = os.path.join(storage, "docstore.json")
+        with open(docstore, "r+b") as f:
+            raw = f.read()
+            at = raw.index(b'"text": "', len(raw) // 2) + len(b'"text": "')
+            f.seek(at)
+            f.write(b"Y" if raw[at:at + 1] != b"Y" else b"Z")
+        edited = _run(storage, args.dim)
+        assert edited["fingerprint"] != runs["cold"][0]["fingerprint"], "in-place docstore edit kept the fingerprint"
+        print(f"after in-place docstore edit: fingerprint {edited['fingerprint']}")
+
+        # A rebuilt index: new fingerprint, the old derived data is dropped.
+        _persist_synthetic(storage, args.nodes + 1, args.dim, args.chars, args.seed)
+        changed = _run(storage, args.dim)
+        assert changed["fingerprint"] != runs["cold"][0]["fingerprint"]
+        assert os.listdir(derived_root) == [changed["fingerprint"]]
+        print(f"after rebuild: fingerprint {changed['fingerprint']}, old derived data removed")
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Ad-hoc benchmark: loading an index from its JSON files vs. from index_snapshot. Not a fixture.
+
+Persists a synthetic index (default 2000 nodes x 3072 dims, ~1500 chars of
+text each), or takes a real persisted index with --storage, converts it
+with ``index_snapshot.convert`` and then loads it both ways, each in a fresh
+process so RSS is not shared between runs:
+
+  json      — ``load_index_from_storage`` + ``DenseEmbeddingMatrix.from_index``
+              (what config did before snapshots);
+  snapshot  — ``index_snapshot.load_snapshot`` (index + prebuilt matrix).
+
+For each it reports the time and RSS growth (current and peak, from
+/proc/self/status) until the index and matrix are ready, and again after
+materializing ``docstore.docs`` (what attach_node_artifacts does at load).
+
+    python -m test._index_snapshot_bench
+    python -m test._index_snapshot_bench --nodes 8000 --repeat 3
+    python -m test._index_snapshot_bench --storage ./blobstorage/chatbot/hvaerinnafor_unified
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+import numpy as np
+
+
+def _rss_mb() -> Dict[str, float]:
+    out = {}
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                key, value = line.split(":", 1)
+                out[key] = int(value.split()[0]) / 1024.0
+    return {"rss": out["VmRSS"], "peak": out["VmHWM"]}
+
+
+def _child(mode: str, storage: str, dim: int) -> None:
+    from llama_index.core import Settings, StorageContext, load_index_from_storage
+    from llama_index.core.embeddings import MockEmbedding
+
+    import index_snapshot
+    from dense_retriever import DenseEmbeddingMatrix
+
+    # load_index_from_storage resolves Settings.embed_model; keep it offline.
+    Settings.embed_model = MockEmbedding(embed_dim=dim)
+    base = _rss_mb()
+    t0 = time.perf_counter()
+    if mode == "json":
+        index = load_index_from_storage(StorageContext.from_defaults(persist_dir=storage))
+        matrix = DenseEmbeddingMatrix.from_index(index)
+    else:
+        index, matrix = index_snapshot.load_snapshot(storage)
+    ready = time.perf_counter() - t0
+    at_ready = _rss_mb()
+    docs = index.docstore.docs
+    with_docs = time.perf_counter() - t0
+    at_docs = _rss_mb()
+    print(json.dumps({
+        "ready_s": ready,
+        "docs_s": with_docs,
+        "ready_rss": at_ready["rss"] - base["rss"],
+        "docs_rss": at_docs["rss"] - base["rss"],
+        "peak": at_docs["peak"] - base["rss"],
+        "nodes": len(docs),
+        "rows": matrix.size,
+    }))
+
+
+def _persist_synthetic(path: str, n: int, dim: int, chars: int, seed: int) -> None:
+    from llama_index.core import VectorStoreIndex
+    from llama_index.core.embeddings import MockEmbedding
+    from llama_index.core.schema import TextNode
+
+    rng = np.random.default_rng(seed)
+    words = ["prevensjon", "kropp", "forelskelse", "grenser", "følelser", "venner", "skole", "helse", "spørsmål"]
+    nodes = []
+    for i in range(n):
+        text = " ".join(rng.choice(words, size=chars // 9))[:chars]
+        nodes.append(TextNode(
+            text=text,
+            embedding=rng.standard_normal(dim).astype(np.float32).tolist(),
+            metadata={"url": f"https://example.org/{i}", "title": f"Artikkel {i}", "category": "Kropp", "valid": 1},
+        ))
+    VectorStoreIndex(nodes=nodes, embed_model=MockEmbedding(embed_dim=dim)).storage_context.persist(path)
+
+
+def _dir_mb(path: str) -> float:
+    return sum(
+        os.path.getsize(os.path.join(path, name))
+        for name in os.listdir(path)
+        if os.path.isfile(os.path.join(path, name))
+    ) / 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--storage", help="persisted index dir (a snapshot is written into it)")
+    ap.add_argument("--nodes", type=int, default=2000)
+    ap.add_argument("--dim", type=int, default=3072)
+    ap.add_argument("--chars", type=int, default=1500)
+    ap.add_argument("--repeat", type=int, default=2)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--child", choices=("json", "snapshot"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        _child(args.child, args.storage, args.dim)
+        return
+
+    import index_snapshot
+
+    tmp = None
+    storage = args.storage
+    if storage is None:
+        tmp = tempfile.TemporaryDirectory()
+        storage = tmp.name
+        t0 = time.perf_counter()
+        _persist_synthetic(storage, args.nodes, args.dim, args.chars, args.seed)
+        print(f"synthetic index persisted in {time.perf_counter() - t0:.1f}s")
+
+    t0 = time.perf_counter()
+    manifest = index_snapshot.convert(storage)
+    print(f"converted in {time.perf_counter() - t0:.1f}s: {manifest['vectors']} vectors x {manifest['dim']}, "
+          f"{manifest['nodes']} nodes; JSON files {_dir_mb(storage):.0f} MB, "
+          f"snapshot {_dir_mb(os.path.join(storage, index_snapshot.SNAPSHOT_DIR)):.0f} MB")
+
+    dim = manifest["dim"] or args.dim
+    results: Dict[str, list] = {"json": [], "snapshot": []}
+    for _ in range(args.repeat):
+        for mode in results:
+            out = subprocess.run(
+                [sys.executable, "-m", "test._index_snapshot_bench", "--child", mode,
+                 "--storage", storage, "--dim", str(dim)],
+                capture_output=True, text=True, check=True,
+            )
+            results[mode].append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{'':<9} {'ready s':>8} {'+docs s':>8} {'ready MB':>9} {'+docs MB':>9} {'peak MB':>8}")
+    for mode, runs in results.items():
+        med = {k: statistics.median(r[k] for r in runs) for k in ("ready_s", "docs_s", "ready_rss", "docs_rss", "peak")}
+        print(f"{mode:<9} {med['ready_s']:8.2f} {med['docs_s']:8.2f} {med['ready_rss']:9.0f} "
+              f"{med['docs_rss']:9.0f} {med['peak']:8.0f}")
+    j, s = results["json"], results["snapshot"]
+    print(f"ready: {statistics.median(r['ready_s'] for r in j) / max(statistics.median(r['ready_s'] for r in s), 1e-9):.1f}x "
+          f"faster, {statistics.median(r['ready_rss'] for r in j) / max(statistics.median(r['ready_rss'] for r in s), 1e-9):.1f}x "
+          f"less memory (RSS growth)")
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Deterministic smoke for PooledChatModel routing, ejection and probing. Not a fixture.
+
+Three stub deployments share a fake clock, so "latency" is whatever each stub
+advances the clock by; nothing sleeps and every run gives the same result:
+
+  * "a" is slow (300 ms), "b" is fast (50 ms), "c" is medium (120 ms);
+  * after warm-up, calls must go to "b";
+  * "b" then starts failing with 503: the call fails over, "b" is ejected and
+    traffic moves to "c";
+  * once the cooldown has passed, exactly one probe goes to "b". A failed
+    probe doubles the cooldown; a successful one readmits "b";
+  * a 400 from a deployment is raised to the caller without ejecting it;
+  * the same checks run through with_structured_output() and ainvoke().
+
+    python -m test._llm_pool_smoke
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from typing import Any, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+from pydantic import BaseModel
+
+import llm_pool
+from llm_pool import PooledChatModel
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+CLOCK = _Clock()
+SERVED: List[str] = []
+
+
+class _StatusError(Exception):
+    def __init__(self, status_code: int) -> None:
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class _StubDeployment(BaseChatModel):
+    name_: str
+    latency_s: float
+    fail_with: Optional[int] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        CLOCK.now += self.latency_s
+        SERVED.append(self.name_)
+        if self.fail_with is not None:
+            raise _StatusError(self.fail_with)
+        msg = AIMessage(
+            content='{"answer": "%s"}' % self.name_,
+            usage_metadata={"input_tokens": 10, "output_tokens": 2, "total_tokens": 12},
+        )
+        return ChatResult(generations=[ChatGeneration(message=msg)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return self._generate(messages, stop, run_manager, **kwargs)
+
+    def with_structured_output(self, schema: Any, **kwargs: Any):
+        return self | RunnableLambda(lambda m: schema.model_validate_json(m.content))
+
+
+class _Answer(BaseModel):
+    answer: str
+
+
+def _build() -> tuple[PooledChatModel, dict[str, _StubDeployment]]:
+    stubs = {
+        "a": _StubDeployment(name_="a", latency_s=0.300),
+        "b": _StubDeployment(name_="b", latency_s=0.050),
+        "c": _StubDeployment(name_="c", latency_s=0.120),
+    }
+    pool = llm_pool.build_pool("smoke", list(stubs.values()), list(stubs))
+    pool._clock = CLOCK
+    return pool, stubs
+
+
+def _check(label: str, cond: bool) -> None:
+    print(("ok   " if cond else "FAIL ") + label)
+    if not cond:
+        raise SystemExit(1)
+
+
+def run_sync() -> None:
+    pool, stubs = _build()
+    served = SERVED
+    served.clear()
+
+    # Warm-up: every member is tried once, then the fastest wins.
+    for _ in range(3):
+        pool.invoke("hei")
+    _check("warm-up touches every member once", sorted(served) == ["a", "b", "c"])
+    served.clear()
+    for _ in range(5):
+        pool.invoke("hei")
+    _check("routes to the fastest member", Counter(served) == Counter({"b": 5}))
+
+    # b fails: the call still succeeds (failover), b is ejected.
+    stubs["b"].fail_with = 503
+    served.clear()
+    out = pool.invoke("hei")
+    _check("failover answers from another member", out.content == '{"answer": "c"}')
+    _check("failed member is ejected", not pool.stats()["b"]["healthy"])
+    served.clear()
+    for _ in range(3):
+        pool.invoke("hei")
+    _check("ejected member gets no traffic", "b" not in served)
+
+    # After the cooldown: one probe. It fails -> longer cooldown.
+    CLOCK.now += llm_pool.POOL_EJECT_S + 1
+    served.clear()
+    pool.invoke("hei")
+    _check("probe is sent after cooldown", served[0] == "b")
+    _check("failed probe keeps it ejected", not pool.stats()["b"]["healthy"])
+
+    # Recovers; the next probe readmits it.
+    stubs["b"].fail_with = None
+    CLOCK.now += 2 * llm_pool.POOL_EJECT_S + 1
+    served.clear()
+    pool.invoke("hei")
+    _check("successful probe readmits", served == ["b"] and pool.stats()["b"]["healthy"])
+
+    # Caller errors are not the deployment's fault.
+    stubs["b"].fail_with = 400
+    try:
+        pool.invoke("hei")
+        _check("400 is raised to the caller", False)
+    except _StatusError:
+        _check("400 is raised to the caller", True)
+    _check("400 does not eject", pool.stats()["b"]["healthy"])
+    stubs["b"].fail_with = None
+
+    structured = pool.with_structured_output(_Answer)
+    _check("with_structured_output routes too", structured.invoke("hei").answer == "b")
+
+    # Everything failing: the last error surfaces.
+    for stub in stubs.values():
+        stub.fail_with = 503
+    try:
+        pool.invoke("hei")
+        _check("all-down raises", False)
+    except _StatusError:
+        _check("all-down raises", True)
+
+
+async def run_async() -> None:
+    pool, stubs = _build()
+    for _ in range(4):
+        await pool.ainvoke("hei")
+    stubs["b"].fail_with = 503
+    out = await pool.ainvoke("hei")
+    _check("async failover", out.content == '{"answer": "c"}')
+    structured = pool.with_structured_output(_Answer)
+    _check("async structured", (await structured.ainvoke("hei")).answer == "c")
+
+
+if __name__ == "__main__":
+    run_sync()
+    asyncio.run(run_async())
+    print(llm_pool.stats())
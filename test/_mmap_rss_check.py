@@ -0,0 +1,148 @@
+"""Ad-hoc check: per-worker memory of snapshot indexes, read into memory vs. memory-mapped. Not a fixture.
+
+Persists a synthetic index (default 2000 nodes x 3072 dims), or takes a
+real persisted index with --storage, converts it with index_snapshot and
+then starts 1 and 4 worker processes per mode, like Hypercorn workers each
+loading the index on their own:
+
+  copy  — INDEX_SNAPSHOT_MMAP=false: arrays read into each worker's memory;
+  mmap  — INDEX_SNAPSHOT_MMAP=true: arrays mapped from the page cache.
+
+Every worker loads the snapshot, runs a few retrievals (touching every
+matrix row) and materializes ``docstore.docs`` (touching every text), then
+waits while the parent reads /proc/<pid>/smaps_rollup. Reported per worker,
+as growth over the worker's own baseline after imports:
+
+  USS — private (unique) memory, what each extra worker costs;
+  PSS — shared pages divided among the workers that map them.
+
+With mmap, USS stays flat from 1 to 4 workers (the pages are shared;
+with a single worker they still count as private), while with copy every
+worker holds its own matrix.
+
+    python -m test._mmap_rss_check
+    python -m test._mmap_rss_check --nodes 4000 --workers 1,2,4
+    python -m test._mmap_rss_check --storage ./blobstorage/chatbot/hvaerinnafor_unified
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+
+def _smaps(pid: str = "self") -> Dict[str, float]:
+    """USS / PSS / RSS of a process in MB."""
+    fields: Dict[str, float] = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1]) / 1024.0
+    return {
+        "uss": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0),
+        "pss": fields.get("Pss", 0.0),
+        "rss": fields.get("Rss", 0.0),
+    }
+
+
+def _worker(storage: str, dim: int) -> None:
+    from llama_index.core import Settings
+    from llama_index.core.embeddings import MockEmbedding
+    from llama_index.core.schema import QueryBundle
+
+    import index_snapshot
+    from dense_retriever import DenseMatrixRetriever
+
+    Settings.embed_model = MockEmbedding(embed_dim=dim)
+    base = _smaps()
+    index, matrix = index_snapshot.load_snapshot(storage)
+    rng = np.random.default_rng(os.getpid())
+    retriever = DenseMatrixRetriever(index, matrix, similarity_top_k=5)
+    for _ in range(5):
+        retriever.retrieve(QueryBundle("q", embedding=rng.standard_normal(matrix.dim).tolist()))
+    docs = index.docstore.docs
+    print(json.dumps({"base": base, "nodes": len(docs)}), flush=True)
+    del docs
+    sys.stdin.readline()
+
+
+def _run(storage: str, dim: int, workers: int, mmap: bool) -> List[Dict[str, float]]:
+    env = dict(os.environ, INDEX_SNAPSHOT_MMAP="true" if mmap else "false")
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "test._mmap_rss_check", "--worker", "--storage", storage, "--dim", str(dim)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env,
+        )
+        for _ in range(workers)
+    ]
+    try:
+        bases = [json.loads(p.stdout.readline())["base"] for p in procs]
+        # All workers are loaded before any is measured, so PSS splits shared pages among them.
+        out = []
+        for p, base in zip(procs, bases):
+            now = _smaps(str(p.pid))
+            out.append({k: now[k] - base[k] for k in now})
+        return out
+    finally:
+        for p in procs:
+            try:
+                p.stdin.write("\n")
+                p.stdin.flush()
+            except OSError:
+                pass
+            p.wait()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--storage", help="persisted index dir (a snapshot is written into it)")
+    ap.add_argument("--nodes", type=int, default=2000)
+    ap.add_argument("--dim", type=int, default=3072)
+    ap.add_argument("--chars", type=int, default=1500)
+    ap.add_argument("--workers", default="1,4")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        _worker(args.storage, args.dim)
+        return
+
+    import index_snapshot
+    from test._index_snapshot_bench import _dir_mb, _persist_synthetic
+
+    tmp = None
+    storage = args.storage
+    if storage is None:
+        tmp = tempfile.TemporaryDirectory()
+        storage = tmp.name
+        t0 = time.perf_counter()
+        _persist_synthetic(storage, args.nodes, args.dim, args.chars, args.seed)
+        print(f"synthetic index persisted in {time.perf_counter() - t0:.1f}s")
+    manifest = index_snapshot.convert(storage)
+    print(f"snapshot: {manifest['vectors']} vectors x {manifest['dim']}, {manifest['nodes']} nodes, "
+          f"{_dir_mb(os.path.join(storage, index_snapshot.SNAPSHOT_DIR)):.0f} MB on disk")
+
+    dim = manifest["dim"] or args.dim
+    print(f"{'mode':<5} {'workers':>7} {'USS/worker MB':>14} {'PSS/worker MB':>14} {'RSS/worker MB':>14} {'USS total MB':>13}")
+    for mmap in (False, True):
+        for workers in (int(w) for w in args.workers.split(",")):
+            rows = _run(storage, dim, workers, mmap)
+            med = {k: statistics.median(r[k] for r in rows) for k in ("uss", "pss", "rss")}
+            print(f"{'mmap' if mmap else 'copy':<5} {workers:>7} {med['uss']:14.1f} {med['pss']:14.1f} "
+                  f"{med['rss']:14.1f} {sum(r['uss'] for r in rows):13.1f}")
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
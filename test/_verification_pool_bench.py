@@ -0,0 +1,119 @@
+"""Ad-hoc benchmark: effect of claim verification on other streams' token latency. Not a fixture.
+
+Runs S simulated token streams on one event loop (each "emits" a token
+every --interval ms and records how late it wakes up) while V coroutines
+verify synthetic grounded answers back to back. Three modes:
+
+  loop    — ``_agrounded_claims_report`` with the pool off (the async
+            graph without a pool: matching runs in worker threads);
+  thread  — ``_grounded_claims_report`` via asyncio.to_thread, pool off
+            (the sync graph: a worker thread sharing the GIL);
+  pool    — ``_agrounded_claims_report`` with VERIFY_POOL_WORKERS workers.
+
+Reports token lateness percentiles and verification throughput per mode.
+
+    python -m test._verification_pool_bench
+    python -m test._verification_pool_bench --workers 4 --verifiers 6 --chars 8000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import List
+
+from llama_index.core import VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+
+import citation_matcher
+import verification_pool
+from agent_workflow_answer import _agrounded_claims_report, _grounded_claims_report
+from node_artifacts import attach_node_artifacts
+from test._citation_matcher_bench import _answer, _nodes
+
+
+def _pct(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+async def _stream(interval_s: float, stop: asyncio.Event, lags: List[float]) -> None:
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(interval_s)
+        lags.append((time.perf_counter() - t0 - interval_s) * 1000.0)
+
+
+async def _verifier(mode: str, answers, nodes, rounds: int, done: List[float]) -> None:
+    for i in range(rounds):
+        ga = answers[i % len(answers)]
+        t0 = time.perf_counter()
+        if mode == "thread":
+            await asyncio.to_thread(_grounded_claims_report, ga, nodes)
+        else:
+            await _agrounded_claims_report(ga, nodes)
+        done.append((time.perf_counter() - t0) * 1000.0)
+
+
+async def _run(mode: str, args, answers, nodes) -> None:
+    verification_pool.VERIFY_POOL_WORKERS = args.workers if mode == "pool" else 0
+    stop = asyncio.Event()
+    lags: List[float] = []
+    done: List[float] = []
+    streams = [asyncio.create_task(_stream(args.interval / 1000.0, stop, lags)) for _ in range(args.streams)]
+    await asyncio.sleep(0.2)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_verifier(mode, answers, nodes, args.rounds, done) for _ in range(args.verifiers)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await asyncio.gather(*streams)
+
+    print(f"{mode:<7} token lateness ms: p50 {_pct(lags, 0.5):7.2f}  p95 {_pct(lags, 0.95):7.2f}  "
+          f"p99 {_pct(lags, 0.99):7.2f}  max {max(lags):7.2f}   "
+          f"verification: {len(done) / elapsed:6.1f} answers/s, median {statistics.median(done):7.1f} ms")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--streams", type=int, default=20)
+    ap.add_argument("--interval", type=float, default=20.0, help="ms between tokens")
+    ap.add_argument("--verifiers", type=int, default=4, help="concurrent verifications")
+    ap.add_argument("--rounds", type=int, default=8, help="answers per verifier")
+    ap.add_argument("--nodes", type=int, default=12)
+    ap.add_argument("--chars", type=int, default=4000)
+    ap.add_argument("--claims", type=int, default=40)
+    ap.add_argument("--full-text", action="store_true", help="fuzzy on full node texts (CITATION_FUZZY_WINDOWS=0)")
+    ap.add_argument("--modes", default="loop,thread,pool")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    if args.full_text:
+        citation_matcher.CITATION_FUZZY_WINDOWS = 0
+    rng = random.Random(args.seed)
+    nodes = _nodes(rng, args.nodes, args.chars)
+    index = VectorStoreIndex(nodes=[nws.node for nws in nodes], embed_model=MockEmbedding(embed_dim=8))
+    attach_node_artifacts("bench", index)
+    answers = [_answer(rng, nodes, args.claims, 3) for _ in range(4)]
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    if "pool" in modes:
+        verification_pool.VERIFY_POOL_WORKERS = args.workers
+        t0 = time.perf_counter()
+        verification_pool.start()
+        while not verification_pool.stats()["current"]:
+            time.sleep(0.05)
+        print(f"pool of {args.workers} workers ready in {time.perf_counter() - t0:.2f}s")
+
+    print(f"{args.streams} streams every {args.interval:.0f} ms, {args.verifiers} concurrent verifications x "
+          f"{args.rounds}, {args.claims} claims x 3 citations over {args.nodes} nodes of ~{args.chars} chars"
+          f"{' (full-text fuzzy)' if args.full_text else ''}")
+    for mode in modes:
+        asyncio.run(_run(mode, args, answers, nodes))
+    print(verification_pool.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# verification_pool.py
+"""Optional process pool for fuzzy citation matching.
+
+Fuzzy matching (``CitationMatcher._match_fuzzy``) is the CPU-heavy part of
+claim verification. It runs on a worker thread that shares the GIL with
+everything else. Either way, several subquery workers verifying at once hold up
+token streaming for every other connection. With VERIFY_POOL_WORKERS > 0
+the misses of a large enough answer go to a pool of worker processes
+instead:
+
+  * the corpus is shipped once per worker, not per call. When the pool
+    starts, every worker receives the normalized text and word grams of
+    all loaded nodes (``node_artifacts.export_corpus``) through the pool
+    initializer. A task carries only node ids, the missed quotes and the
+    ratio, and returns {quote: node index or None};
+  * answers with fewer than VERIFY_POOL_MIN_PAIRS (missed quote, node)
+    pairs stay in-process. Shipping costs more than it saves there;
+  * the pool is rebuilt in the background when the node tables change
+    (an index is reloaded). Until the new pool is warm, and whenever a
+    node is not in the shipped corpus, matching runs in-process. A broken
+    pool (crashed worker) falls back the same way and is rebuilt;
+  * a task is waited for at most VERIFY_POOL_TIMEOUT_S, and never past the
+    request's deadline. A hung or overloaded worker means in-process
+    matching, not a stuck request.
+
+Workers are spawned, not forked (forking a process with live threads can
+inherit held locks), so each one imports this module's dependencies and
+holds its own copy of the corpus. Counters are published in ``metrics``
+under "verification_pool".
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+import deadlines
+import node_artifacts
+from metrics import register_metrics
+
+
+VERIFY_POOL_WORKERS = int(os.getenv("VERIFY_POOL_WORKERS", "0") or 0)
+VERIFY_POOL_MIN_PAIRS = int(os.getenv("VERIFY_POOL_MIN_PAIRS", "48") or 0)
+VERIFY_POOL_TIMEOUT_S = float(os.getenv("VERIFY_POOL_TIMEOUT_S", "5") or 0)
+
+_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_generation = -1
+_rebuilding = False
+_counters: Dict[str, int] = {
+    "offloaded": 0,
+    "in_process": 0,  # below VERIFY_POOL_MIN_PAIRS
+    "fallbacks": 0,   # pool not ready, node not shipped, or task failed / timed out
+    "timeouts": 0,
+    "restarts": 0,
+}
+
+
+# ---------- worker process ----------
+
+_corpus: Dict[str, Tuple[str, Any]] = {}
+
+
+def _init_worker(corpus: Dict[str, Tuple[str, bytes, bytes]]) -> None:
+    global _corpus
+    _corpus = {
+        key: (norm, node_artifacts.NodeGrams.from_bytes(keys, offsets))
+        for key, (norm, keys, offsets) in corpus.items()
+    }
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _fuzzy_task(node_ids: List[str], misses: List[str], fuzzy_min_ratio: int) -> Optional[Dict[str, Optional[int]]]:
+    from citation_matcher import CitationMatcher
+
+    entries = [_corpus.get(key) for key in node_ids]
+    if any(entry is None for entry in entries):
+        return None
+    matcher = CitationMatcher.from_texts(
+        [norm for norm, _ in entries],
+        [grams for _, grams in entries],
+        fuzzy_min_ratio=fuzzy_min_ratio,
+    )
+    matcher._match_fuzzy(misses)
+    return {q_norm: matcher._resolved.get(q_norm) for q_norm in misses}
+
+
+# ---------- server process ----------
+
+def _rebuild() -> None:
+    """Start a pool with the current corpus, warm its workers, then swap it in."""
+    global _pool, _pool_generation, _rebuilding
+    started = time.time()
+    new_pool: Optional[ProcessPoolExecutor] = None
+    try:
+        gen, corpus = node_artifacts.export_corpus()
+        new_pool = ProcessPoolExecutor(
+            max_workers=VERIFY_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(corpus,),
+        )
+        # Spawning and unpickling the corpus happen here, not on a request.
+        for f in [new_pool.submit(_ping) for _ in range(VERIFY_POOL_WORKERS)]:
+            f.result()
+        with _lock:
+            old, _pool, _pool_generation = _pool, new_pool, gen
+            _counters["restarts"] += 1
+        new_pool = None
+        if old is not None:
+            old.shutdown(wait=False, cancel_futures=True)
+        logging.info(
+            "Verification pool ready: %d workers, %d nodes shipped in %.2fs",
+            VERIFY_POOL_WORKERS, len(corpus), time.time() - started,
+        )
+    except Exception:
+        logging.exception("Could not start the verification pool; verifying in-process")
+        if new_pool is not None:
+            new_pool.shutdown(wait=False, cancel_futures=True)
+    finally:
+        with _lock:
+            _rebuilding = False
+
+
+def _schedule_rebuild() -> None:
+    global _rebuilding
+    with _lock:
+        if _rebuilding:
+            return
+        _rebuilding = True
+    threading.Thread(target=_rebuild, name="verification-pool", daemon=True).start()
+
+
+def start() -> None:
+    """Build the pool in the background (no-op unless VERIFY_POOL_WORKERS > 0). Call after indexes load."""
+    if VERIFY_POOL_WORKERS > 0:
+        _schedule_rebuild()
+
+
+def _discard(pool: ProcessPoolExecutor) -> None:
+    global _pool, _pool_generation
+    with _lock:
+        if _pool is pool:
+            _pool, _pool_generation = None, -1
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_fuzzy(nodes: List[Any], misses: List[str], fuzzy_min_ratio: int) -> Optional[Future]:
+    """Send one answer's fuzzy pass to the pool; None means run it in-process."""
+    if VERIFY_POOL_WORKERS <= 0 or not misses:
+        return None
+    if len(misses) * len(nodes) < VERIFY_POOL_MIN_PAIRS:
+        with _lock:
+            _counters["in_process"] += 1
+        return None
+
+    with _lock:
+        pool, gen = _pool, _pool_generation
+    if pool is None or gen != node_artifacts.generation():
+        _schedule_rebuild()
+        pool = None
+    # Workers hold the newest table's entry per node id; a node whose text
+    # differs from it (a request still on a reloaded index) stays in-process.
+    if pool is None or any(node_artifacts.table_entry(n, newest_only=True) is None for n in nodes):
+        with _lock:
+            _counters["fallbacks"] += 1
+        return None
+
+    try:
+        future = pool.submit(_fuzzy_task, [node_artifacts.node_key(n) for n in nodes], misses, fuzzy_min_ratio)
+    except (BrokenProcessPool, RuntimeError) as e:
+        logging.warning("Verification pool unusable (%s); verifying in-process", e)
+        _discard(pool)
+        with _lock:
+            _counters["fallbacks"] += 1
+        return None
+    with _lock:
+        _counters["offloaded"] += 1
+    future.add_done_callback(lambda f: _on_done(f, pool))
+    return future
+
+
+def _on_done(future: Future, pool: ProcessPoolExecutor) -> None:
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        _discard(pool)
+
+
+def _failed(e: BaseException) -> None:
+    logging.warning("Verification pool task failed (%s); verifying in-process", e)
+    with _lock:
+        _counters["fallbacks"] += 1
+
+
+def _wait_budget() -> Optional[float]:
+    """How long to wait for a task: VERIFY_POOL_TIMEOUT_S, cut to the request's remaining budget."""
+    cap = VERIFY_POOL_TIMEOUT_S if VERIFY_POOL_TIMEOUT_S > 0 else None
+    left = deadlines.remaining()
+    if left is None:
+        return cap
+    left = max(0.0, left)
+    return left if cap is None else min(cap, left)
+
+
+def _timed_out(future: Future, waited: Optional[float]) -> None:
+    future.cancel()
+    logging.warning("Verification pool task not done after %.1fs; verifying in-process", waited or 0.0)
+    with _lock:
+        _counters["timeouts"] += 1
+        _counters["fallbacks"] += 1
+
+
+def result(future: Future) -> Optional[Dict[str, Optional[int]]]:
+    """The task's {quote: node index} (None = run in-process), blocking this thread only."""
+    timeout = _wait_budget()
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        _timed_out(future, timeout)
+        return None
+    except Exception as e:
+        _failed(e)
+        return None
+
+
+async def aresult(future: Future) -> Optional[Dict[str, Optional[int]]]:
+    """``result`` without blocking the event loop."""
+    timeout = _wait_budget()
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        _timed_out(future, timeout)
+        return None
+    except Exception as e:
+        _failed(e)
+        return None
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        out: Dict[str, Any] = dict(_counters)
+        out["ready"] = _pool is not None
+        out["current"] = _pool is not None and _pool_generation == node_artifacts.generation()
+    out["workers"] = VERIFY_POOL_WORKERS
+    out["min_pairs"] = VERIFY_POOL_MIN_PAIRS
+    return out
+
+
+register_metrics("verification_pool", stats)